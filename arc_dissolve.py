@@ -0,0 +1,155 @@
+import hashlib
+import json
+import logging
+import math
+from collections import OrderedDict
+from typing import List, Dict, Tuple, Optional, Any
+
+import numpy as np
+import shapely
+from shapely.geometry import mapping
+
+from qd_engine import circle_primitive
+from qd_spatial import LocalProjection
+
+logger = logging.getLogger(__name__)
+
+DISSOLVE_CACHE_SIZE = 16
+# Segments per quarter circle of the dissolved outlines
+DEFAULT_QUAD_SEGS = 16
+
+
+def _arc_records(facility_results: List[Dict]) -> List[Tuple]:
+    """(facility_id, center lon, center lat, radius ft, qd_type, hazard_division, k multiplier) per ring"""
+    records = []
+    for result in facility_results:
+        center = result.get("facility_centroid") or [0, 0]
+        for ring in result.get("qd_rings") or []:
+            properties = ring.get("properties") or {}
+            if properties.get("is_uncertainty") or not properties.get("radius"):
+                continue
+            records.append((
+                result.get("facility_id"), float(center[0]), float(center[1]), float(properties["radius"]),
+                properties.get("qd_type"), properties.get("hazard_division") or result.get("hazard_division"),
+                float(properties.get("k_factor") or 0)
+            ))
+    return records
+
+
+def arcs_key(facility_results: List[Dict]) -> str:
+    """Content hash of the arcs of an analysis, used to cache and fetch them"""
+    payload = json.dumps(_arc_records(facility_results), separators=(",", ":"), default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def dissolve_arcs(facility_results: List[Dict], quad_segs: int = DEFAULT_QUAD_SEGS) -> Dict[str, Any]:
+    """Merge overlapping QD arcs into one outline per (K-factor type, HD, ring multiplier).
+
+    Arcs are rebuilt from each facility centroid and ring radius in a local
+    feet projection, as polygons that circumscribe the true circle, so the
+    merged outline never falls inside any arc. Each group is merged with one
+    cascaded union (GEOS builds an STRtree over the arcs internally).
+    """
+    records = _arc_records(facility_results)
+    if not records:
+        return {"type": "FeatureCollection", "features": []}
+
+    centers = np.array([[r[1], r[2]] for r in records])
+    radii = np.array([r[3] for r in records])
+    groups = {}
+    for i, record in enumerate(records):
+        groups.setdefault((record[4], record[5], record[6]), []).append(i)
+
+    projection = LocalProjection(*((centers.min(axis=0) + centers.max(axis=0)) / 2))
+    x, y = projection.forward(centers[:, 0], centers[:, 1])
+    # Buffer vertices lie on the circle; push them out so the edges do not cut inside it
+    circumscribe = 1 / math.cos(math.pi / (4 * quad_segs))
+    arcs = shapely.buffer(shapely.points(x, y), radii * circumscribe, quad_segs=quad_segs)
+
+    def _to_lonlat(coords):
+        lon, lat = projection.inverse(coords[:, 0], coords[:, 1])
+        return np.column_stack([lon, lat])
+
+    features = []
+    for (qd_type, hazard_division, k_multiplier), members in sorted(groups.items(), key=lambda g: str(g[0])):
+        outline = shapely.transform(shapely.union_all(arcs[members]), _to_lonlat)
+        features.append({
+            "type": "Feature",
+            "geometry": mapping(outline),
+            "properties": {
+                "qd_type": qd_type,
+                "hazard_division": hazard_division,
+                "k_factor": k_multiplier,
+                "facility_count": len({records[i][0] for i in members}),
+                "arc_count": len(members),
+                "label": f"HD {hazard_division} {qd_type}" + (f" ({k_multiplier}x)" if k_multiplier != 1.0 else ""),
+                "is_qd_arc": True,
+                "is_dissolved": True
+            }
+        })
+
+    logger.info(f"Dissolved {len(records)} arcs into {len(features)} outlines")
+    return {"type": "FeatureCollection", "features": features}
+
+
+class ArcCache:
+    """LRU of dissolved outlines and per-facility arcs by analysis arcs key"""
+
+    def __init__(self, max_entries: int = DISSOLVE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+arc_cache = ArcCache()
+
+
+def get_dissolved_arcs(facility_results: List[Dict]) -> Tuple[str, Dict[str, Any]]:
+    """(arcs key, dissolved FeatureCollection) for an analysis, computed once per distinct arc set.
+
+    The per-facility rings are kept with the cached outlines so they can be
+    fetched later with `facility_arcs`.
+    """
+    key = arcs_key(facility_results)
+    entry = arc_cache.get(key)
+    if entry is None:
+        entry = {
+            "dissolved": dissolve_arcs(facility_results),
+            # Keyed by str(id): facility ids come back as query strings, numeric or not
+            "rings": {str(r.get("facility_id")): r.get("qd_rings") or [] for r in facility_results},
+            "centers": {str(r.get("facility_id")): r.get("facility_centroid") for r in facility_results}
+        }
+        arc_cache.put(key, entry)
+    return key, entry["dissolved"]
+
+
+def facility_arcs(key: str, facility_id: Optional[str] = None,
+                  arc_format: str = "polygon") -> Optional[Dict[str, List[Dict]]]:
+    """Cached per-facility rings of an analysis (all facilities when no id is given).
+
+    With arc_format "circle" the rings are returned as circle primitives.
+    Returns None for an unknown key and raises KeyError for a facility that
+    is not part of the analysis.
+    """
+    entry = arc_cache.get(key)
+    if entry is None:
+        return None
+    facility_ids = list(entry["rings"]) if facility_id is None else [str(facility_id)]
+    rings = {fid: entry["rings"][fid] for fid in facility_ids}
+    if arc_format == "circle":
+        rings = {
+            fid: [circle_primitive(entry["centers"][fid], ring) for ring in fid_rings]
+            for fid, fid_rings in rings.items()
+        }
+    return rings
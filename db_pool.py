@@ -0,0 +1,224 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Any, Callable
+
+import psycopg2
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_SIZE = 1
+DEFAULT_MAX_SIZE = 10
+# Connections are replaced after this many seconds, so server-side state cannot pile up
+DEFAULT_MAX_LIFETIME = 1800.0
+# A connection idle longer than this is checked with a round trip before it is handed out
+DEFAULT_HEALTH_CHECK_AFTER = 30.0
+# Seconds a request waits for a free connection before giving up
+DEFAULT_TIMEOUT = 10.0
+
+def pool_settings() -> Dict[str, Any]:
+    """Pool sizing, lifetime, health check and timeout settings from QD_DB_POOL_* variables"""
+    return {
+        "min_size": int(os.environ.get('QD_DB_POOL_MIN', DEFAULT_MIN_SIZE)),
+        "max_size": int(os.environ.get('QD_DB_POOL_MAX', DEFAULT_MAX_SIZE)),
+        "max_lifetime": float(os.environ.get('QD_DB_POOL_MAX_LIFETIME', DEFAULT_MAX_LIFETIME)),
+        "health_check_after": float(os.environ.get('QD_DB_POOL_HEALTH_CHECK', DEFAULT_HEALTH_CHECK_AFTER)),
+        "timeout": float(os.environ.get('QD_DB_POOL_TIMEOUT', DEFAULT_TIMEOUT))
+    }
+
+
+class PoolTimeout(Exception):
+    """No connection became free within the pool timeout"""
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of psycopg2 connections.
+
+    `getconn` hands out an idle connection (or opens one while below
+    `max_size`, or waits up to `timeout`). Connections older than
+    `max_lifetime` are closed instead of reused, and connections idle for
+    longer than `health_check_after` are checked with `SELECT 1` first.
+    `putconn` rolls back any open transaction before the connection goes
+    back to the pool.
+    """
+
+    def __init__(self, dsn: Optional[str] = None, min_size: int = DEFAULT_MIN_SIZE, max_size: int = DEFAULT_MAX_SIZE,
+                 max_lifetime: float = DEFAULT_MAX_LIFETIME, health_check_after: float = DEFAULT_HEALTH_CHECK_AFTER,
+                 timeout: float = DEFAULT_TIMEOUT, connect: Optional[Callable[[str], Any]] = None):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self._connect = connect or psycopg2.connect
+        self._idle = []
+        self._info = {}
+        self._opening = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._metrics = {
+            "connections_opened": 0,
+            "connections_closed": 0,
+            "expired": 0,
+            "health_check_failures": 0,
+            "requests": 0,
+            "waits": 0,
+            "wait_time_ms": 0.0,
+            "timeouts": 0
+        }
+
+    @classmethod
+    def from_env(cls) -> 'ConnectionPool':
+        """Pool configured from DATABASE_URL and the QD_DB_POOL_* variables"""
+        return cls(dsn=os.environ.get('DATABASE_URL'), **pool_settings())
+
+    def _register(self, conn):
+        now = time.monotonic()
+        self._info[conn] = {"created": now, "last_used": now}
+        self._metrics["connections_opened"] += 1
+        return conn
+
+    def _discard(self, conn) -> None:
+        self._info.pop(conn, None)
+        self._metrics["connections_closed"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _usable(self, conn) -> bool:
+        """Lifetime and (for long idle connections) liveness check, run outside the pool lock"""
+        info = self._info[conn]
+        now = time.monotonic()
+        if conn.closed or now - info["created"] > self.max_lifetime:
+            with self._condition:
+                self._metrics["expired"] += 1
+            return False
+        if now - info["last_used"] > self.health_check_after:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except Exception as e:
+                logger.warning(f"Discarding unhealthy pooled connection: {str(e)}")
+                with self._condition:
+                    self._metrics["health_check_failures"] += 1
+                return False
+        return True
+
+    def open(self) -> None:
+        """Open the minimum number of connections (failures are logged, connections open lazily)"""
+        with self._condition:
+            self._closed = False
+            try:
+                while len(self._info) < self.min_size:
+                    self._idle.append(self._register(self._connect(self.dsn or os.environ['DATABASE_URL'])))
+            except Exception as e:
+                logger.error(f"Could not pre-open database connections: {str(e)}")
+        logger.info(f"Database pool ready ({len(self._idle)} open, max {self.max_size})")
+
+    def close(self) -> None:
+        """Close idle connections; connections in use are closed when they are returned"""
+        with self._condition:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop())
+            self._condition.notify_all()
+        logger.info("Database pool closed")
+
+    def getconn(self):
+        """Take a connection, opening one below max_size or waiting up to `timeout` for one"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        with self._condition:
+            self._metrics["requests"] += 1
+        while True:
+            conn = None
+            with self._condition:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("Database pool is closed")
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if len(self._info) + self._opening < self.max_size:
+                        self._opening += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._metrics["timeouts"] += 1
+                        raise PoolTimeout(f"No database connection free after {self.timeout}s")
+                    waited = True
+                    self._condition.wait(remaining)
+
+            if conn is None:
+                # Connect outside the lock so other requests are not held up by the handshake
+                try:
+                    conn = self._connect(self.dsn or os.environ['DATABASE_URL'])
+                finally:
+                    with self._condition:
+                        self._opening -= 1
+                        if conn is not None:
+                            self._register(conn)
+                        else:
+                            self._condition.notify()
+                break
+            if self._usable(conn):
+                break
+            with self._condition:
+                self._discard(conn)
+                self._condition.notify()
+
+        if waited:
+            with self._condition:
+                self._metrics["waits"] += 1
+                self._metrics["wait_time_ms"] += (time.monotonic() - started) * 1000
+        return conn
+
+    def putconn(self, conn) -> None:
+        with self._condition:
+            if conn not in self._info:
+                return
+            healthy = not conn.closed
+            if healthy and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    healthy = False
+            if healthy and not self._closed:
+                self._info[conn]["last_used"] = time.monotonic()
+                self._idle.append(conn)
+            else:
+                self._discard(conn)
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            stats = dict(self._metrics)
+            stats.update(
+                size=len(self._info),
+                idle=len(self._idle),
+                in_use=len(self._info) - len(self._idle),
+                min_size=self.min_size,
+                max_size=self.max_size,
+                max_lifetime=self.max_lifetime,
+                wait_time_ms=round(stats["wait_time_ms"], 2),
+                avg_wait_ms=round(stats["wait_time_ms"] / stats["waits"], 2) if stats["waits"] else 0.0
+            )
+            return stats
+
+
+db_pool = ConnectionPool.from_env()
@@ -0,0 +1,296 @@
+import logging
+import multiprocessing
+import os
+import secrets
+import threading
+from collections import deque
+from multiprocessing.connection import Listener, Client
+from typing import List, Dict, Tuple, Optional, Any
+
+from qd_engine import KFactorType, get_engine
+from tiled_analysis import (TiledDataset, analyze_tile, merge_tile_results, tile_summary, iter_location_features,
+                            close_source, DEFAULT_MEMORY_BUDGET_MB, DEFAULT_CHUNK_SIZE)
+
+logger = logging.getLogger(__name__)
+
+# Workers and coordinator authenticate with a shared key; there is no default,
+# since the connections carry pickles and any key holder can run code
+AUTHKEY_ENV = "QD_CLUSTER_AUTHKEY"
+# A task handed to a worker that disconnects is re-queued this many times
+MAX_TASK_ATTEMPTS = 3
+
+
+def cluster_authkey() -> bytes:
+    """Shared cluster key from the environment; refuses to run without one"""
+    value = os.environ.get(AUTHKEY_ENV)
+    if not value:
+        raise RuntimeError(f"{AUTHKEY_ENV} must be set to the shared cluster key on the coordinator and every worker")
+    return value.encode()
+
+
+def run_worker(address: Tuple[str, int], authkey: Optional[bytes] = None, worker_id: Optional[str] = None) -> int:
+    """Worker node loop: request tiles from the coordinator and return their facility results.
+
+    Protocol (pickled dicts over multiprocessing.connection):
+      worker -> {"type": "ready", "worker_id"}
+      coordinator -> {"type": "task", "task_id", "site_type", "k_factor_type", "features", "is_home"}
+                     or {"type": "shutdown"}
+      worker -> {"type": "result", "task_id", "results"} or {"type": "error", "task_id", "error"}
+    The coordinator answers every result with the next task. Returns the
+    number of tiles analyzed.
+    """
+    worker_id = worker_id or f"{os.uname().nodename}:{os.getpid()}"
+    analyzed = 0
+    with Client(tuple(address), authkey=authkey or cluster_authkey()) as conn:
+        conn.send({"type": "ready", "worker_id": worker_id})
+        while True:
+            message = conn.recv()
+            if message.get("type") != "task":
+                break
+            try:
+                results = analyze_tile(
+                    get_engine(message["site_type"]),
+                    message["features"],
+                    message["is_home"],
+                    message["k_factor_type"]
+                )
+                conn.send({"type": "result", "task_id": message["task_id"], "results": results})
+                analyzed += 1
+            except Exception as e:
+                logger.error(f"Worker {worker_id} failed on task {message['task_id']}: {str(e)}")
+                conn.send({"type": "error", "task_id": message["task_id"], "error": str(e)})
+    logger.info(f"Worker {worker_id} finished after {analyzed} tiles")
+    return analyzed
+
+
+class Coordinator:
+    """Hands out halo tiles of one or more datasets to connected workers and gathers results.
+
+    Each job (an installation) is spooled and tiled as for out-of-core
+    analysis; tile features are read from the spool only when a tile is
+    dispatched, so coordinator memory is bounded by the tiles in flight.
+    """
+
+    def __init__(self, jobs: Dict[Any, Dict[str, Any]], k_factor_type: str = KFactorType.IBD.value,
+                 memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB, tile_size_ft: Optional[float] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, spool_dir: Optional[str] = None):
+        """`jobs` maps a job key to {"source": iterable of features, "site_type": str}"""
+        self.k_factor_type = k_factor_type
+        self._datasets = {}
+        self._plans = {}
+        self._site_types = {}
+        self._tasks = {}
+        self._pending = deque()
+        self._results = {}
+        self._attempts = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+        try:
+            for key, job in jobs.items():
+                site_type = job.get("site_type", "DOD")
+                engine = get_engine(site_type)
+                dataset = TiledDataset(engine, job["source"], chunk_size=chunk_size, spool_dir=spool_dir)
+                self._datasets[key] = dataset
+                self._site_types[key] = site_type
+                self._plans[key] = dataset.plan(engine, k_factor_type, memory_budget_mb, tile_size_ft)
+                if self._plans[key] is None:
+                    continue
+                for tile_rows, is_home in dataset.tiles(self._plans[key]):
+                    task_id = len(self._tasks)
+                    self._tasks[task_id] = (key, tile_rows, is_home)
+                    self._pending.append(task_id)
+        except Exception:
+            self.close()
+            raise
+        finally:
+            # Database sources hold a pooled connection until closed
+            for job in jobs.values():
+                close_source(job["source"])
+
+        if not self._tasks:
+            self._done.set()
+        logger.info(f"Coordinator ready: {len(jobs)} jobs, {len(self._tasks)} tiles")
+
+    @property
+    def tile_count(self) -> int:
+        return len(self._tasks)
+
+    def _next_message(self) -> Optional[Dict]:
+        with self._lock:
+            if not self._pending:
+                return None
+            task_id = self._pending.popleft()
+            self._attempts[task_id] = self._attempts.get(task_id, 0) + 1
+            key, tile_rows, is_home = self._tasks[task_id]
+            dataset = self._datasets[key]
+            features = dataset.spool.read(tile_rows)
+        return {
+            "type": "task",
+            "task_id": task_id,
+            "site_type": self._site_types[key],
+            "k_factor_type": self.k_factor_type,
+            "features": features,
+            "is_home": is_home
+        }
+
+    def _finish(self, task_id: int, results: Optional[List[Dict]] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            if task_id in self._results or task_id in self._failures:
+                return
+            if error is None:
+                self._results[task_id] = results
+            elif self._attempts.get(task_id, 0) < MAX_TASK_ATTEMPTS:
+                self._pending.append(task_id)
+                return
+            else:
+                self._failures[task_id] = error
+            if len(self._results) + len(self._failures) == len(self._tasks):
+                self._done.set()
+
+    def _serve(self, conn, worker_id: str) -> None:
+        task_id = None
+        try:
+            while not self._done.is_set():
+                message = self._next_message()
+                if message is None:
+                    # Everything is dispatched; idle until in-flight tiles settle
+                    if self._done.wait(0.1):
+                        break
+                    continue
+                task_id = message["task_id"]
+                conn.send(message)
+                reply = conn.recv()
+                if reply.get("type") == "result":
+                    self._finish(task_id, results=reply["results"])
+                else:
+                    self._finish(task_id, error=reply.get("error", "unknown worker error"))
+                task_id = None
+            conn.send({"type": "shutdown"})
+        except (EOFError, OSError) as e:
+            logger.warning(f"Lost worker {worker_id}: {str(e)}")
+            if task_id is not None:
+                self._finish(task_id, error=f"worker {worker_id} disconnected")
+        finally:
+            conn.close()
+
+    def serve(self, address: Tuple[str, int] = ("localhost", 0), authkey: Optional[bytes] = None,
+              ready: Optional[threading.Event] = None, timeout: Optional[float] = None) -> Dict[Any, Dict[str, Any]]:
+        """Accept workers until every tile has a result, then return per-job results.
+
+        The bound address is available as `self.address` once `ready` is set.
+        """
+        with Listener(tuple(address), authkey=authkey or cluster_authkey()) as listener:
+            self.address = listener.address
+            if ready is not None:
+                ready.set()
+
+            def _accept():
+                while not self._done.is_set():
+                    try:
+                        conn = listener.accept()
+                    except OSError:
+                        break
+                    try:
+                        hello = conn.recv()
+                    except (EOFError, OSError):
+                        conn.close()
+                        continue
+                    threading.Thread(target=self._serve, args=(conn, hello.get("worker_id", "?")),
+                                     daemon=True).start()
+
+            threading.Thread(target=_accept, daemon=True).start()
+            if not self._done.wait(timeout):
+                raise TimeoutError(f"{len(self._tasks) - len(self._results)} tiles still outstanding")
+        return self.results()
+
+    def results(self) -> Dict[Any, Dict[str, Any]]:
+        by_job = {key: [] for key in self._datasets}
+        for task_id, results in sorted(self._results.items()):
+            by_job[self._tasks[task_id][0]].append(results)
+        output = {}
+        for key, dataset in self._datasets.items():
+            plan = self._plans[key]
+            facilities = merge_tile_results(by_job[key])
+            output[key] = dict(
+                tile_summary(plan) if plan is not None else {},
+                site_type=self._site_types[key],
+                total_features=len(dataset),
+                tiles_analyzed=len(by_job[key]),
+                failed_tiles=sum(1 for t in self._failures if self._tasks[t][0] == key),
+                total_violations=sum(len(r["violations"]) for r in facilities),
+                facilities_analyzed=facilities
+            )
+        return output
+
+    def close(self) -> None:
+        for dataset in self._datasets.values():
+            dataset.close()
+
+
+def analyze_cluster_local(jobs: Dict[Any, Dict[str, Any]], workers: int = 4,
+                          k_factor_type: str = KFactorType.IBD.value,
+                          memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+                          tile_size_ft: Optional[float] = None,
+                          timeout: Optional[float] = None) -> Dict[Any, Dict[str, Any]]:
+    """Run a coordinator with `workers` local worker processes over localhost.
+
+    Stand-in for a multi-node deployment: the same protocol is used as
+    when workers on other hosts connect with `run_worker`. The workers are
+    our own child processes, so they share a random per-run key instead of
+    QD_CLUSTER_AUTHKEY.
+    """
+    coordinator = Coordinator(jobs, k_factor_type=k_factor_type, memory_budget_mb=memory_budget_mb,
+                              tile_size_ft=tile_size_ft)
+    authkey = secrets.token_bytes(32)
+    ready = threading.Event()
+    outcome = {}
+
+    def _coordinate():
+        try:
+            outcome["results"] = coordinator.serve(("localhost", 0), authkey, ready=ready, timeout=timeout)
+        except Exception as e:
+            outcome["error"] = e
+            ready.set()
+
+    thread = threading.Thread(target=_coordinate, daemon=True)
+    thread.start()
+    ready.wait()
+    processes = []
+    try:
+        if "error" not in outcome and coordinator.tile_count:
+            context = multiprocessing.get_context("spawn")
+            for i in range(max(1, workers)):
+                process = context.Process(target=run_worker, args=(coordinator.address, authkey, f"local-{i}"))
+                process.start()
+                processes.append(process)
+        thread.join()
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        coordinator.close()
+
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["results"]
+
+
+def location_jobs(database_url: Optional[str] = None, site_type: str = "DOD") -> Dict[Any, Dict[str, Any]]:
+    """One job per active location, streaming its features from the database"""
+    import psycopg2
+
+    conn = psycopg2.connect(database_url or os.environ['DATABASE_URL'])
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM locations WHERE deleted = FALSE ORDER BY id")
+        location_ids = [row[0] for row in cur.fetchall()]
+        cur.close()
+    finally:
+        conn.close()
+    return {
+        location_id: {"source": iter_location_features(location_id, database_url), "site_type": site_type}
+        for location_id in location_ids
+    }
@@ -0,0 +1,223 @@
+import json
+import logging
+from dataclasses import dataclass
+from typing import List, Dict, Tuple, Optional, Any
+
+from feature_table import parse_net_explosive_weight
+
+logger = logging.getLogger(__name__)
+
+# Feature pages are capped so one response stays bounded
+MAX_PAGE_SIZE = 10000
+
+
+def feature_json_sql(properties_sql: str = "f.properties") -> str:
+    """SQL expression rebuilding the GeoJSON feature of a `features f` row"""
+    return (f"f.members || jsonb_build_object('geometry', ST_AsGeoJSON(f.geom)::jsonb, "
+            f"'properties', {properties_sql})")
+
+
+FEATURE_JSON_SQL = feature_json_sql()
+
+# Properties restricted to the keys in an array parameter
+SPARSE_PROPERTIES_SQL = ("COALESCE((SELECT jsonb_object_agg(p.key, p.value) FROM jsonb_each(f.properties) p "
+                         "WHERE p.key = ANY(%s)), '{}'::jsonb)")
+
+
+def _split(value: Optional[str]) -> Optional[Tuple[str, ...]]:
+    if value is None:
+        return None
+    items = tuple(item.strip() for item in value.split(",") if item.strip())
+    return items or None
+
+
+@dataclass(frozen=True)
+class FeatureFilter:
+    """Viewport, layer and property selection plus a keyset page for feature reads.
+
+    `layers` matches either the stored layer name or a feature's
+    `layerName`. Pages are ordered by (layer id, position) and `after` is
+    the last key of the previous page.
+    """
+    bbox: Optional[Tuple[float, float, float, float]] = None
+    layers: Optional[Tuple[str, ...]] = None
+    fields: Optional[Tuple[str, ...]] = None
+    after: Optional[Tuple[int, int]] = None
+    limit: Optional[int] = None
+
+    @classmethod
+    def from_query(cls, bbox: Optional[str] = None, layers: Optional[str] = None, fields: Optional[str] = None,
+                   cursor: Optional[str] = None, limit: Optional[int] = None) -> 'FeatureFilter':
+        """Parse comma-separated query parameters; raises ValueError on malformed input"""
+        box = None
+        if bbox:
+            try:
+                box = tuple(float(v) for v in bbox.split(","))
+            except ValueError:
+                raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+            if len(box) != 4 or box[0] > box[2] or box[1] > box[3]:
+                raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+        after = None
+        if cursor:
+            try:
+                layer_id, position = (int(v) for v in cursor.split(":"))
+            except ValueError:
+                raise ValueError("Invalid cursor")
+            after = (layer_id, position)
+        if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        return cls(box, _split(layers), _split(fields), after, limit)
+
+    @property
+    def is_empty(self) -> bool:
+        return self == FeatureFilter()
+
+    def sql(self, location_id: Optional[int] = None, facilities_only: bool = False) -> Tuple[str, List[Any]]:
+        """(SELECT of layer id, position and feature JSON, parameters) for active layers"""
+        params: List[Any] = []
+        properties_sql = "f.properties"
+        if self.fields is not None:
+            properties_sql = SPARSE_PROPERTIES_SQL
+            params.append(list(self.fields))
+
+        conditions = ["l.is_active = TRUE"]
+        if location_id:
+            conditions.append("f.location_id = %s")
+            params.append(location_id)
+        if facilities_only:
+            conditions.append("f.net_explosive_weight > 0")
+        if self.bbox:
+            # && is answered by the GiST index on geom
+            conditions.append("f.geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)")
+            params.extend(self.bbox)
+        if self.layers:
+            conditions.append("(l.name = ANY(%s) OR f.members->>'layerName' = ANY(%s))")
+            params.extend([list(self.layers), list(self.layers)])
+        if self.after:
+            conditions.append("(f.layer_id, f.position) > (%s, %s)")
+            params.extend(self.after)
+
+        sql = f"""
+            SELECT f.layer_id, f.position, {feature_json_sql(properties_sql)}
+            FROM features f JOIN map_layers l ON l.id = f.layer_id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY f.layer_id, f.position
+        """
+        if self.limit:
+            sql += " LIMIT %s"
+            params.append(self.limit)
+        return sql, params
+
+    def next_cursor(self, rows: List[Tuple]) -> Optional[str]:
+        """Cursor for the page after `rows`, or None when this was the last page"""
+        if not self.limit or len(rows) < self.limit:
+            return None
+        layer_id, position = rows[-1][0], rows[-1][1]
+        return f"{layer_id}:{position}"
+
+INSERT_FEATURE_SQL = """
+    INSERT INTO features (layer_id, location_id, position, feature_id, geom,
+                          net_explosive_weight, hazard_division, unit, members, properties)
+    VALUES (%s, %s, %s, %s, ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326), %s, %s, %s, %s, %s)
+"""
+
+UPDATE_FEATURE_SQL = """
+    UPDATE features
+    SET geom = ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326), net_explosive_weight = %s,
+        hazard_division = %s, unit = %s, members = %s, properties = %s
+    WHERE layer_id = %s AND feature_id = %s
+"""
+
+
+def typed_columns(properties: Optional[Dict]) -> Tuple[float, Optional[str], Optional[str]]:
+    """(NEW, hazard division, unit) columns for a feature's properties"""
+    properties = properties or {}
+    return (
+        parse_net_explosive_weight(properties.get("net_explosive_weight")),
+        properties.get("hazard_division"),
+        properties.get("unit")
+    )
+
+
+def feature_row(feature: Dict, layer_id: int, location_id: Optional[int], position: int) -> Tuple:
+    """Parameters for INSERT_FEATURE_SQL; JSON columns are returned as Python objects"""
+    members = {k: v for k, v in feature.items() if k not in ("geometry", "properties")}
+    properties = feature.get("properties") or {}
+    geometry = feature.get("geometry")
+    feature_id = feature.get("id")
+    return (
+        layer_id,
+        location_id,
+        position,
+        str(feature_id) if feature_id is not None else None,
+        json.dumps(geometry) if geometry else None,
+        *typed_columns(properties),
+        members,
+        properties
+    )
+
+
+def update_params(row: Tuple) -> Tuple:
+    """Parameters for UPDATE_FEATURE_SQL from a feature_row"""
+    return row[4:] + (row[0], row[3])
+
+
+def validate_layer_patch(added: List[Dict], modified: List[Dict], deleted: List[Any]) -> None:
+    """Raise ValueError unless the patch touches each feature once and every feature has an id"""
+    seen = set()
+    for feature in list(added) + list(modified):
+        if not isinstance(feature, dict) or feature.get("id") is None:
+            raise ValueError("Added and modified features need an id")
+    for feature_id in [f["id"] for f in added] + [f["id"] for f in modified] + list(deleted):
+        if feature_id is None:
+            raise ValueError("Deleted features are given by id")
+        if str(feature_id) in seen:
+            raise ValueError(f"Feature {feature_id} appears more than once in the patch")
+        seen.add(str(feature_id))
+
+
+def migrate_layer_blobs(conn) -> int:
+    """Move features out of map_layers.layer_config into the features table.
+
+    Runs on a psycopg2 connection, one layer per transaction so a large
+    installation is never held in memory at once. The migrated layer keeps
+    its remaining config with the `features` member removed. Returns the
+    number of layers migrated.
+    """
+    from psycopg2.extras import Json
+
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    migrated = 0
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM map_layers WHERE layer_config ? 'features' ORDER BY id")
+            layer_ids = [row[0] for row in cur.fetchall()]
+
+        for layer_id in layer_ids:
+            with conn.cursor() as cur:
+                cur.execute("SELECT location_id, layer_config FROM map_layers WHERE id = %s FOR UPDATE",
+                            (layer_id,))
+                location_id, layer_config = cur.fetchone()
+                features = layer_config.get("features") or []
+                cur.execute("DELETE FROM features WHERE layer_id = %s", (layer_id,))
+                cur.executemany(INSERT_FEATURE_SQL, [
+                    _adapt_json(feature_row(feature, layer_id, location_id, position), Json)
+                    for position, feature in enumerate(features)
+                ])
+                cur.execute("UPDATE map_layers SET layer_config = layer_config - 'features' WHERE id = %s",
+                            (layer_id,))
+            conn.commit()
+            migrated += 1
+            logger.info(f"Migrated {len(features)} features of layer {layer_id}")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = autocommit
+    return migrated
+
+
+def _adapt_json(row: Tuple, adapter: Any) -> Tuple:
+    """Wrap the trailing members/properties columns of a feature row for the driver"""
+    return row[:-2] + (adapter(row[-2]), adapter(row[-1]))
@@ -0,0 +1,287 @@
+import logging
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+import shapely
+from shapely import GeometryType
+
+from qd_engine import QDEngine, UnitType
+
+logger = logging.getLogger(__name__)
+
+# Unit codes index into this tuple
+UNIT_CODES = (UnitType.POUNDS.value, UnitType.KILOGRAMS.value, UnitType.GRAMS.value, UnitType.NEQ.value)
+
+GEOMETRY_TYPES = {
+    "Point": GeometryType.POINT,
+    "LineString": GeometryType.LINESTRING,
+    "Polygon": GeometryType.POLYGON,
+    "MultiPoint": GeometryType.MULTIPOINT,
+    "MultiLineString": GeometryType.MULTILINESTRING,
+    "MultiPolygon": GeometryType.MULTIPOLYGON,
+}
+
+
+def parse_net_explosive_weight(value) -> float:
+    """Convert a raw net_explosive_weight property to a float (0 if missing or invalid)"""
+    if value is None or value == "":
+        return 0.0
+    try:
+        if isinstance(value, str):
+            return float(value.strip() or 0)
+        return float(value)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def _geometry_parts(geometry: Dict) -> Tuple[int, List[List[np.ndarray]]]:
+    """(geometry type code, parts as lists of (k, 2) vertex rings) for a GeoJSON geometry.
+
+    Degenerate rings/lines are dropped; a geometry with nothing usable left
+    becomes MISSING.
+    """
+    geo_type = GEOMETRY_TYPES.get((geometry or {}).get("type"), GeometryType.MISSING)
+    coordinates = (geometry or {}).get("coordinates")
+    if geo_type == GeometryType.MISSING or coordinates is None:
+        return GeometryType.MISSING, []
+
+    def _ring(coords, closed: bool) -> Optional[np.ndarray]:
+        try:
+            array = np.asarray(coords, dtype=np.float64)
+        except (ValueError, TypeError):
+            return None
+        if array.ndim != 2 or array.shape[1] < 2:
+            return None
+        array = array[:, :2]
+        if closed:
+            if len(array) and not np.array_equal(array[0], array[-1]):
+                array = np.vstack([array, array[:1]])
+            return array if len(array) >= 4 else None
+        return array if len(array) >= 2 else None
+
+    def _polygon(rings) -> Optional[List[np.ndarray]]:
+        parsed = [_ring(r, closed=True) for r in rings or []]
+        if not parsed or parsed[0] is None:
+            return None
+        return [r for r in parsed if r is not None]
+
+    def _point(coords) -> Optional[List[np.ndarray]]:
+        try:
+            array = np.asarray(coords, dtype=np.float64).reshape(1, -1)
+        except (ValueError, TypeError):
+            return None
+        return [array[:, :2]] if array.shape[1] >= 2 else None
+
+    if geo_type == GeometryType.POINT:
+        parts = [_point(coordinates)]
+    elif geo_type == GeometryType.LINESTRING:
+        line = _ring(coordinates, closed=False)
+        parts = [[line] if line is not None else None]
+    elif geo_type == GeometryType.POLYGON:
+        parts = [_polygon(coordinates)]
+    elif geo_type == GeometryType.MULTIPOINT:
+        parts = [_point(c) for c in coordinates]
+    elif geo_type == GeometryType.MULTILINESTRING:
+        parts = [[line] if (line := _ring(c, closed=False)) is not None else None for c in coordinates]
+    else:
+        parts = [_polygon(p) for p in coordinates]
+
+    parts = [p for p in parts if p]
+    if not parts:
+        return GeometryType.MISSING, []
+    return geo_type, parts
+
+
+def _consecutive(values: np.ndarray) -> np.ndarray:
+    """Renumber a non-decreasing index array to 0..k-1"""
+    if len(values) == 0:
+        return values
+    return np.concatenate([[0], np.cumsum(values[1:] != values[:-1])])
+
+
+@dataclass
+class FeatureTable:
+    """Struct-of-arrays view of a GeoJSON feature list for analysis.
+
+    Geometry is held as one flat (V, 2) coordinate buffer with three offset
+    levels: feature -> parts (geom_part_offsets), part -> rings
+    (part_ring_offsets) and ring -> vertices (ring_offsets). A Polygon is one
+    part, a MultiPolygon one part per polygon, and lines/points use one ring
+    per part. Attributes are parsed once; categorical values are stored as
+    small integer codes into per-table vocabularies.
+    """
+    ids: np.ndarray
+    names: np.ndarray
+    new_values: np.ndarray
+    new_lbs: np.ndarray
+    unit_codes: np.ndarray
+    hd_codes: np.ndarray
+    hazard_division_vocab: List[str]
+    layer_codes: np.ndarray
+    layer_vocab: List[str]
+    is_qd_arc: np.ndarray
+    geometry_types: np.ndarray
+    bbox: np.ndarray
+    centroids: np.ndarray
+    coords: np.ndarray
+    ring_offsets: np.ndarray
+    part_ring_offsets: np.ndarray
+    geom_part_offsets: np.ndarray
+
+    @classmethod
+    def from_features(cls, features: List[Dict], engine: QDEngine) -> 'FeatureTable':
+        """Parse a GeoJSON feature list once into columnar arrays"""
+        n = len(features)
+        ids = np.empty(n, dtype=object)
+        names = np.empty(n, dtype=object)
+        new_values = np.zeros(n)
+        unit_codes = np.zeros(n, dtype=np.int8)
+        hd_codes = np.zeros(n, dtype=np.int16)
+        layer_codes = np.full(n, -1, dtype=np.int16)
+        is_qd_arc = np.zeros(n, dtype=bool)
+        geometry_types = np.full(n, GeometryType.MISSING, dtype=np.int8)
+
+        vocabularies = ({}, {})  # hazard division, layer name
+        rings = []
+        part_ring_counts = []
+        geom_part_counts = np.zeros(n, dtype=np.int64)
+
+        for i, feature in enumerate(features):
+            properties = feature.get("properties") or {}
+            ids[i] = feature.get("id") or f"feature_{i}"
+            names[i] = properties.get("name") or properties.get("facility_name")
+            new_values[i] = parse_net_explosive_weight(properties.get("net_explosive_weight"))
+            unit = properties.get("unit") or UnitType.POUNDS.value
+            unit_codes[i] = UNIT_CODES.index(unit) if unit in UNIT_CODES else 0
+            hd_codes[i] = vocabularies[0].setdefault(properties.get("hazard_division") or "1.1", len(vocabularies[0]))
+            if properties.get("layerName"):
+                layer_codes[i] = vocabularies[1].setdefault(properties["layerName"], len(vocabularies[1]))
+            is_qd_arc[i] = bool(properties.get("is_qd_arc", False))
+
+            geo_type, parts = _geometry_parts(feature.get("geometry"))
+            geometry_types[i] = geo_type
+            geom_part_counts[i] = len(parts)
+            for part in parts:
+                part_ring_counts.append(len(part))
+                rings.extend(part)
+
+        ring_lengths = np.array([len(r) for r in rings], dtype=np.int64)
+        coords = np.concatenate(rings) if rings else np.empty((0, 2))
+        ring_offsets = np.concatenate([[0], np.cumsum(ring_lengths)])
+        part_ring_offsets = np.concatenate([[0], np.cumsum(np.array(part_ring_counts, dtype=np.int64))])
+        geom_part_offsets = np.concatenate([[0], np.cumsum(geom_part_counts)])
+
+        # Vertex ranges per feature for centroids (plain vertex average, as
+        # QDEngine.get_centroid) and bounding boxes
+        vertex_offsets = ring_offsets[part_ring_offsets[geom_part_offsets]]
+        counts = np.diff(vertex_offsets)
+        sums = np.vstack([np.zeros((1, 2)), np.cumsum(coords, axis=0)])
+        centroids = np.zeros((n, 2))
+        bbox = np.full((n, 4), np.nan)
+        has_vertices = counts > 0
+        centroids[has_vertices] = (
+            (sums[vertex_offsets[1:]] - sums[vertex_offsets[:-1]])[has_vertices] / counts[has_vertices, None]
+        )
+        if has_vertices.any():
+            starts = vertex_offsets[:-1][has_vertices]
+            bbox[has_vertices, 0:2] = np.minimum.reduceat(coords, starts, axis=0)
+            bbox[has_vertices, 2:4] = np.maximum.reduceat(coords, starts, axis=0)
+
+        unit_factors = np.array([engine.unit_conversions.get(u, 1.0) for u in UNIT_CODES])
+        table = cls(
+            ids=ids,
+            names=names,
+            new_values=new_values,
+            new_lbs=new_values * unit_factors[unit_codes],
+            unit_codes=unit_codes,
+            hd_codes=hd_codes,
+            hazard_division_vocab=list(vocabularies[0]),
+            layer_codes=layer_codes,
+            layer_vocab=list(vocabularies[1]),
+            is_qd_arc=is_qd_arc,
+            geometry_types=geometry_types,
+            bbox=bbox,
+            centroids=centroids,
+            coords=coords,
+            ring_offsets=ring_offsets,
+            part_ring_offsets=part_ring_offsets,
+            geom_part_offsets=geom_part_offsets
+        )
+        logger.info(f"Built feature table: {n} features, {len(coords)} vertices, {table.nbytes} bytes")
+        return table
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate size of the numeric buffers in bytes"""
+        return sum(
+            getattr(self, name).nbytes for name in (
+                "new_values", "new_lbs", "unit_codes", "hd_codes", "layer_codes",
+                "is_qd_arc", "geometry_types", "bbox", "centroids", "coords",
+                "ring_offsets", "part_ring_offsets", "geom_part_offsets"
+            )
+        )
+
+    @property
+    def has_geometry(self) -> np.ndarray:
+        return self.geometry_types != GeometryType.MISSING
+
+    @property
+    def units(self) -> np.ndarray:
+        return np.array(UNIT_CODES, dtype=object)[self.unit_codes]
+
+    @property
+    def hazard_divisions(self) -> np.ndarray:
+        return np.array(self.hazard_division_vocab, dtype=object)[self.hd_codes]
+
+    @property
+    def layer_names(self) -> np.ndarray:
+        labels = np.array(self.layer_vocab + ["unknown"], dtype=object)
+        return labels[self.layer_codes]
+
+    def geometries(self, coords: Optional[np.ndarray] = None) -> np.ndarray:
+        """Build shapely geometries for every feature from the flat buffers.
+
+        `coords` may replace the stored coordinates (e.g. a projected copy of the
+        same shape). Construction is vectorized per geometry type; features
+        without geometry come back as None.
+        """
+        coords = self.coords if coords is None else coords
+        n = len(self)
+        result = np.full(n, None, dtype=object)
+        ring_of_vertex = np.repeat(np.arange(len(self.ring_offsets) - 1), np.diff(self.ring_offsets))
+        part_of_ring = np.repeat(np.arange(len(self.part_ring_offsets) - 1), np.diff(self.part_ring_offsets))
+        feature_of_part = np.repeat(np.arange(n), np.diff(self.geom_part_offsets))
+        part_types = self.geometry_types[feature_of_part]
+
+        for geo_type in np.unique(self.geometry_types):
+            if geo_type == GeometryType.MISSING:
+                continue
+            rows = np.flatnonzero(self.geometry_types == geo_type)
+            part_mask = part_types == geo_type
+            ring_mask = part_mask[part_of_ring]
+            vertex_mask = ring_mask[ring_of_vertex]
+            xy = coords[vertex_mask]
+            vertex_rings = _consecutive(ring_of_vertex[vertex_mask])
+            ring_parts = _consecutive(part_of_ring[ring_mask])
+            part_features = _consecutive(feature_of_part[part_mask])
+
+            if geo_type == GeometryType.POINT:
+                geometries = shapely.points(xy)
+            elif geo_type == GeometryType.LINESTRING:
+                geometries = shapely.linestrings(xy, indices=vertex_rings)
+            elif geo_type == GeometryType.POLYGON:
+                geometries = shapely.polygons(shapely.linearrings(xy, indices=vertex_rings), indices=ring_parts)
+            elif geo_type == GeometryType.MULTIPOINT:
+                geometries = shapely.multipoints(shapely.points(xy), indices=part_features)
+            elif geo_type == GeometryType.MULTILINESTRING:
+                lines = shapely.linestrings(xy, indices=vertex_rings)
+                geometries = shapely.multilinestrings(lines, indices=part_features)
+            else:
+                polygons = shapely.polygons(shapely.linearrings(xy, indices=vertex_rings), indices=ring_parts)
+                geometries = shapely.multipolygons(polygons, indices=part_features)
+            result[rows] = geometries
+        return result
@@ -0,0 +1,45 @@
+"""
+Lon/lat to feet conversions for QD geometry.
+
+Distances are measured in feet after a local projection using WGS84 degree
+lengths at the origin latitude (or by haversine for point pairs); the
+geometry-to-geometry distance itself is left to GEOS through shapely.
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+FEET_PER_METER = 1 / 0.3048
+# IUGG mean Earth radius
+EARTH_RADIUS_FT = 6371008.8 * FEET_PER_METER
+
+
+def feet_per_degree(lat) -> Tuple[np.ndarray, np.ndarray]:
+    """Length in feet of one degree of longitude and of latitude at `lat` on the WGS84 ellipsoid"""
+    phi = np.radians(np.asarray(lat, dtype=np.float64))
+    lat_m = 111132.92 - 559.82 * np.cos(2 * phi) + 1.175 * np.cos(4 * phi) - 0.0023 * np.cos(6 * phi)
+    lon_m = 111412.84 * np.cos(phi) - 93.5 * np.cos(3 * phi) + 0.118 * np.cos(5 * phi)
+    return lon_m * FEET_PER_METER, lat_m * FEET_PER_METER
+
+
+def haversine_ft(lon1, lat1, lon2, lat2) -> np.ndarray:
+    """Great-circle distance in feet between lon/lat arrays (broadcasting)"""
+    lon1, lat1, lon2, lat2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_FT * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def project_to_feet(coords, origin_lon: float, origin_lat: float) -> np.ndarray:
+    """Project (N, 2) lon/lat coordinates to planar feet around an origin in one pass.
+
+    Uses the ellipsoidal degree lengths at the origin latitude, accurate to
+    well under 0.1% across a single installation.
+    """
+    ft_lon, ft_lat = feet_per_degree(origin_lat)
+    coords = _as_xy(coords)
+    return np.column_stack([(coords[:, 0] - origin_lon) * ft_lon, (coords[:, 1] - origin_lat) * ft_lat])
+
+
+def _as_xy(array) -> np.ndarray:
+    return np.ascontiguousarray(np.asarray(array, dtype=np.float64).reshape(-1, 2))
@@ -0,0 +1,127 @@
+from typing import Dict, Optional, Any
+
+# 7 decimal places of a degree is about 1.1 cm at the equator
+DEFAULT_COORDINATE_PRECISION = 7
+MAX_COORDINATE_PRECISION = 15
+# Delta encoded positions are integers of up to 180 * 10^precision; past 9
+# decimals (sub-millimetre) they stop being exact in JavaScript clients
+MAX_DELTA_PRECISION = 9
+
+GEOMETRY_TYPES = frozenset(("Point", "MultiPoint", "LineString", "MultiLineString", "Polygon", "MultiPolygon"))
+# Members holding caller data that is echoed back as given, never coordinates
+OPAQUE_KEYS = frozenset(("properties", "analysis_options"))
+
+
+def validate_precision(precision: Optional[int], delta: bool = False) -> int:
+    """Precision to use for a response; None selects the default"""
+    if precision is None:
+        return DEFAULT_COORDINATE_PRECISION
+    precision = int(precision)
+    limit = MAX_DELTA_PRECISION if delta else MAX_COORDINATE_PRECISION
+    if not 0 <= precision <= limit:
+        raise ValueError(f"precision must be between 0 and {limit}" + (" with delta encoding" if delta else ""))
+    return precision
+
+
+def _round_coords(coords, precision: int):
+    if isinstance(coords, (int, float)):
+        return round(coords, precision)
+    if isinstance(coords, list):
+        return [_round_coords(c, precision) for c in coords]
+    return coords
+
+
+def _is_position(coords) -> bool:
+    return isinstance(coords, list) and len(coords) >= 2 and isinstance(coords[0], (int, float))
+
+
+def _delta_coords(coords, scale: int):
+    """Integer deltas along each position list; the first position of a list is absolute"""
+    if _is_position(coords):
+        return [int(round(v * scale)) for v in coords]
+    if not isinstance(coords, list) or not coords:
+        return coords
+    if not _is_position(coords[0]):
+        return [_delta_coords(c, scale) for c in coords]
+    encoded = []
+    previous = None
+    for position in coords:
+        current = [int(round(v * scale)) for v in position]
+        encoded.append(current if previous is None else [c - p for c, p in zip(current, previous)])
+        previous = current
+    return encoded
+
+
+def _undelta_coords(coords, scale: int):
+    if _is_position(coords):
+        return [v / scale for v in coords]
+    if not isinstance(coords, list) or not coords:
+        return coords
+    if not _is_position(coords[0]):
+        return [_undelta_coords(c, scale) for c in coords]
+    decoded = []
+    previous = None
+    for delta in coords:
+        current = delta if previous is None else [d + p for d, p in zip(delta, previous)]
+        decoded.append([v / scale for v in current])
+        previous = current
+    return decoded
+
+
+def encode_coordinates(payload: Any, precision: int = DEFAULT_COORDINATE_PRECISION, delta: bool = False) -> Any:
+    """Copy of a response payload with every coordinate quantized to `precision` decimals.
+
+    Coordinates are the "coordinates" of GeoJSON geometries, the
+    "facility_centroid" of analysis results and the "center" of circle
+    primitives; feature properties and echoed analysis options are passed
+    through untouched (and uncopied). With `delta`, geometry coordinates
+    become integers in units of 10^-precision degrees, each position stored
+    as the difference from the previous one in its line or ring;
+    `decode_coordinates` reverses it. Centroids and centers are only rounded.
+    """
+    scale = 10 ** precision
+
+    def _walk(value):
+        if isinstance(value, dict):
+            if value.get("type") in GEOMETRY_TYPES and "coordinates" in value:
+                encoded = dict(value)
+                coordinates = value["coordinates"]
+                encoded["coordinates"] = _delta_coords(coordinates, scale) if delta else _round_coords(coordinates, precision)
+                return encoded
+            encoded = {}
+            for key, item in value.items():
+                if key in OPAQUE_KEYS:
+                    encoded[key] = item
+                elif key == "facility_centroid" and _is_position(item):
+                    encoded[key] = _round_coords(item, precision)
+                elif key == "center" and "radius_ft" in value and _is_position(item):
+                    encoded[key] = _round_coords(item, precision)
+                else:
+                    encoded[key] = _walk(item)
+            return encoded
+        if isinstance(value, list):
+            return [_walk(item) for item in value]
+        return value
+
+    return _walk(payload)
+
+
+def decode_coordinates(payload: Any, precision: int) -> Any:
+    """Reverse the delta encoding of `encode_coordinates(..., delta=True)`"""
+    scale = 10 ** precision
+
+    def _walk(value):
+        if isinstance(value, dict):
+            if value.get("type") in GEOMETRY_TYPES and "coordinates" in value:
+                return dict(value, coordinates=_undelta_coords(value["coordinates"], scale))
+            return {key: item if key in OPAQUE_KEYS else _walk(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [_walk(item) for item in value]
+        return value
+
+    return _walk(payload)
+
+
+def coordinate_encoding(precision: int, delta: bool) -> Dict[str, Any]:
+    """Description of the encoding, included in responses so clients can decode them"""
+    return {"precision": precision, "delta": delta, "scale": 10 ** precision if delta else None}
@@ -1,22 +1,224 @@
+import logging
+import time
+from dataclasses import dataclass
+from typing import List, Tuple, Optional, Callable
 
-from alembic import op
-import sqlalchemy as sa
-from geoalchemy2 import Geometry
-
-def upgrade():
-    # Create version table
-    op.create_table(
-        'version_history',
-        sa.Column('id', sa.Integer(), nullable=False),
-        sa.Column('version', sa.String(50), nullable=False),
-        sa.Column('applied_at', sa.DateTime(), nullable=False),
-        sa.PrimaryKeyConstraint('id')
-    )
-    
-    # Track initial schema version
-    op.execute(
-        "INSERT INTO version_history (version, applied_at) VALUES ('1.0.0', CURRENT_TIMESTAMP)"
+from feature_store import migrate_layer_blobs
+
+logger = logging.getLogger(__name__)
+
+# Held while migrating so concurrently starting workers apply each version once
+MIGRATION_LOCK_ID = 0x51D0_0001
+# Waiters poll for the lock rather than block in pg_advisory_lock: a blocked
+# statement keeps its transaction open, and CREATE INDEX CONCURRENTLY in the
+# lock holder waits for every open transaction to finish, so neither would
+# make progress
+MIGRATION_LOCK_POLL_SECONDS = 1.0
+
+VERSION_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS version_history (
+        id SERIAL PRIMARY KEY,
+        version VARCHAR(50) NOT NULL,
+        applied_at TIMESTAMP NOT NULL
     )
+"""
+
+
+@dataclass(frozen=True)
+class Migration:
+    """One schema version.
+
+    Transactional migrations run their statements and `run` step in a single
+    transaction together with the version_history row. The others run in
+    autocommit, which CREATE INDEX CONCURRENTLY requires; their `indexes`
+    are (name, definition) pairs and must be safe to repeat.
+    """
+    version: str
+    description: str
+    statements: Tuple[str, ...] = ()
+    indexes: Tuple[Tuple[str, str], ...] = ()
+    run: Optional[Callable] = None
+    transactional: bool = True
+
+
+def _add_constraint(table: str, name: str, definition: str) -> str:
+    return f"""
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = '{name}') THEN
+                ALTER TABLE {table} ADD CONSTRAINT {name} {definition};
+            END IF;
+        END $$
+    """
+
+
+MIGRATIONS = (
+    Migration("1.0.0", "Version history"),
+    Migration("1.1.0", "Locations, map layers and bookmarks", statements=(
+        """
+        CREATE TABLE IF NOT EXISTS locations (
+            id SERIAL PRIMARY KEY,
+            location_name VARCHAR(255) NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            deleted BOOLEAN DEFAULT FALSE,
+            deleted_at TIMESTAMP WITH TIME ZONE
+        )
+        """,
+        "ALTER TABLE locations ADD COLUMN IF NOT EXISTS deleted BOOLEAN DEFAULT FALSE",
+        "ALTER TABLE locations ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITH TIME ZONE",
+        """
+        CREATE TABLE IF NOT EXISTS map_layers (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            layer_config JSONB,
+            location_id INTEGER,
+            is_active BOOLEAN DEFAULT TRUE,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "ALTER TABLE map_layers ADD COLUMN IF NOT EXISTS location_id INTEGER",
+        "ALTER TABLE map_layers ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0",
+        # Layer names are unique per location, not globally
+        "ALTER TABLE map_layers DROP CONSTRAINT IF EXISTS map_layers_name_key",
+        _add_constraint("map_layers", "map_layers_name_location_key", "UNIQUE (name, location_id)"),
+        """
+        CREATE TABLE IF NOT EXISTS map_bookmarks (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            location_id INTEGER,
+            bookmark_data JSONB NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE
+        )
+        """,
+        _add_constraint("map_bookmarks", "map_bookmarks_name_location_key", "UNIQUE (name, location_id)")
+    )),
+    # One row per feature. Geometry, NEW, hazard division and unit are typed
+    # columns so facility selection and spatial filters are index scans; the
+    # remaining top-level members (id, type, layerName, ...) and the
+    # properties are kept as JSONB so a feature reads back as it was saved.
+    Migration("1.2.0", "Per-feature storage", statements=(
+        "CREATE EXTENSION IF NOT EXISTS postgis",
+        """
+        CREATE TABLE IF NOT EXISTS features (
+            id BIGSERIAL PRIMARY KEY,
+            layer_id INTEGER NOT NULL REFERENCES map_layers(id) ON DELETE CASCADE,
+            location_id INTEGER,
+            position INTEGER NOT NULL,
+            feature_id TEXT,
+            geom GEOMETRY(GEOMETRY, 4326),
+            net_explosive_weight DOUBLE PRECISION NOT NULL DEFAULT 0,
+            hazard_division VARCHAR(20),
+            unit VARCHAR(20),
+            members JSONB NOT NULL DEFAULT '{}'::jsonb,
+            properties JSONB NOT NULL DEFAULT '{}'::jsonb
+        )
+        """
+    )),
+    # Commits one layer at a time and skips layers already moved
+    Migration("1.2.1", "Move layer_config feature blobs into features", run=migrate_layer_blobs,
+              transactional=False),
+    # Built after the bulk load, without blocking writes
+    Migration("1.3.0", "Feature indexes", transactional=False, statements=(
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_features_feature_id",
+    ), indexes=(
+        ("idx_features_geom", "ON features USING GIST (geom)"),
+        ("idx_features_layer", "ON features (layer_id, position)"),
+        ("idx_features_location", "ON features (location_id, layer_id, position)"),
+        # Feature id -> (layer id, position), so an edit finds its row with one index probe
+        ("idx_features_feature_lookup", "ON features (feature_id, layer_id, position)"),
+        ("idx_features_location_feature", "ON features (location_id, feature_id, layer_id, position)"),
+        ("idx_features_facilities", "ON features (location_id) WHERE net_explosive_weight > 0")
+    )),
+    # Bumped by every layer, feature and bookmark write; keys the location snapshot cache
+    Migration("1.4.0", "Location version counter", statements=(
+        "ALTER TABLE locations ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0",
+    )),
+)
+
+
+def _drop_invalid_index(cur, name: str) -> None:
+    """Drop what an interrupted concurrent build left behind, so it is rebuilt"""
+    cur.execute("""
+        SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname = %s AND NOT i.indisvalid
+    """, (name,))
+    if cur.fetchone():
+        logger.warning(f"Rebuilding invalid index {name}")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def _record(cur, migration: Migration) -> None:
+    cur.execute("INSERT INTO version_history (version, applied_at) VALUES (%s, CURRENT_TIMESTAMP)",
+                (migration.version,))
+
+
+def apply_migration(conn, migration: Migration) -> None:
+    if migration.transactional:
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                for statement in migration.statements:
+                    cur.execute(statement)
+                if migration.run:
+                    migration.run(conn)
+                _record(cur, migration)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = True
+        return
+
+    with conn.cursor() as cur:
+        for statement in migration.statements:
+            cur.execute(statement)
+        for name, definition in migration.indexes:
+            _drop_invalid_index(cur, name)
+            cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}")
+    if migration.run:
+        migration.run(conn)
+    with conn.cursor() as cur:
+        _record(cur, migration)
+
+
+def applied_versions(conn) -> List[str]:
+    with conn.cursor() as cur:
+        cur.execute("SELECT version FROM version_history ORDER BY id")
+        return [row[0] for row in cur.fetchall()]
+
+
+def _acquire_migration_lock(cur, poll_seconds: float) -> None:
+    """Take the session-level migration lock, sleeping between attempts while another worker holds it"""
+    while True:
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        if cur.fetchone()[0]:
+            return
+        logger.info("Waiting for another worker to finish migrating")
+        time.sleep(poll_seconds)
+
+
+def run_migrations(conn, migrations: Tuple[Migration, ...] = MIGRATIONS,
+                   poll_seconds: float = MIGRATION_LOCK_POLL_SECONDS) -> List[str]:
+    """Apply pending migrations in order on a psycopg2 connection; returns the versions applied.
 
-def downgrade():
-    op.drop_table('version_history')
+    When the schema is current this is a lock and one SELECT, so it is cheap
+    to run on every start.
+    """
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(VERSION_TABLE_DDL)
+        _acquire_migration_lock(cur, poll_seconds)
+    try:
+        done = set(applied_versions(conn))
+        applied = []
+        for migration in migrations:
+            if migration.version in done:
+                continue
+            logger.info(f"Applying migration {migration.version}: {migration.description}")
+            apply_migration(conn, migration)
+            applied.append(migration.version)
+        return applied
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
@@ -52,6 +52,32 @@ def parse_arguments():
     rings_parser.add_argument("--hazard-division", type=str, default="1.1", help="Hazard division")
     rings_parser.add_argument("--output-file", type=str, help="Output GeoJSON file")
     
+    # Out-of-core analysis command
+    tiled_parser = subparsers.add_parser("analyze-tiled", help="Analyze a large GeoJSON dataset tile by tile")
+    tiled_parser.add_argument("--input", type=str, required=True, help="Newline-delimited GeoJSON or FeatureCollection file")
+    tiled_parser.add_argument("--site-type", type=str, default="DOD", help="Site type (DOD, DOE, NATO, AIR_FORCE)")
+    tiled_parser.add_argument("--k-factor-type", type=str, default="IBD", help="K-factor type (IBD, ILD, IMD, PTRD, LOP)")
+    tiled_parser.add_argument("--memory-mb", type=float, default=512, help="Memory budget per tile in MB")
+    tiled_parser.add_argument("--tile-size", type=float, help="Fixed tile size in feet (default: sized to the budget)")
+    tiled_parser.add_argument("--spool-dir", type=str, help="Directory for the temporary feature spool")
+    tiled_parser.add_argument("--output-file", type=str, help="Output JSON file")
+    
+    # Distributed analysis commands
+    sweep_parser = subparsers.add_parser("cluster-sweep", help="Coordinate a tiled analysis across worker nodes")
+    sweep_parser.add_argument("--input", type=str, nargs="*", default=[], help="Feature files, one job each")
+    sweep_parser.add_argument("--all-locations", action="store_true", help="Add one job per location in the database")
+    sweep_parser.add_argument("--site-type", type=str, default="DOD", help="Site type (DOD, DOE, NATO, AIR_FORCE)")
+    sweep_parser.add_argument("--k-factor-type", type=str, default="IBD", help="K-factor type (IBD, ILD, IMD, PTRD, LOP)")
+    sweep_parser.add_argument("--memory-mb", type=float, default=512, help="Memory budget per tile in MB")
+    sweep_parser.add_argument("--listen", type=str, help="host:port to accept remote workers on "
+                              "(requires QD_CLUSTER_AUTHKEY, the key shared with every worker)")
+    sweep_parser.add_argument("--local-workers", type=int, default=4, help="Local worker processes (without --listen)")
+    sweep_parser.add_argument("--output-file", type=str, help="Output JSON file")
+    
+    worker_parser = subparsers.add_parser("cluster-worker", help="Run a worker node for cluster-sweep")
+    worker_parser.add_argument("--connect", type=str, required=True, help="Coordinator host:port "
+                               "(requires QD_CLUSTER_AUTHKEY, the coordinator's shared key)")
+    
     return parser.parse_args()
 
 def format_output(data, format_type):
@@ -153,6 +179,87 @@ def generate_rings(args):
         logger.error(f"Error generating QD rings: {str(e)}")
         return 1
 
+def analyze_tiled(args):
+    """Run out-of-core violation analysis over a feature file."""
+    try:
+        from tiled_analysis import analyze_out_of_core, iter_geojson_file
+        
+        engine = get_engine(args.site_type)
+        result = analyze_out_of_core(
+            engine,
+            iter_geojson_file(args.input),
+            k_factor_type=args.k_factor_type,
+            memory_budget_mb=args.memory_mb,
+            tile_size_ft=args.tile_size,
+            spool_dir=args.spool_dir
+        )
+        
+        if args.output_file:
+            with open(args.output_file, 'w') as f:
+                json.dump(result, f, indent=2)
+            print(f"Analysis of {result['total_features']} features written to {args.output_file}")
+        else:
+            print(json.dumps(result, indent=2))
+        
+        return 0
+    except Exception as e:
+        logger.error(f"Error running tiled analysis: {str(e)}")
+        return 1
+
+def _address(value):
+    host, port = value.rsplit(":", 1)
+    return (host, int(port))
+
+def cluster_sweep(args):
+    """Coordinate tiled analysis of several datasets across worker nodes."""
+    try:
+        from distributed_analysis import Coordinator, analyze_cluster_local, location_jobs, cluster_authkey
+        from tiled_analysis import iter_geojson_file
+        
+        # Fail before reading any data when remote workers cannot be authenticated
+        authkey = cluster_authkey() if args.listen else None
+        jobs = {path: {"source": iter_geojson_file(path), "site_type": args.site_type} for path in args.input}
+        if args.all_locations:
+            jobs.update(location_jobs(site_type=args.site_type))
+        if not jobs:
+            print("No inputs given. Use --input and/or --all-locations.")
+            return 1
+        
+        if args.listen:
+            coordinator = Coordinator(jobs, k_factor_type=args.k_factor_type, memory_budget_mb=args.memory_mb)
+            try:
+                logger.info(f"Waiting for workers on {args.listen}")
+                result = coordinator.serve(_address(args.listen), authkey)
+            finally:
+                coordinator.close()
+        else:
+            result = analyze_cluster_local(jobs, workers=args.local_workers, k_factor_type=args.k_factor_type,
+                                           memory_budget_mb=args.memory_mb)
+        
+        output = json.dumps({str(key): value for key, value in result.items()}, indent=2)
+        if args.output_file:
+            with open(args.output_file, 'w') as f:
+                f.write(output)
+            print(f"Results for {len(result)} jobs written to {args.output_file}")
+        else:
+            print(output)
+        
+        return 0
+    except Exception as e:
+        logger.error(f"Error running cluster sweep: {str(e)}")
+        return 1
+
+def cluster_worker(args):
+    """Serve tiles for a cluster-sweep coordinator."""
+    try:
+        from distributed_analysis import run_worker
+        
+        run_worker(_address(args.connect))
+        return 0
+    except Exception as e:
+        logger.error(f"Worker error: {str(e)}")
+        return 1
+
 def main():
     """Main entry point for the CLI."""
     args = parse_arguments()
@@ -163,6 +270,12 @@ def main():
         return calculate_fragments(args)
     elif args.command == "rings":
         return generate_rings(args)
+    elif args.command == "analyze-tiled":
+        return analyze_tiled(args)
+    elif args.command == "cluster-sweep":
+        return cluster_sweep(args)
+    elif args.command == "cluster-worker":
+        return cluster_worker(args)
     else:
         print("No command specified. Use --help for usage information.")
         return 1
@@ -1,12 +1,19 @@
 
 import numpy as np
 import math
-import json
+import copy
 import logging
-from typing import List, Dict, Tuple, Optional, Literal, Union, Any
-from dataclasses import dataclass
+from typing import List, Dict, Tuple, Optional, Union
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, astuple
 from enum import Enum
 
+import shapely
+from shapely.geometry import shape
+
+import geodesy
+
 logger = logging.getLogger(__name__)
 
 # Configure basic logging
@@ -74,8 +81,12 @@ class QDParameters:
             raise ValueError(f"MCE factor must be between 0 and 1.0")
 
 
+# One engine per site type, so calculation caches are shared between requests
+_engines: Dict[str, 'QDEngine'] = {}
+_engines_lock = threading.Lock()
+
 def get_engine(site_type: str = "DOD") -> 'QDEngine':
-    """Create and return a QDEngine instance based on site type."""
+    """Return the QDEngine instance for a site type, creating it on first use."""
     site_type = site_type.upper()
     valid_site_types = [st.value for st in SiteType]
     
@@ -83,8 +94,89 @@ def get_engine(site_type: str = "DOD") -> 'QDEngine':
         logger.warning(f"Unknown site type {site_type}, defaulting to DOD")
         site_type = "DOD"
     
-    logger.info(f"Creating QD engine instance for site type: {site_type}")
-    return QDEngine(site_type=site_type)
+    with _engines_lock:
+        if site_type not in _engines:
+            logger.info(f"Creating QD engine instance for site type: {site_type}")
+            _engines[site_type] = QDEngine(site_type=site_type)
+        return _engines[site_type]
+
+def clear_calculation_caches() -> None:
+    """Drop memoized QD calculations of every engine (e.g. after a standards update)."""
+    with _engines_lock:
+        engines = list(_engines.values())
+    for engine in engines:
+        engine.calculation_cache.clear()
+
+def calculation_cache_stats() -> Dict[str, Dict[str, int]]:
+    """Memo cache counters per site type."""
+    with _engines_lock:
+        return {site_type: engine.calculation_cache.stats() for site_type, engine in _engines.items()}
+
+def circle_primitive(center: List[float], ring: Dict) -> Dict:
+    """Compact {center, radius_ft, k, type} form of a ring from `QDEngine._create_circle_feature`.
+
+    Clients draw these as native circles; `QDEngine.circle_feature` turns
+    one back into the polygonized GeoJSON ring for exports.
+    """
+    properties = ring["properties"]
+    primitive = {
+        "center": [round(float(center[0]), 7), round(float(center[1]), 7)],
+        "radius_ft": round(float(properties["radius"]), 2),
+        "k": properties["k_factor"],
+        "type": properties["qd_type"],
+        "hd": properties["hazard_division"]
+    }
+    if properties.get("is_uncertainty"):
+        primitive["uncertainty"] = True
+    return primitive
+
+class CalculationCache:
+    """Bounded LRU memo of pure QD calculation results with hit/miss/eviction counters.
+
+    Keys are tuples of normalized inputs. Cached results are shared, so
+    callers get a deep copy of dict results and may modify them freely.
+    """
+    
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                value = self._entries[key]
+                return copy.deepcopy(value) if isinstance(value, dict) else value
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return copy.deepcopy(value) if isinstance(value, dict) else value
+        
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
 
 class QDEngine:
     def __init__(self, site_type: str):
@@ -92,6 +184,9 @@ class QDEngine:
         self.uncertainty_margin = 0.1
         self.confidence_level = 0.95
         
+        # Memo of calculate_safe_distance / calculate_arc_radius / calculate_fragment_distance
+        self.calculation_cache = CalculationCache()
+        
         # Unit conversion factors to pounds
         self.unit_conversions = {
             UnitType.GRAMS: 0.00220462,
@@ -249,15 +344,53 @@ class QDEngine:
                                risk_based: bool = False) -> Dict[str, any]:
         """Calculate deterministic safe distance with environmental corrections."""
         
-        # Convert to pounds for calculation
-        quantity_lbs = self.convert_to_pounds(quantity, unit_type)
-        
         # Set defaults if not provided
         if material_props is None:
             material_props = MaterialProperties(sensitivity=1.0, det_velocity=6000, tnt_equiv=1.0)
         if env_conditions is None:
             env_conditions = EnvironmentalConditions(temperature=298, pressure=101.325, humidity=50, confinement_factor=0.0)
-
+        
+        # Memoized on the NEW in pounds; the quantity and unit as given are
+        # echoed into a fresh result on every call
+        quantity_lbs = self.convert_to_pounds(quantity, unit_type)
+        key = ("safe_distance", quantity_lbs, k_factor_type, lop_class,
+               astuple(material_props), astuple(env_conditions), bool(risk_based))
+        result = self.calculation_cache.get_or_compute(key, lambda: self._calculate_safe_distance(
+            quantity_lbs, k_factor_type, lop_class, material_props, env_conditions, risk_based
+        ))
+        steps = result.pop("steps")
+        
+        # Format the calculation steps for transparency
+        calc_steps = f"""
+QD engine calculation steps:
+1. Applied standard: {result["standard_reference"]}
+2. Net explosive weight: {quantity} {unit_type}
+3. Converted to pounds: {quantity_lbs:.2f} lbs
+4. K-factor applied: {result["k_factor"]}
+5. Base formula: {result["k_factor"]} × ∛({quantity_lbs:.2f})
+6. Base distance: {steps["base_distance"]:.2f} ft
+7. Environmental adjustments:
+   - Temperature factor: {steps["temp_factor"]:.3f}
+   - Humidity factor: {steps["humidity_factor"]:.3f}
+   - Material sensitivity: {material_props.sensitivity}
+8. Final distance: {steps["adjusted_distance"]:.2f} ft
+"""
+        
+        return {
+            "distance_ft": result["distance_ft"],
+            "k_factor": result["k_factor"],
+            "k_factor_type": k_factor_type,
+            "standard_reference": result["standard_reference"],
+            "calculation_steps": calc_steps,
+            "risk_analysis": result["risk_analysis"],
+            "unit_type": unit_type,
+            "quantity_original": quantity,
+            "quantity_lbs": quantity_lbs
+        }
+        
+    def _calculate_safe_distance(self, quantity_lbs: float, k_factor_type: str, lop_class: Optional[str],
+                                 material_props: MaterialProperties, env_conditions: EnvironmentalConditions,
+                                 risk_based: bool) -> Dict[str, any]:
         # Apply environmental corrections
         temp_factor = 1.0 + 0.002 * (env_conditions.temperature - 298)
         humidity_factor = 1.0 + 0.001 * (env_conditions.humidity - 50)
@@ -285,32 +418,17 @@ class QDEngine:
                 "reference": "DDESB TP-14, Section 4.2.1"
             }
         
-        # Format the calculation steps for transparency
-        calc_steps = f"""
-QD engine calculation steps:
-1. Applied standard: {standard_ref}
-2. Net explosive weight: {quantity} {unit_type}
-3. Converted to pounds: {quantity_lbs:.2f} lbs
-4. K-factor applied: {k_factor}
-5. Base formula: {k_factor} × ∛({quantity_lbs:.2f})
-6. Base distance: {base_distance:.2f} ft
-7. Environmental adjustments:
-   - Temperature factor: {temp_factor:.3f}
-   - Humidity factor: {humidity_factor:.3f}
-   - Material sensitivity: {material_props.sensitivity}
-8. Final distance: {adjusted_distance:.2f} ft
-"""
-        
         return {
             "distance_ft": round(adjusted_distance, 2),
             "k_factor": k_factor,
-            "k_factor_type": k_factor_type,
             "standard_reference": standard_ref,
-            "calculation_steps": calc_steps,
             "risk_analysis": risk_info,
-            "unit_type": unit_type,
-            "quantity_original": quantity,
-            "quantity_lbs": quantity_lbs
+            "steps": {
+                "base_distance": base_distance,
+                "temp_factor": temp_factor,
+                "humidity_factor": humidity_factor,
+                "adjusted_distance": adjusted_distance
+            }
         }
 
     def generate_k_factor_rings(self, center: List[float], 
@@ -389,12 +507,13 @@ QD engine calculation steps:
                              num_points: int = 32, is_uncertainty: bool = False,
                              net_explosive_weight: float = None, unit: str = None) -> Dict:
         """Create a circle feature with enhanced properties"""
+        # Radius is in feet; convert per axis at the center latitude
+        feet_per_lon, feet_per_lat = geodesy.feet_per_degree(center[1])
+        radius_x, radius_y = float(radius / feet_per_lon), float(radius / feet_per_lat)
         coords = []
         for i in range(num_points):
             angle = (i / num_points) * 2 * math.pi
-            dx = radius * math.cos(angle)
-            dy = radius * math.sin(angle)
-            coords.append([center[0] + dx, center[1] + dy])
+            coords.append([center[0] + radius_x * math.cos(angle), center[1] + radius_y * math.sin(angle)])
         coords.append(coords[0])  # Close the polygon
 
         # Create the feature with rich metadata
@@ -421,15 +540,47 @@ QD engine calculation steps:
         if net_explosive_weight is not None:
             feature["properties"]["net_explosive_weight"] = net_explosive_weight
             feature["properties"]["unit"] = unit
-            
+
         return feature
 
+    def circle_feature(self, primitive: Dict, num_points: int = 32) -> Dict:
+        """Polygonized GeoJSON ring of a circle primitive"""
+        radius = primitive["radius_ft"]
+        if primitive["type"] == "FRAG":
+            label = f"Fragment Distance {radius:.0f} ft"
+            description = "Maximum Hazardous Fragment Distance"
+        elif primitive["k"] == 1.0:
+            label = f"HD {primitive['hd']} {primitive['type']} {radius:.0f} ft"
+            description = f"{primitive['type']} ({self.get_k_factor(primitive['type'])}) - {radius:.0f} ft"
+        else:
+            label = f"{primitive['k']}x {primitive['type']} {radius:.0f} ft"
+            description = f"{primitive['k']}x {primitive['type']} Buffer - {radius:.0f} ft"
+        return self._create_circle_feature(
+            center=primitive["center"],
+            radius=radius,
+            k_factor=primitive["k"],
+            label=label,
+            description=description,
+            qd_type=primitive["type"],
+            hazard_division=primitive["hd"],
+            num_points=num_points,
+            is_uncertainty=primitive.get("uncertainty", False)
+        )
+
     def calculate_fragment_distance(self, quantity: float, unit_type: UnitType = UnitType.POUNDS,
                                  material_type: str = "Steel", casing_thickness: float = 0.5) -> Dict[str, any]:
         """Calculate hazardous fragment distance"""
-        # Convert to pounds for calculation
         quantity_lbs = self.convert_to_pounds(quantity, unit_type)
+        key = ("fragment_distance", quantity_lbs, material_type.lower(), float(casing_thickness))
+        result = self.calculation_cache.get_or_compute(key, lambda: self._calculate_fragment_distance(
+            quantity_lbs, material_type, casing_thickness
+        ))
+        # The material name is echoed as given
+        result["material_type"] = material_type
+        return result
         
+    def _calculate_fragment_distance(self, quantity_lbs: float, material_type: str,
+                                     casing_thickness: float) -> Dict[str, any]:
         # Simple model for hazardous fragment distance based on Gurney energy
         # This is a simplified approach - a real implementation would use more sophisticated models
         if material_type.lower() == "steel":
@@ -452,8 +603,7 @@ QD engine calculation steps:
             "hazard_distance": hazard_distance,
             "reference": reference,
             "method": "Simplified Gurney equation model",
-            "initial_velocity": initial_velocity,
-            "material_type": material_type
+            "initial_velocity": initial_velocity
         }
 
     def calculate_arc_radius(self, net_explosive_weight: float, unit_type: UnitType = UnitType.POUNDS,
@@ -461,10 +611,13 @@ QD engine calculation steps:
         """Calculate the radius for QD arc based on NEW with unit conversion"""
         # Convert to pounds and get K-factor
         quantity_lbs = self.convert_to_pounds(net_explosive_weight, unit_type)
-        k_factor = self.get_k_factor(k_factor_type)
         
-        # Calculate using cube root formula
-        return round(k_factor * math.pow(quantity_lbs, 1/3), 2)
+        def _compute():
+            k_factor = self.get_k_factor(k_factor_type)
+            # Calculate using cube root formula
+            return round(k_factor * math.pow(quantity_lbs, 1/3), 2)
+        
+        return self.calculation_cache.get_or_compute(("arc_radius", quantity_lbs, k_factor_type), _compute)
 
     def analyze_facility(self, facility: Dict, surrounding_features: List[Dict], 
                         k_factor_type: str = KFactorType.IBD.value,
@@ -542,49 +695,67 @@ QD engine calculation steps:
             "hazard_division": facility_data["hazard_division"]
         }
         
-        # Check each surrounding feature for violations
-        for feature in surrounding_features:
-            # Skip if this is a QD arc or the same feature
-            if feature.get("properties", {}).get("is_qd_arc", False):
-                continue
-                
-            if feature.get("id") == facility.get("id"):
-                continue
-                
-            # Calculate distance using enhanced polygon distance
-            try:
-                distance = self.calculate_polygon_distance(
-                    facility_geometry,
-                    feature.get("geometry", {})
-                )
-            except Exception as e:
-                logger.error(f"Distance calculation error: {str(e)}")
-                continue
-                
-            # Check for violation with enhanced logging
-            if distance < safe_distance:
-                feature_name = feature.get("properties", {}).get("name", "Unknown Feature")
-                logger.warning(f"VIOLATION DETECTED: {feature_name} is at {distance:.2f} ft, but requires {safe_distance:.2f} ft")
-                
-                # Log detailed information about the violation
-                violation_info = {
-                    "feature_id": feature.get("id", "unknown"),
-                    "feature_name": feature_name,
-                    "distance": round(distance, 2),
-                    "required": safe_distance,
-                    "deficiency": round(safe_distance - distance, 2),
-                    "percent_deficient": round(100 * (safe_distance - distance) / safe_distance, 1),
-                    "standard_reference": self.get_standard_text(k_factor_type, "summary")
-                }
-                logger.info(f"Violation details: {json.dumps(violation_info, indent=2)}")
-                
-                results["violations"].append(violation_info)
-            else:
-                feature_name = feature.get("properties", {}).get("name", "Unknown Feature") 
-                logger.info(f"No violation: {feature_name} is at {distance:.2f} ft, which is >= required {safe_distance:.2f} ft")
-                
+        # Check the surrounding features for violations in one bulk query
+        from feature_table import FeatureTable
+        table = FeatureTable.from_features([facility] + list(surrounding_features), self)
+        try:
+            results["violations"] = self.find_violations(
+                table, np.array([0]), np.array([safe_distance]), k_factor_type
+            )[0]
+        except Exception as e:
+            logger.error(f"Distance calculation error: {str(e)}")
+
         return results
 
+    def find_violations(self, table, facility_rows: np.ndarray, safe_distances: np.ndarray,
+                        k_factor_type: str = KFactorType.IBD.value, index=None) -> List[List[Dict]]:
+        """Violations of every facility row of a FeatureTable against all other rows.
+
+        Distances are edge-to-edge in feet over a local projection; all
+        facility/feature pairs within the safe distances are found with one
+        STRtree query. Returns one violation list per facility row, in feature
+        order. Pass a prebuilt qd_spatial.GeometryIndex over `table` to reuse it.
+        """
+        from qd_spatial import GeometryIndex
+
+        facility_rows = np.asarray(facility_rows, dtype=np.intp)
+        safe_distances = np.asarray(safe_distances, dtype=np.float64)
+        violations = [[] for _ in range(len(facility_rows))]
+        if index is None:
+            index = GeometryIndex(table, self, default_k_factor_type=k_factor_type)
+
+        facility_slots = index.slots_of_rows()[facility_rows]
+        indexed = np.flatnonzero(facility_slots >= 0)
+        if len(indexed) == 0:
+            return violations
+        pes_idx, es_idx, distances = index.candidate_pairs(facility_slots[indexed], safe_distances[indexed])
+
+        facility_of_slot = {slot: i for i, slot in zip(indexed, facility_slots[indexed])}
+        facility_idx = np.array([facility_of_slot[p] for p in pes_idx], dtype=np.intp)
+        required = safe_distances[facility_idx]
+        ids = np.asarray(index.ids, dtype=object)
+        hits = np.flatnonzero((distances < required) & (ids[es_idx] != ids[pes_idx]))
+        hits = hits[np.lexsort((es_idx[hits], facility_idx[hits]))]
+
+        names = table.names[index.positions]
+        reference = self.get_standard_text(k_factor_type, "summary")
+        for i in hits:
+            distance = float(distances[i])
+            safe_distance = float(required[i])
+            feature_name = names[es_idx[i]] or "Unknown Feature"
+            logger.warning(f"VIOLATION DETECTED: {feature_name} is at {distance:.2f} ft, but requires {safe_distance:.2f} ft")
+            violations[facility_idx[i]].append({
+                "feature_id": ids[es_idx[i]],
+                "feature_name": feature_name,
+                "distance": round(distance, 2),
+                "required": safe_distance,
+                "deficiency": round(safe_distance - distance, 2),
+                "percent_deficient": round(100 * (safe_distance - distance) / safe_distance, 1),
+                "standard_reference": reference
+            })
+        logger.info(f"Violation check: {len(facility_rows)} facilities, {len(pes_idx)} candidate pairs, {len(hits)} violations")
+        return violations
+
     def calculate_distance(self, point1: Union[List[float], Tuple[float, float]], 
                          point2: Union[List[float], Tuple[float, float]]) -> float:
         """Calculate distance between two points"""
@@ -618,24 +789,18 @@ QD engine calculation steps:
             if not coords1 or not coords2:
                 centroid1 = self.get_centroid(geometry1)
                 centroid2 = self.get_centroid(geometry2)
-                return self.calculate_distance(centroid1, centroid2)
+                return float(geodesy.haversine_ft(centroid1[0], centroid1[1], centroid2[0], centroid2[1]))
             
-            # Scale factor for coordinate-based distances (compensates for longitude/latitude distortion)
-            # This multiplier converts degrees to approximate feet at mid-latitudes
-            # More accurate would be using a proper geodesic calculation
-            scale_factor = 364000  # ~364,000 feet per degree at mid-latitudes
-            
-            # Calculate minimum distance between all points
-            min_distance = float('inf')
-            for p1 in coords1:
-                for p2 in coords2:
-                    # Make sure points have two coordinates
-                    if len(p1) >= 2 and len(p2) >= 2:
-                        # Get raw coordinate distance
-                        raw_dist = self.calculate_distance(p1, p2)
-                        # Convert to approximate feet
-                        dist_feet = raw_dist * scale_factor
-                        min_distance = min(min_distance, dist_feet)
+            # Project both geometries to feet around their common midpoint and let
+            # GEOS measure them, so overlapping or crossing geometries are 0 apart
+            vertices = np.asarray([c[:2] for c in coords1 + coords2], dtype=np.float64)
+            origin_lon = (vertices[:, 0].min() + vertices[:, 0].max()) / 2
+            origin_lat = (vertices[:, 1].min() + vertices[:, 1].max()) / 2
+            projected1, projected2 = (
+                shapely.transform(shape(geometry), lambda c: geodesy.project_to_feet(c, origin_lon, origin_lat))
+                for geometry in (geometry1, geometry2)
+            )
+            min_distance = float(projected1.distance(projected2))
             
             # Log detailed distance information for debugging
             logger.info(f"Distance calculation between geometries: {min_distance:.2f} ft")
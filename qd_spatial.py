@@ -0,0 +1,198 @@
+import logging
+from typing import List, Dict, Tuple, Optional, Union
+
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from qd_engine import QDEngine, KFactorType
+from feature_table import FeatureTable, parse_net_explosive_weight
+from geodesy import feet_per_degree
+
+logger = logging.getLogger(__name__)
+
+
+def feature_attributes(properties: Dict, engine: QDEngine) -> Tuple[float, str]:
+    """(NEW in lbs, hazard division) for a feature's properties"""
+    properties = properties or {}
+    unit = properties.get("unit") or "lbs"
+    if unit not in engine.unit_conversions:
+        unit = "lbs"
+    new_value = parse_net_explosive_weight(properties.get("net_explosive_weight"))
+    return (
+        engine.convert_to_pounds(new_value, unit),
+        properties.get("hazard_division") or "1.1"
+    )
+
+
+class LocalProjection:
+    """Planar projection of lon/lat coordinates into feet around an origin.
+
+    Degree lengths come from the WGS84 ellipsoid at the origin latitude, so
+    east-west distances shrink with cos(latitude) as they should.
+    """
+
+    def __init__(self, origin_lon: float, origin_lat: float):
+        self.origin_lon = float(origin_lon)
+        self.origin_lat = float(origin_lat)
+        self.feet_per_degree_lon, self.feet_per_degree_lat = (float(v) for v in feet_per_degree(self.origin_lat))
+
+    def forward(self, lon: np.ndarray, lat: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Project lon/lat arrays to x/y feet"""
+        x = (np.asarray(lon, dtype=np.float64) - self.origin_lon) * self.feet_per_degree_lon
+        y = (np.asarray(lat, dtype=np.float64) - self.origin_lat) * self.feet_per_degree_lat
+        return x, y
+
+    def inverse(self, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Convert x/y feet arrays back to lon/lat"""
+        lon = np.asarray(x, dtype=np.float64) / self.feet_per_degree_lon + self.origin_lon
+        lat = np.asarray(y, dtype=np.float64) / self.feet_per_degree_lat + self.origin_lat
+        return lon, lat
+
+    def project_coords(self, coords: np.ndarray) -> np.ndarray:
+        """Project a (N, 2) lon/lat coordinate buffer to feet in one pass"""
+        x, y = self.forward(coords[:, 0], coords[:, 1])
+        return np.column_stack([x, y])
+
+    @classmethod
+    def from_bbox(cls, bbox: np.ndarray) -> 'LocalProjection':
+        """Create a projection centered on the union of (N, 4) lon/lat bounding boxes"""
+        if len(bbox) == 0:
+            return cls(0.0, 0.0)
+        minx, miny = np.min(bbox[:, 0]), np.min(bbox[:, 1])
+        maxx, maxy = np.max(bbox[:, 2]), np.max(bbox[:, 3])
+        return cls((minx + maxx) / 2, (miny + maxy) / 2)
+
+
+class GeometryIndex:
+    """Projected geometries, attributes and an STRtree for a set of features.
+
+    Built once per feature set (GeoJSON list or FeatureTable) so that
+    nearest/within-distance queries for many points or facilities run in bulk
+    instead of per-pair Python loops. Slots are the table rows that have a
+    geometry and are not QD arcs; `positions` maps slots back to rows.
+    Every ES is held to `default_k_factor_type`, the analysis K-factor type,
+    as in analyze-location.
+    """
+
+    def __init__(self, features: Union[List[Dict], FeatureTable], engine: QDEngine,
+                 default_k_factor_type: str = KFactorType.IBD.value,
+                 projection: Optional[LocalProjection] = None):
+        self.engine = engine
+        self.default_k_factor_type = default_k_factor_type
+        self.table = features if isinstance(features, FeatureTable) else FeatureTable.from_features(features, engine)
+        table = self.table
+
+        # QD arcs are analysis output, never exposed sites
+        self.positions = np.flatnonzero(table.has_geometry & ~table.is_qd_arc)
+        self.ids = list(table.ids[self.positions])
+
+        self.projection = projection or LocalProjection.from_bbox(table.bbox[self.positions])
+        self.geometries = table.geometries(self.projection.project_coords(table.coords))[self.positions]
+
+        self.new_lbs = table.new_lbs[self.positions]
+        self.hazard_divisions = table.hazard_divisions[self.positions]
+        self.is_pes = self.new_lbs > 0
+        self.tree = STRtree(self.geometries)
+
+        logger.info(f"Built geometry index: {len(self.positions)} features, {int(self.is_pes.sum())} PES")
+
+    def slots_of_rows(self) -> np.ndarray:
+        """Table row -> slot lookup array (-1 for rows that are not indexed)"""
+        slots = np.full(len(self.table), -1, dtype=np.intp)
+        slots[self.positions] = np.arange(len(self.positions))
+        return slots
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @property
+    def bounds(self) -> Tuple[float, float, float, float]:
+        """Projected (minx, miny, maxx, maxy) bounds in feet"""
+        if len(self.geometries) == 0:
+            return (0.0, 0.0, 0.0, 0.0)
+        return tuple(shapely.total_bounds(self.geometries))
+
+    def nearest_distances(self, points: np.ndarray) -> np.ndarray:
+        """Distance in feet from each projected point to the nearest ES (inf when there is none)"""
+        result = np.full(len(points), np.inf)
+        if len(self.geometries):
+            (point_idx, _), nearest = self.tree.query_nearest(points, return_distance=True, all_matches=False)
+            result[point_idx] = nearest
+        return result
+
+    def candidate_pairs(self, pes_indices: np.ndarray, radii: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(pes index, es index, distance ft) for every feature within `radii` of each PES.
+
+        One bulk STRtree dwithin query finds the candidates and one vectorized
+        shapely.distance call measures them; self pairs are dropped.
+        """
+        pes_indices = np.asarray(pes_indices, dtype=np.intp)
+        if len(pes_indices) == 0 or len(self.geometries) == 0:
+            empty = np.empty(0, dtype=np.intp)
+            return empty, empty, np.empty(0)
+        query_idx, es_idx = self.tree.query(
+            self.geometries[pes_indices], predicate="dwithin", distance=np.asarray(radii, dtype=np.float64)
+        )
+        pes_idx = pes_indices[query_idx]
+        keep = pes_idx != es_idx
+        pes_idx, es_idx = pes_idx[keep], es_idx[keep]
+        distances = shapely.distance(self.geometries[pes_idx], self.geometries[es_idx])
+        return pes_idx, es_idx, distances
+
+    def encroachment(self, pes_idx: np.ndarray, es_idx: np.ndarray,
+                     radii: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Area (sq ft) and length (ft) of each ES lying inside the QD arc of its PES.
+
+        Arcs are the PES geometry buffered by the required distance, built once
+        per distinct (PES, radius). Polygonal ES report area, linear ES (roads,
+        PTRD routes) report length; points report neither.
+        """
+        pes_idx = np.asarray(pes_idx, dtype=np.intp)
+        es_idx = np.asarray(es_idx, dtype=np.intp)
+        if len(pes_idx) == 0:
+            return np.empty(0), np.empty(0)
+        keys = np.column_stack([pes_idx.astype(np.float64), np.asarray(radii, dtype=np.float64)])
+        arc_keys, arc_of_pair = np.unique(keys, axis=0, return_inverse=True)
+        arcs = shapely.buffer(self.geometries[arc_keys[:, 0].astype(np.intp)], arc_keys[:, 1])
+        es_geometries = self.geometries[es_idx]
+        inside = shapely.intersection(arcs[arc_of_pair.reshape(-1)], es_geometries)
+        dimensions = shapely.get_dimensions(es_geometries)
+        area = np.where(dimensions == 2, shapely.area(inside), 0.0)
+        length = np.where(dimensions == 1, shapely.length(inside), 0.0)
+        return area, length
+
+
+def annotate_encroachment(engine: QDEngine, features: Union[List[Dict], FeatureTable], facility_results: List[Dict],
+                          index: Optional[GeometryIndex] = None) -> None:
+    """Add encroaching area/length to every violation of analyze-location style results.
+
+    All violations of all facilities are measured in one vectorized pass;
+    `index` reuses a GeometryIndex already built over the same features.
+    """
+    pairs = [
+        (result.get("facility_id"), violation)
+        for result in facility_results
+        for violation in result.get("violations", [])
+    ]
+    if not pairs:
+        return
+
+    if index is None:
+        index = GeometryIndex(features, engine)
+    slots = {}
+    for slot, feature_id in enumerate(index.ids):
+        slots.setdefault(feature_id, slot)
+
+    measurable = [(slots[f], slots[v.get("feature_id")], v) for f, v in pairs
+                  if f in slots and v.get("feature_id") in slots]
+    if not measurable:
+        return
+    area, length = index.encroachment(
+        [p for p, _, _ in measurable],
+        [e for _, e, _ in measurable],
+        [float(v.get("required", 0)) for _, _, v in measurable]
+    )
+    for (_, _, violation), a, l in zip(measurable, area, length):
+        violation["encroachment_area_sqft"] = round(float(a), 2)
+        violation["encroachment_length_ft"] = round(float(l), 2)
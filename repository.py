@@ -0,0 +1,416 @@
+import asyncio
+import logging
+import os
+import random
+from typing import List, Dict, Tuple, Optional, Any
+
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+
+from db_pool import pool_settings
+from vector_tiles import TILE_SQL
+from feature_store import (FEATURE_JSON_SQL, INSERT_FEATURE_SQL, UPDATE_FEATURE_SQL, FeatureFilter, feature_row,
+                           typed_columns, update_params, validate_layer_patch)
+
+logger = logging.getLogger(__name__)
+
+# Hot read queries are sent with prepare=True so the server plans them once per connection
+LOCATIONS_ACTIVE_SQL = "SELECT id, location_name, created_at FROM locations WHERE deleted = FALSE"
+LOCATIONS_ALL_SQL = "SELECT id, location_name, created_at FROM locations"
+LOCATION_BY_ID_SQL = "SELECT id, location_name, version FROM locations WHERE id = %s"
+LOCATION_VERSION_SQL = "SELECT version FROM locations WHERE id = %s"
+LAYERS_BY_LOCATION_SQL = f"""
+    SELECT {FEATURE_JSON_SQL} FROM features f JOIN map_layers l ON l.id = f.layer_id
+    WHERE f.location_id = %s AND l.is_active = TRUE
+    ORDER BY f.layer_id, f.position
+"""
+LAYERS_ALL_SQL = f"""
+    SELECT {FEATURE_JSON_SQL} FROM features f JOIN map_layers l ON l.id = f.layer_id
+    WHERE l.is_active = TRUE
+    ORDER BY f.layer_id, f.position
+"""
+# Served by the partial idx_features_facilities index
+FACILITIES_BY_LOCATION_SQL = f"""
+    SELECT {FEATURE_JSON_SQL} FROM features f JOIN map_layers l ON l.id = f.layer_id
+    WHERE f.location_id = %s AND f.net_explosive_weight > 0 AND l.is_active = TRUE
+    ORDER BY f.layer_id, f.position
+"""
+BOOKMARKS_BY_LOCATION_SQL = "SELECT name, bookmark_data FROM map_bookmarks WHERE location_id = %s AND is_active = TRUE"
+BOOKMARKS_ALL_SQL = "SELECT name, bookmark_data FROM map_bookmarks WHERE is_active = TRUE"
+
+
+class LayerNotFound(Exception):
+    """No active layer with the requested id"""
+
+
+class LayerVersionConflict(Exception):
+    """The layer changed since the version a patch was based on"""
+
+    def __init__(self, message: str, current_version: int):
+        super().__init__(message)
+        self.current_version = current_version
+
+
+def _layer_features(rows) -> List[Dict]:
+    # The feature JSON is the last column; filtered reads also select its keyset
+    return [row[-1] for row in rows]
+
+
+async def _bump_location_version(conn, location_id: Optional[int]) -> None:
+    # Every write to a location's layers or bookmarks moves its version, in the same transaction
+    if location_id:
+        await conn.execute("UPDATE locations SET version = version + 1 WHERE id = %s", (location_id,))
+
+
+async def _execute_features(conn, location_id: Optional[int], feature_filter: FeatureFilter):
+    if feature_filter.is_empty:
+        if location_id:
+            return await conn.execute(LAYERS_BY_LOCATION_SQL, (location_id,), prepare=True)
+        return await conn.execute(LAYERS_ALL_SQL, prepare=True)
+    sql, params = feature_filter.sql(location_id)
+    return await conn.execute(sql, params)
+
+
+def _feature_row(feature: Dict, layer_id: int, location_id: Optional[int], position: int) -> Tuple:
+    row = feature_row(feature, layer_id, location_id, position)
+    return row[:-2] + (Jsonb(row[-2]), Jsonb(row[-1]))
+
+
+class Repository:
+    """Async data access for locations, layers, features and bookmarks.
+
+    Layer features live one per row in the `features` table (see
+    feature_store), so a feature edit is a single-row update and facility
+    selection is an indexed query.
+
+    Queries run on a psycopg 3 AsyncConnectionPool, so handlers await the
+    database instead of blocking the event loop. Each method uses one
+    pooled connection and one transaction (committed when the method
+    returns, rolled back on error); independent statements are sent
+    together in pipeline mode.
+    """
+
+    def __init__(self, conninfo: Optional[str] = None, **settings):
+        self.conninfo = conninfo
+        self.settings = dict(pool_settings(), **settings)
+        self.pool: Optional[AsyncConnectionPool] = None
+        self._health_task: Optional[asyncio.Task] = None
+
+    async def open(self) -> None:
+        self.pool = AsyncConnectionPool(
+            self.conninfo or os.environ['DATABASE_URL'],
+            min_size=self.settings["min_size"],
+            max_size=self.settings["max_size"],
+            max_lifetime=self.settings["max_lifetime"],
+            timeout=self.settings["timeout"],
+            name="qdpro",
+            open=False
+        )
+        await self.pool.open()
+        self._health_task = asyncio.create_task(self._check_idle_connections())
+        logger.info(f"Async database pool ready (max {self.settings['max_size']})")
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+        logger.info("Async database pool closed")
+
+    async def _check_idle_connections(self) -> None:
+        # Broken idle connections are replaced in the background rather than on checkout
+        while True:
+            await asyncio.sleep(self.settings["health_check_after"])
+            try:
+                await self.pool.check()
+            except Exception as e:
+                logger.warning(f"Database pool health check failed: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.pool.get_stats() if self.pool is not None else {}
+        stats.update(
+            open=self.pool is not None,
+            max_lifetime=self.settings["max_lifetime"],
+            health_check_after=self.settings["health_check_after"]
+        )
+        return stats
+
+    def connection(self):
+        if self.pool is None:
+            raise RuntimeError("Database pool is not open")
+        return self.pool.connection()
+
+    async def server_version(self) -> str:
+        async with self.connection() as conn:
+            cur = await conn.execute("SELECT version()")
+            return (await cur.fetchone())[0]
+
+    # Locations
+
+    async def list_locations(self, include_deleted: bool = False) -> List[Dict]:
+        async with self.connection() as conn:
+            cur = await conn.execute(LOCATIONS_ALL_SQL if include_deleted else LOCATIONS_ACTIVE_SQL, prepare=True)
+            rows = await cur.fetchall()
+        return [{"id": r[0], "name": r[1], "created_at": str(r[2])} for r in rows]
+
+    async def create_location(self, location_name: str) -> Dict:
+        async with self.connection() as conn:
+            cur = await conn.execute(
+                "INSERT INTO locations (location_name) VALUES (%s) RETURNING id, location_name",
+                (location_name,)
+            )
+            row = await cur.fetchone()
+        return {"id": row[0], "name": row[1]}
+
+    async def load_location(self, location_id: int, feature_filter: Optional[FeatureFilter] = None
+                            ) -> Optional[Tuple[str, List[Dict], Optional[str], int]]:
+        """(location name, active layer features, next page cursor, location version), or None when the
+        location does not exist"""
+        feature_filter = feature_filter or FeatureFilter()
+        async with self.connection() as conn:
+            async with conn.pipeline():
+                location_cur = await conn.execute(LOCATION_BY_ID_SQL, (location_id,), prepare=True)
+                layers_cur = await _execute_features(conn, location_id, feature_filter)
+            row = await location_cur.fetchone()
+            if not row:
+                return None
+            rows = await layers_cur.fetchall()
+            return row[1], _layer_features(rows), feature_filter.next_cursor(rows), row[2]
+
+    async def location_version(self, location_id: int) -> Optional[int]:
+        async with self.connection() as conn:
+            cur = await conn.execute(LOCATION_VERSION_SQL, (location_id,), prepare=True)
+            row = await cur.fetchone()
+        return row[0] if row else None
+
+    # Layers and features
+
+    async def load_layer_features(self, location_id: Optional[int] = None,
+                                  feature_filter: Optional[FeatureFilter] = None) -> Tuple[List[Dict], Optional[str]]:
+        """(active layer features, next page cursor); the filter is evaluated in SQL"""
+        feature_filter = feature_filter or FeatureFilter()
+        async with self.connection() as conn:
+            cur = await _execute_features(conn, location_id, feature_filter)
+            rows = await cur.fetchall()
+            return _layer_features(rows), feature_filter.next_cursor(rows)
+
+    async def load_facilities(self, location_id: int) -> List[Dict]:
+        """Active features of a location with a positive net explosive weight"""
+        async with self.connection() as conn:
+            cur = await conn.execute(FACILITIES_BY_LOCATION_SQL, (location_id,), prepare=True)
+            return _layer_features(await cur.fetchall())
+
+    async def vector_tile(self, params: Dict[str, Any]) -> bytes:
+        """Mapbox Vector Tile of a location's features and the given arcs (see vector_tiles.tile_params)"""
+        async with self.connection() as conn:
+            cur = await conn.execute(TILE_SQL, params, prepare=True)
+            return bytes((await cur.fetchone())[0])
+
+    async def save_layer(self, layer_name: str, features: List[Dict],
+                         location_id: Optional[int] = None) -> Tuple[str, int, int]:
+        """Insert or replace a named layer and its feature rows; returns (stored layer name, layer id, version)"""
+        layer_config = Jsonb({"type": "FeatureCollection"})
+        async with self.connection() as conn:
+            existing = None
+            if location_id:
+                cur = await conn.execute("""
+                    SELECT id FROM map_layers
+                    WHERE name = %s AND location_id = %s AND is_active = TRUE
+                """, (layer_name, location_id))
+                existing = await cur.fetchone()
+            if existing:
+                layer_id = existing[0]
+                cur = await conn.execute("""
+                    UPDATE map_layers SET layer_config = %s, version = version + 1
+                    WHERE id = %s
+                    RETURNING version
+                """, (layer_config, layer_id))
+                version = (await cur.fetchone())[0]
+                await conn.execute("DELETE FROM features WHERE layer_id = %s", (layer_id,))
+            else:
+                # Layers without a location get a random suffix to keep names unique
+                if location_id is None:
+                    layer_name = f"{layer_name}_{random.randint(1000, 9999)}"
+                cur = await conn.execute("""
+                    INSERT INTO map_layers (name, layer_config, location_id, is_active)
+                    VALUES (%s, %s, %s, TRUE)
+                    RETURNING id, version
+                """, (layer_name, layer_config, location_id))
+                layer_id, version = await cur.fetchone()
+
+            async with conn.cursor() as cur:
+                await cur.executemany(INSERT_FEATURE_SQL, [
+                    _feature_row(feature, layer_id, location_id, position)
+                    for position, feature in enumerate(features)
+                ])
+            await _bump_location_version(conn, location_id)
+            return layer_name, layer_id, version
+
+    async def patch_layer(self, layer_id: int, base_version: int, added: List[Dict] = (),
+                          modified: List[Dict] = (), deleted: List[Any] = ()) -> Tuple[int, Optional[int]]:
+        """Apply added, modified and deleted features to a layer in one transaction.
+
+        Features are matched by id. The patch is rejected with
+        LayerVersionConflict when the layer is no longer at `base_version`,
+        or when it adds an id that exists or modifies one that does not.
+        Only the touched rows are written. Returns (new version, layer
+        location id).
+        """
+        validate_layer_patch(added, modified, deleted)
+        async with self.connection() as conn:
+            cur = await conn.execute("""
+                SELECT location_id, version FROM map_layers
+                WHERE id = %s AND is_active = TRUE
+                FOR UPDATE
+            """, (layer_id,))
+            row = await cur.fetchone()
+            if row is None:
+                raise LayerNotFound(f"Layer {layer_id} not found")
+            location_id, version = row
+            if version != base_version:
+                raise LayerVersionConflict(
+                    f"Layer {layer_id} is at version {version}, patch is based on {base_version}", version)
+
+            async with conn.pipeline():
+                existing_cur = await conn.execute("""
+                    SELECT feature_id FROM features WHERE layer_id = %s AND feature_id = ANY(%s)
+                """, (layer_id, [str(f["id"]) for f in added]))
+                position_cur = await conn.execute(
+                    "SELECT COALESCE(MAX(position), -1) FROM features WHERE layer_id = %s", (layer_id,))
+            clashes = [r[0] for r in await existing_cur.fetchall()]
+            if clashes:
+                raise LayerVersionConflict(f"Features already exist: {', '.join(clashes)}", version)
+            next_position = (await position_cur.fetchone())[0] + 1
+
+            async with conn.cursor() as cur:
+                if deleted:
+                    await cur.execute("DELETE FROM features WHERE layer_id = %s AND feature_id = ANY(%s)",
+                                      (layer_id, [str(feature_id) for feature_id in deleted]))
+                if modified:
+                    await cur.executemany(UPDATE_FEATURE_SQL, [
+                        update_params(_feature_row(feature, layer_id, location_id, 0)) for feature in modified
+                    ])
+                    if cur.rowcount != len(modified):
+                        raise LayerVersionConflict(f"Modified features are missing from layer {layer_id}", version)
+                if added:
+                    await cur.executemany(INSERT_FEATURE_SQL, [
+                        _feature_row(feature, layer_id, location_id, next_position + i)
+                        for i, feature in enumerate(added)
+                    ])
+                await cur.execute("UPDATE map_layers SET version = version + 1 WHERE id = %s RETURNING version",
+                                  (layer_id,))
+                version = (await cur.fetchone())[0]
+            await _bump_location_version(conn, location_id)
+            return version, location_id
+
+    async def update_feature_properties(self, feature_id: Any, properties: Dict,
+                                        location_id: Optional[int] = None) -> Optional[Tuple[int, Optional[int]]]:
+        """Replace the properties of the first active feature with this id.
+
+        Returns (layer id, location id) of the updated feature, or None when
+        none matches.
+
+        The row is found through the feature id index, scoped to one location
+        when `location_id` is given, so the cost does not grow with the
+        number of stored features.
+        """
+        if feature_id is None:
+            return None
+        location_filter = "AND f.location_id = %s" if location_id else ""
+        params = (Jsonb(properties), *typed_columns(properties), str(feature_id))
+        async with self.connection() as conn:
+            # The owning layer's version moves too, so patches based on the old state are rejected
+            cur = await conn.execute(f"""
+                WITH updated AS (
+                    UPDATE features
+                    SET properties = %s, net_explosive_weight = %s, hazard_division = %s, unit = %s
+                    WHERE id = (
+                        SELECT f.id FROM features f JOIN map_layers l ON l.id = f.layer_id
+                        WHERE f.feature_id = %s {location_filter} AND l.is_active = TRUE
+                        ORDER BY f.layer_id, f.position
+                        LIMIT 1
+                    )
+                    RETURNING layer_id
+                )
+                UPDATE map_layers SET version = version + 1
+                FROM updated WHERE map_layers.id = updated.layer_id
+                RETURNING map_layers.id, map_layers.location_id
+            """, params + (location_id,) if location_id else params, prepare=True)
+            row = await cur.fetchone()
+            if row is None:
+                return None
+            await _bump_location_version(conn, row[1])
+            return tuple(row)
+
+    # Bookmarks
+
+    async def list_bookmarks(self, location_id: Optional[int] = None) -> Dict[str, Any]:
+        async with self.connection() as conn:
+            if location_id:
+                cur = await conn.execute(BOOKMARKS_BY_LOCATION_SQL, (location_id,), prepare=True)
+            else:
+                cur = await conn.execute(BOOKMARKS_ALL_SQL, prepare=True)
+            return {name: data for name, data in await cur.fetchall()}
+
+    async def get_bookmark(self, name: str, location_id: Optional[int] = None) -> Optional[Any]:
+        async with self.connection() as conn:
+            if location_id:
+                cur = await conn.execute("""
+                    SELECT bookmark_data FROM map_bookmarks
+                    WHERE name = %s AND location_id = %s AND is_active = TRUE
+                """, (name, location_id))
+            else:
+                cur = await conn.execute("""
+                    SELECT bookmark_data FROM map_bookmarks
+                    WHERE name = %s AND is_active = TRUE
+                """, (name,))
+            row = await cur.fetchone()
+        return row[0] if row else None
+
+    async def save_bookmark(self, name: str, location_id: Optional[int], bookmark_data: Any) -> None:
+        async with self.connection() as conn:
+            if location_id:
+                cur = await conn.execute("""
+                    SELECT id FROM map_bookmarks
+                    WHERE name = %s AND location_id = %s AND is_active = TRUE
+                """, (name, location_id))
+            else:
+                cur = await conn.execute("""
+                    SELECT id FROM map_bookmarks
+                    WHERE name = %s AND location_id IS NULL AND is_active = TRUE
+                """, (name,))
+            row = await cur.fetchone()
+
+            if row:
+                await conn.execute("UPDATE map_bookmarks SET bookmark_data = %s WHERE id = %s",
+                                   (Jsonb(bookmark_data), row[0]))
+            elif location_id:
+                await conn.execute("""
+                    INSERT INTO map_bookmarks (name, location_id, bookmark_data, is_active)
+                    VALUES (%s, %s, %s, TRUE)
+                """, (name, location_id, Jsonb(bookmark_data)))
+            else:
+                await conn.execute("""
+                    INSERT INTO map_bookmarks (name, bookmark_data, is_active)
+                    VALUES (%s, %s, TRUE)
+                """, (name, Jsonb(bookmark_data)))
+            await _bump_location_version(conn, location_id)
+
+    async def delete_bookmark(self, name: str, location_id: Optional[int] = None) -> None:
+        async with self.connection() as conn:
+            if location_id:
+                await conn.execute("""
+                    UPDATE map_bookmarks SET is_active = FALSE
+                    WHERE name = %s AND location_id = %s
+                """, (name, location_id))
+            else:
+                await conn.execute("""
+                    UPDATE map_bookmarks SET is_active = FALSE
+                    WHERE name = %s AND location_id IS NULL
+                """, (name,))
+            await _bump_location_version(conn, location_id)
+
+
+repository = Repository()
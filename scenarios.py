@@ -0,0 +1,163 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Any
+
+import numpy as np
+
+from qd_engine import QDEngine, KFactorType
+from qd_spatial import GeometryIndex, feature_attributes
+
+logger = logging.getLogger(__name__)
+
+BASE_SCENARIO = "base"
+
+
+class ScenarioSet:
+    """A base feature set plus N deltas, sharing one geometry index.
+
+    Every feature that appears in any scenario (base features, added features
+    and re-drawn geometries) gets one slot in a combined GeometryIndex. Each
+    scenario is then just an active mask plus a per-slot NEW array over those
+    slots. Like analyze-location, every ES is held to the set's single
+    K-factor type.
+
+    A scenario delta may contain:
+      - "remove": list of feature ids to drop
+      - "add": list of GeoJSON features to add (barricades, new buildings, ...)
+      - "update": {feature_id: {"properties": {...}, "geometry": {...}}}, where
+        properties are merged into the base feature's properties
+      - "set_new": {feature_id: NEW in the feature's own unit}
+    """
+
+    def __init__(self, engine: QDEngine, base_features: List[Dict], scenarios: List[Dict],
+                 k_factor_type: str = KFactorType.IBD.value):
+        self.engine = engine
+        self.k_factor_type = k_factor_type
+        self.names = [s.get("name") or f"scenario_{i + 1}" for i, s in enumerate(scenarios)]
+
+        combined = []
+        owners = []  # -1 for base slots, scenario position for scenario-only slots
+        keys = []
+        for i, feature in enumerate(base_features):
+            combined.append(feature)
+            owners.append(-1)
+            keys.append(feature.get("id") or f"feature_{i}")
+
+        base_slot = {key: i for i, key in enumerate(keys)}
+        self._removed = []
+        self._property_updates = []
+        for s_pos, scenario in enumerate(scenarios):
+            removed = set(scenario.get("remove", []))
+            updates = {}
+            for j, feature in enumerate(scenario.get("add", [])):
+                combined.append(feature)
+                owners.append(s_pos)
+                keys.append(feature.get("id") or f"{self.names[s_pos]}_added_{j}")
+            new_overrides = scenario.get("set_new") or {}
+            changes = {fid: {} for fid in new_overrides}
+            changes.update(scenario.get("update") or {})
+            for feature_id, change in changes.items():
+                if feature_id not in base_slot:
+                    continue
+                base_feature = base_features[base_slot[feature_id]]
+                properties = dict(base_feature.get("properties") or {})
+                properties.update(change.get("properties") or {})
+                if feature_id in new_overrides:
+                    properties["net_explosive_weight"] = new_overrides[feature_id]
+                if change.get("geometry"):
+                    # A re-drawn feature replaces its base slot in this scenario
+                    removed.add(feature_id)
+                    combined.append({**base_feature, "geometry": change["geometry"], "properties": properties})
+                    owners.append(s_pos)
+                    keys.append(feature_id)
+                else:
+                    updates[feature_id] = properties
+            self._removed.append(removed)
+            self._property_updates.append(updates)
+
+        self.index = GeometryIndex(combined, engine, default_k_factor_type=k_factor_type)
+        self.owners = np.array([owners[p] for p in self.index.positions], dtype=np.intp)
+        self.keys = [keys[p] for p in self.index.positions]
+        self._slot_of_key = {}
+        for slot, key in enumerate(self.keys):
+            if self.owners[slot] == -1:
+                self._slot_of_key[key] = slot
+
+        # Per-scenario state arrays; position 0 is the base
+        self.states = [self._state(None)] + [self._state(i) for i in range(len(scenarios))]
+        self._compute_pairs()
+
+    def _state(self, s_pos: Optional[int]):
+        owners = self.owners
+        active = owners == -1
+        new_lbs = self.index.new_lbs.copy()
+        if s_pos is not None:
+            active = active | (owners == s_pos)
+            for key in self._removed[s_pos]:
+                slot = self._slot_of_key.get(key)
+                if slot is not None:
+                    active[slot] = False
+            for key, properties in self._property_updates[s_pos].items():
+                slot = self._slot_of_key.get(key)
+                if slot is not None:
+                    new_lbs[slot], _ = feature_attributes(properties, self.engine)
+        return active, new_lbs
+
+    def _compute_pairs(self):
+        """Find and measure every PES/ES pair any scenario could violate, once"""
+        max_new = np.max(np.stack([np.where(active, new_lbs, 0) for active, new_lbs in self.states]), axis=0)
+        self.k_factor = self.engine.get_k_factor(self.k_factor_type)
+
+        pes = np.flatnonzero(max_new > 0)
+        radii = self.k_factor * np.cbrt(max_new[pes])
+        self.pair_pes, self.pair_es, self.pair_distance = self.index.candidate_pairs(pes, radii)
+        logger.info(f"Scenario set: {len(self.index)} slots, {len(pes)} PES, {len(self.pair_pes)} candidate pairs")
+
+    def evaluate(self, position: int) -> Dict[str, Any]:
+        """Violations for one scenario (0 = base) using the shared pair distances"""
+        active, new_lbs = self.states[position]
+        pes, es, distance = self.pair_pes, self.pair_es, self.pair_distance
+        weights = new_lbs[pes]
+        # Same rounded K * NEW^(1/3) as QDEngine.calculate_safe_distance
+        required = np.round(self.k_factor * np.cbrt(weights), 2)
+        violating = active[pes] & active[es] & (weights > 0) & (distance < required)
+
+        violations = []
+        for p, e, d, r in zip(pes[violating], es[violating], distance[violating], required[violating]):
+            violations.append({
+                "facility_id": self.keys[p],
+                "feature_id": self.keys[e],
+                "distance": round(float(d), 2),
+                "required": float(r),
+                "deficiency": round(float(r - d), 2)
+            })
+        facilities = np.flatnonzero(active & (new_lbs > 0))
+        return {
+            "name": BASE_SCENARIO if position == 0 else self.names[position - 1],
+            "total_facilities": int(len(facilities)),
+            "total_violations": len(violations),
+            "facilities_in_violation": len({v["facility_id"] for v in violations}),
+            "violations": violations
+        }
+
+    def evaluate_all(self, max_workers: int = 4) -> Dict[str, Any]:
+        """Evaluate the base and every scenario, with per-scenario diffs against the base"""
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(self.evaluate, range(len(self.states))))
+
+        base = results[0]
+        base_pairs = {(v["facility_id"], v["feature_id"]) for v in base["violations"]}
+        for result in results[1:]:
+            pairs = {(v["facility_id"], v["feature_id"]) for v in result["violations"]}
+            result["diff"] = {
+                "violations_delta": result["total_violations"] - base["total_violations"],
+                "new_violations": [{"facility_id": f, "feature_id": e} for f, e in sorted(pairs - base_pairs, key=str)],
+                "resolved_violations": [{"facility_id": f, "feature_id": e} for f, e in sorted(base_pairs - pairs, key=str)]
+            }
+        return {"base": base, "scenarios": results[1:]}
+
+
+def evaluate_scenarios(engine: QDEngine, base_features: List[Dict], scenarios: List[Dict],
+                       k_factor_type: str = KFactorType.IBD.value, max_workers: int = 4) -> Dict[str, Any]:
+    """Evaluate N what-if deltas of a base site against one shared geometry index"""
+    return ScenarioSet(engine, base_features, scenarios, k_factor_type).evaluate_all(max_workers)
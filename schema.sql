@@ -93,7 +93,23 @@ CREATE TABLE map_layers (
     source_type VARCHAR(50),
     provider VARCHAR(100),
     layer_config JSONB,
-    is_active BOOLEAN DEFAULT true
+    is_active BOOLEAN DEFAULT true,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+-- Layer features, one row each
+CREATE TABLE features (
+    id BIGSERIAL PRIMARY KEY,
+    layer_id INTEGER NOT NULL REFERENCES map_layers(id) ON DELETE CASCADE,
+    location_id INTEGER,
+    position INTEGER NOT NULL,
+    feature_id TEXT,
+    geom GEOMETRY(GEOMETRY, 4326),
+    net_explosive_weight DOUBLE PRECISION NOT NULL DEFAULT 0,
+    hazard_division VARCHAR(20),
+    unit VARCHAR(20),
+    members JSONB NOT NULL DEFAULT '{}'::jsonb,
+    properties JSONB NOT NULL DEFAULT '{}'::jsonb
 );
 
 -- User preferences
@@ -135,6 +151,12 @@ CREATE INDEX idx_analysis_results_project ON analysis_results(project_id);
 CREATE INDEX idx_explosive_sites_facility ON explosive_sites(facility_id);
 CREATE INDEX idx_audit_logs_timestamp ON audit_logs(timestamp);
 CREATE INDEX idx_usage_metrics_recorded ON usage_metrics(recorded_at);
+CREATE INDEX idx_features_geom ON features USING GIST(geom);
+CREATE INDEX idx_features_layer ON features(layer_id, position);
+CREATE INDEX idx_features_location ON features(location_id, layer_id, position);
+CREATE INDEX idx_features_feature_lookup ON features(feature_id, layer_id, position);
+CREATE INDEX idx_features_location_feature ON features(location_id, feature_id, layer_id, position);
+CREATE INDEX idx_features_facilities ON features(location_id) WHERE net_explosive_weight > 0;
 
 -- Create materialized view for frequently accessed analysis data
 CREATE MATERIALIZED VIEW analysis_summary AS
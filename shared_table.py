@@ -0,0 +1,303 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, fields
+from multiprocessing import shared_memory
+from typing import List, Dict, Tuple, Optional, Any
+
+import numpy as np
+
+from qd_engine import QDEngine, KFactorType, get_engine
+from feature_table import FeatureTable
+
+logger = logging.getLogger(__name__)
+
+# Buffers are placed on cache-line boundaries inside the segment
+ALIGNMENT = 64
+# Tables kept published after their last analysis, and indexes kept per worker process
+SHARED_TABLES_RETAINED = 4
+WORKER_INDEXES_RETAINED = 4
+
+# FeatureTable fields that are plain numeric arrays; the rest are labels
+NUMERIC_FIELDS = tuple(
+    f.name for f in fields(FeatureTable)
+    if f.name not in ("ids", "names", "hazard_division_vocab", "layer_vocab")
+)
+
+
+@dataclass(frozen=True)
+class SharedTableHandle:
+    """Picklable description of a FeatureTable held in a shared memory segment.
+
+    `layout` lists (field, dtype, shape, byte offset) for every numeric
+    buffer; ids, names and vocabularies follow as one JSON blob at
+    `labels_offset`.
+    """
+    name: str
+    layout: Tuple[Tuple[str, str, Tuple[int, ...], int], ...]
+    labels_offset: int
+    labels_size: int
+
+    def attach(self) -> Tuple[FeatureTable, shared_memory.SharedMemory]:
+        """Map the segment and return a FeatureTable whose numeric arrays are views into it.
+
+        The caller must keep the returned SharedMemory alive as long as the
+        table is in use.
+        """
+        segment = shared_memory.SharedMemory(name=self.name)
+        columns = {
+            field: np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf, offset=offset)
+            for field, dtype, shape, offset in self.layout
+        }
+        labels = json.loads(bytes(segment.buf[self.labels_offset:self.labels_offset + self.labels_size]))
+        columns["ids"] = np.array(labels["ids"] + [None], dtype=object)[:-1]
+        columns["names"] = np.array(labels["names"] + [None], dtype=object)[:-1]
+        for vocab in ("hazard_division_vocab", "layer_vocab"):
+            columns[vocab] = labels[vocab]
+        return FeatureTable(**columns), segment
+
+
+class SharedFeatureTable:
+    """A FeatureTable copied once into shared memory, with reference-counted cleanup.
+
+    Worker processes attach through `handle` without copying or unpickling
+    the coordinate and attribute buffers. The segment is unlinked when the
+    last reference is released.
+    """
+
+    def __init__(self, table: FeatureTable):
+        layout = []
+        size = 0
+        for field in NUMERIC_FIELDS:
+            array = np.ascontiguousarray(getattr(table, field))
+            layout.append((field, array.dtype.str, array.shape, size))
+            size += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        labels = json.dumps({
+            # Raw ids, so numeric feature ids come back as numbers in the workers
+            "ids": list(table.ids),
+            "names": list(table.names),
+            "hazard_division_vocab": table.hazard_division_vocab,
+            "layer_vocab": table.layer_vocab
+        }, default=str).encode()
+
+        self._segment = shared_memory.SharedMemory(create=True, size=max(size + len(labels), 1))
+        for field, dtype, shape, offset in layout:
+            target = np.ndarray(shape, dtype=np.dtype(dtype), buffer=self._segment.buf, offset=offset)
+            target[...] = getattr(table, field)
+            del target
+        self._segment.buf[size:size + len(labels)] = labels
+
+        self.handle = SharedTableHandle(self._segment.name, tuple(layout), size, len(labels))
+        self.nbytes = self._segment.size
+        self._refs = 1
+        self._lock = threading.Lock()
+        logger.info(f"Published feature table to shared memory {self.handle.name} ({self.nbytes} bytes)")
+
+    @property
+    def released(self) -> bool:
+        return self._refs == 0
+
+    def acquire(self) -> 'SharedFeatureTable':
+        with self._lock:
+            if self._refs == 0:
+                raise RuntimeError("Shared feature table has already been released")
+            self._refs += 1
+        return self
+
+    def release(self) -> None:
+        """Drop one reference; the last one closes and unlinks the segment"""
+        with self._lock:
+            if self._refs == 0:
+                return
+            self._refs -= 1
+            if self._refs > 0:
+                return
+        self._segment.close()
+        self._segment.unlink()
+        logger.info(f"Released shared memory {self.handle.name}")
+
+    def __enter__(self) -> 'SharedFeatureTable':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class SharedTableRegistry:
+    """Shared feature tables by key (location and feature content).
+
+    Concurrent analyses of the same location share one segment, and the
+    `max_retained` most recently used tables stay published after their last
+    analysis so that worker processes can keep the indexes they built over
+    them. Each `acquire` must be paired with a `release` of the returned table.
+    """
+
+    def __init__(self, max_retained: int = SHARED_TABLES_RETAINED):
+        self.max_retained = max_retained
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key, table: FeatureTable) -> SharedFeatureTable:
+        with self._lock:
+            shared = self._tables.get(key)
+            if shared is not None and not shared.released:
+                self._tables.move_to_end(key)
+                return shared.acquire()
+            # The registry holds one reference of its own until the table is evicted
+            shared = SharedFeatureTable(table)
+            self._tables[key] = shared
+            evicted = []
+            while len(self._tables) > self.max_retained:
+                evicted.append(self._tables.popitem(last=False)[1])
+            shared.acquire()
+        for old in evicted:
+            old.release()
+        return shared
+
+    def clear(self) -> None:
+        with self._lock:
+            tables = list(self._tables.values())
+            self._tables.clear()
+        for shared in tables:
+            shared.release()
+
+    def __len__(self) -> int:
+        return len(self._tables)
+
+
+shared_tables = SharedTableRegistry()
+
+
+def _start_method_context():
+    """forkserver where available, else spawn: the server process is multithreaded, so it is never forked"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+class WorkerPool:
+    """One long-lived analysis process pool, grown on demand and shared by every request"""
+
+    def __init__(self):
+        self.max_workers = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get(self, max_workers: int) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None or max_workers > self.max_workers:
+                if self._executor is not None:
+                    # Work already submitted to the smaller pool still completes
+                    self._executor.shutdown(wait=False)
+                self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=_start_method_context())
+                self.max_workers = max_workers
+                logger.info(f"Started analysis worker pool with {max_workers} processes")
+            return self._executor
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor, self.max_workers = self._executor, None, 0
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+worker_pool = WorkerPool()
+
+# Per worker process: (table, engine, index, segment) by (segment name, site type, K-factor type)
+_worker_indexes = OrderedDict()
+
+
+def _worker_index(handle: SharedTableHandle, site_type: str, k_factor_type: str):
+    from qd_spatial import GeometryIndex
+
+    key = (handle.name, site_type, k_factor_type)
+    entry = _worker_indexes.get(key)
+    if entry is not None:
+        _worker_indexes.move_to_end(key)
+        return entry
+    table, segment = handle.attach()
+    engine = get_engine(site_type)
+    entry = (table, engine, GeometryIndex(table, engine, default_k_factor_type=k_factor_type), segment)
+    _worker_indexes[key] = entry
+    while len(_worker_indexes) > WORKER_INDEXES_RETAINED:
+        old_segment = _worker_indexes.popitem(last=False)[1][3]
+        try:
+            old_segment.close()
+        except BufferError:
+            # Views into it are still referenced; the mapping goes when they are collected
+            pass
+    return entry
+
+
+def _find_violations_chunk(handle: SharedTableHandle, site_type: str, k_factor_type: str,
+                           facility_rows: np.ndarray, safe_distances: np.ndarray) -> List[List[Dict]]:
+    table, engine, index, _ = _worker_index(handle, site_type, k_factor_type)
+    return engine.find_violations(table, facility_rows, safe_distances, k_factor_type=k_factor_type, index=index)
+
+
+def _chunk_tasks(engine: QDEngine, shared: SharedFeatureTable, facility_rows: np.ndarray,
+                 safe_distances: np.ndarray, k_factor_type: str, max_workers: int) -> List[Tuple]:
+    chunks = np.array_split(np.arange(len(facility_rows)), max_workers * 4)
+    return [
+        (shared.handle, engine.site_type, k_factor_type, facility_rows[c], safe_distances[c])
+        for c in chunks if len(c)
+    ]
+
+
+def _worker_count(max_workers: int, facilities: int) -> int:
+    return max(1, min(max_workers, facilities, os.cpu_count() or 1))
+
+
+def find_violations_parallel(engine: QDEngine, table: FeatureTable, facility_rows: np.ndarray,
+                             safe_distances: np.ndarray, k_factor_type: str = KFactorType.IBD.value,
+                             max_workers: int = 4, key: Optional[Any] = None) -> List[List[Dict]]:
+    """QDEngine.find_violations split over the shared worker pool, attached to one shared table.
+
+    The table is published to shared memory once (or reused from the
+    registry when `key` is given); only facility row chunks and violation
+    lists cross process boundaries. Workers keep the GeometryIndex they
+    built for a segment, so repeated analyses of a location skip it.
+    """
+    facility_rows = np.asarray(facility_rows, dtype=np.intp)
+    safe_distances = np.asarray(safe_distances, dtype=np.float64)
+    if len(facility_rows) == 0:
+        return []
+    max_workers = _worker_count(max_workers, len(facility_rows))
+
+    shared = shared_tables.acquire(key, table) if key is not None else SharedFeatureTable(table)
+    try:
+        tasks = _chunk_tasks(engine, shared, facility_rows, safe_distances, k_factor_type, max_workers)
+        parts = list(worker_pool.get(max_workers).map(_find_violations_chunk, *zip(*tasks)))
+    finally:
+        shared.release()
+
+    logger.info(f"Parallel violation check: {len(facility_rows)} facilities over {max_workers} workers")
+    return [v for part in parts for v in part]
+
+
+async def find_violations_parallel_async(engine: QDEngine, table: FeatureTable, facility_rows: np.ndarray,
+                                         safe_distances: np.ndarray, k_factor_type: str = KFactorType.IBD.value,
+                                         max_workers: int = 4, key: Optional[Any] = None) -> List[List[Dict]]:
+    """find_violations_parallel for request handlers: chunks are awaited, so the event loop keeps serving"""
+    facility_rows = np.asarray(facility_rows, dtype=np.intp)
+    safe_distances = np.asarray(safe_distances, dtype=np.float64)
+    if len(facility_rows) == 0:
+        return []
+    max_workers = _worker_count(max_workers, len(facility_rows))
+
+    loop = asyncio.get_running_loop()
+    shared = await loop.run_in_executor(
+        None, lambda: shared_tables.acquire(key, table) if key is not None else SharedFeatureTable(table))
+    try:
+        executor = worker_pool.get(max_workers)
+        tasks = _chunk_tasks(engine, shared, facility_rows, safe_distances, k_factor_type, max_workers)
+        parts = await asyncio.gather(*(loop.run_in_executor(executor, _find_violations_chunk, *task) for task in tasks))
+    finally:
+        shared.release()
+
+    logger.info(f"Parallel violation check: {len(facility_rows)} facilities over {max_workers} workers")
+    return [v for part in parts for v in part]
@@ -0,0 +1,291 @@
+import io
+import json
+import math
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Optional, Any
+
+import numpy as np
+import shapely
+
+from qd_engine import QDEngine, KFactorType, UnitType
+from qd_spatial import GeometryIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CELL_SIZE_FT = 50.0
+MAX_GRID_CELLS = 250000
+CLEARANCE_CACHE_SIZE = 32
+
+
+class ClearanceGrid:
+    """Raster of the maximum NEW that can be sited at each cell without violating existing ES"""
+
+    def __init__(self, values_lbs: np.ndarray, origin_x: float, origin_y: float,
+                 cell_size_ft: float, index: GeometryIndex):
+        self.values_lbs = values_lbs  # shape (rows, cols), row 0 is the southern edge
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+        self.cell_size_ft = cell_size_ft
+        self.index = index
+
+    @property
+    def shape(self):
+        return self.values_lbs.shape
+
+    def cell_centers(self) -> np.ndarray:
+        """Projected (x, y) centers of every cell, shape (rows, cols, 2)"""
+        rows, cols = self.values_lbs.shape
+        xs = self.origin_x + (np.arange(cols) + 0.5) * self.cell_size_ft
+        ys = self.origin_y + (np.arange(rows) + 0.5) * self.cell_size_ft
+        gx, gy = np.meshgrid(xs, ys)
+        return np.stack([gx, gy], axis=-1)
+
+    def lonlat_bounds(self) -> List[float]:
+        """[west, south, east, north] of the raster in degrees"""
+        rows, cols = self.values_lbs.shape
+        lon, lat = self.index.projection.inverse(
+            [self.origin_x, self.origin_x + cols * self.cell_size_ft],
+            [self.origin_y, self.origin_y + rows * self.cell_size_ft]
+        )
+        return [float(lon[0]), float(lat[0]), float(lon[1]), float(lat[1])]
+
+    def to_dict(self, engine: QDEngine, unit: str = UnitType.POUNDS.value) -> Dict[str, Any]:
+        """Serialize as a north-up array in the requested unit (null = unconstrained)"""
+        values = engine.convert_from_pounds(self.values_lbs[::-1], unit)
+        finite = values[np.isfinite(values)]
+        rows = [[float(v) if np.isfinite(v) else None for v in row] for row in np.round(values, 4)]
+        return {
+            "bounds": self.lonlat_bounds(),
+            "cell_size_ft": self.cell_size_ft,
+            "width": int(self.values_lbs.shape[1]),
+            "height": int(self.values_lbs.shape[0]),
+            "unit": unit,
+            "max_value": float(finite.max()) if finite.size else None,
+            "values": rows
+        }
+
+    def to_png(self) -> bytes:
+        """Render as a north-up grayscale PNG scaled on cube-root NEW (requires Pillow)"""
+        from PIL import Image
+
+        finite = np.isfinite(self.values_lbs)
+        scaled = np.zeros(self.values_lbs.shape, dtype=np.float64)
+        if finite.any():
+            roots = np.cbrt(np.where(finite, self.values_lbs, 0))
+            top = roots.max() or 1.0
+            scaled = np.where(finite, roots / top, 1.0)
+        image = Image.fromarray((scaled[::-1] * 255).astype(np.uint8), mode="L")
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+
+def allowable_new(engine: QDEngine, index: GeometryIndex, xy: np.ndarray) -> np.ndarray:
+    """Maximum NEW (lbs) at each projected point: (d / K)^3 for the nearest ES and the index's K-factor type"""
+    points = shapely.points(xy[:, 0], xy[:, 1])
+    return np.power(index.nearest_distances(points) / engine.get_k_factor(index.default_k_factor_type), 3)
+
+
+def compute_clearance_grid(engine: QDEngine, features: List[Dict],
+                           k_factor_type: str = KFactorType.IBD.value,
+                           cell_size_ft: float = DEFAULT_CELL_SIZE_FT,
+                           padding_ft: float = 0.0,
+                           index: Optional[GeometryIndex] = None) -> ClearanceGrid:
+    """Compute the allowable NEW (lbs) at every cell of the features' bounding box.
+
+    The distance from every cell center to the nearest ES is found with one
+    STRtree nearest query; the allowable NEW is then (d / K)^3 for the
+    analysis K-factor type, which applies to every ES as in analyze-location.
+    """
+    if index is None:
+        index = GeometryIndex(features, engine, default_k_factor_type=k_factor_type)
+    if len(index) == 0:
+        raise ValueError("No features with geometry to build a clearance grid from")
+
+    minx, miny, maxx, maxy = index.bounds
+    minx, miny, maxx, maxy = minx - padding_ft, miny - padding_ft, maxx + padding_ft, maxy + padding_ft
+
+    # Coarsen the grid rather than exceed the cell budget
+    cell_size_ft = max(float(cell_size_ft), 1.0)
+    cols = max(int(np.ceil((maxx - minx) / cell_size_ft)), 1)
+    rows = max(int(np.ceil((maxy - miny) / cell_size_ft)), 1)
+    if rows * cols > MAX_GRID_CELLS:
+        cell_size_ft *= float(np.sqrt(rows * cols / MAX_GRID_CELLS))
+        cols = max(int(np.ceil((maxx - minx) / cell_size_ft)), 1)
+        rows = max(int(np.ceil((maxy - miny) / cell_size_ft)), 1)
+        logger.info(f"Clearance grid coarsened to {cell_size_ft:.1f} ft cells")
+
+    grid = ClearanceGrid(np.full((rows, cols), np.inf), minx, miny, cell_size_ft, index)
+    centers = grid.cell_centers().reshape(-1, 2)
+    grid.values_lbs = allowable_new(engine, index, centers).reshape(rows, cols)
+    logger.info(f"Computed {rows}x{cols} clearance grid at {cell_size_ft:.1f} ft")
+    return grid
+
+
+def features_digest(features: List[Dict]) -> str:
+    """Stable content hash of a feature list, used to key cached siting products"""
+    payload = json.dumps(features, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class ClearanceCache:
+    """Small LRU of clearance grids keyed by location and feature content"""
+
+    def __init__(self, max_entries: int = CLEARANCE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        grid = self._entries.get(key)
+        if grid is not None:
+            self._entries.move_to_end(key)
+        return grid
+
+    def put(self, key, grid: ClearanceGrid) -> None:
+        self._entries[key] = grid
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate_location(self, location_id) -> None:
+        for key in [k for k in self._entries if k[0] == location_id]:
+            del self._entries[key]
+
+
+clearance_cache = ClearanceCache()
+
+
+def get_clearance_grid(engine: QDEngine, features: List[Dict], location_id: Optional[int] = None,
+                       k_factor_type: str = KFactorType.IBD.value,
+                       cell_size_ft: float = DEFAULT_CELL_SIZE_FT,
+                       padding_ft: float = 0.0) -> ClearanceGrid:
+    """Return a cached clearance grid for this location version, computing it if needed"""
+    key = (location_id, features_digest(features), engine.site_type, k_factor_type,
+           float(cell_size_ft), float(padding_ft))
+    grid = clearance_cache.get(key)
+    if grid is None:
+        grid = compute_clearance_grid(engine, features, k_factor_type=k_factor_type,
+                                      cell_size_ft=cell_size_ft, padding_ft=padding_ft)
+        clearance_cache.put(key, grid)
+    return grid
+
+
+def _placement_margins(index: GeometryIndex, xy: np.ndarray, required: float):
+    """Clearance margin (ft) of each point and its distance to the nearest ES"""
+    distances = index.nearest_distances(shapely.points(xy[:, 0], xy[:, 1]))
+    return distances - required, distances
+
+
+def optimize_site_placement(engine: QDEngine, features: List[Dict], quantity: float,
+                            unit_type: str = UnitType.POUNDS.value,
+                            k_factor_type: str = KFactorType.IBD.value,
+                            max_results: int = 10,
+                            resolution_ft: float = 25.0,
+                            max_active_cells: int = 4096,
+                            search_bounds: Optional[List[float]] = None,
+                            index: Optional[GeometryIndex] = None) -> Dict[str, Any]:
+    """Search for points where a new PES of `quantity` clears every existing ES.
+
+    Sites are kept inside the installation footprint: `search_bounds` when
+    given, otherwise the convex hull of the features. Ranking by margin
+    alone would otherwise favour open ground outside the installation.
+
+    The footprint is covered by a coarse grid that is refined by quadrants.
+    Distance to the nearest ES is 1-Lipschitz, so a cell whose center margin is
+    below minus its half-diagonal cannot contain a feasible point and is pruned,
+    as is a cell farther than its half-diagonal from the footprint.
+    Surviving cells are capped at `max_active_cells` per level (best margins
+    first) to keep latency bounded. Returned sites are separated from each other
+    by at least IMD so the list can be used as a set of pads.
+    """
+    if index is None:
+        index = GeometryIndex(features, engine, default_k_factor_type=k_factor_type)
+    if len(index) == 0:
+        raise ValueError("No features with geometry to site against")
+
+    quantity_lbs = engine.convert_to_pounds(quantity, unit_type)
+    if quantity_lbs <= 0:
+        raise ValueError("Quantity must be positive")
+    cube_root_new = math.pow(quantity_lbs, 1 / 3)
+    required = round(engine.get_k_factor(index.default_k_factor_type) * cube_root_new, 2)
+
+    if search_bounds:
+        west, south, east, north = search_bounds
+        xs, ys = index.projection.forward([west, east], [south, north])
+        footprint = shapely.box(xs[0], ys[0], xs[1], ys[1])
+    else:
+        footprint = shapely.convex_hull(shapely.GeometryCollection(list(index.geometries)))
+    shapely.prepare(footprint)
+    minx, miny, maxx, maxy = footprint.bounds
+
+    resolution_ft = max(float(resolution_ft), 1.0)
+    cell_size = max(max(maxx - minx, maxy - miny) / 32, resolution_ft)
+    cols = max(int(np.ceil((maxx - minx) / cell_size)), 1)
+    rows = max(int(np.ceil((maxy - miny) / cell_size)), 1)
+    gx, gy = np.meshgrid(minx + (np.arange(cols) + 0.5) * cell_size,
+                         miny + (np.arange(rows) + 0.5) * cell_size)
+    centers = np.column_stack([gx.ravel(), gy.ravel()])
+
+    evaluated = 0
+    levels = 0
+    while True:
+        levels += 1
+        margins, distances = _placement_margins(index, centers, required)
+        evaluated += len(centers)
+
+        if cell_size <= resolution_ft:
+            feasible = (margins >= 0) & shapely.contains_xy(footprint, centers[:, 0], centers[:, 1])
+            centers, margins, distances = centers[feasible], margins[feasible], distances[feasible]
+            break
+
+        half_diagonal = cell_size * math.sqrt(2) / 2
+        inside = shapely.dwithin(footprint, shapely.points(centers[:, 0], centers[:, 1]), half_diagonal)
+        survivors = np.flatnonzero((margins + half_diagonal >= 0) & inside)
+        if len(survivors) > max_active_cells:
+            survivors = survivors[np.argsort(-margins[survivors], kind="stable")[:max_active_cells]]
+        if len(survivors) == 0:
+            centers = centers[:0]
+            margins = distances = np.empty(0)
+            break
+
+        quarter = cell_size / 4
+        offsets = np.array([[-quarter, -quarter], [quarter, -quarter], [-quarter, quarter], [quarter, quarter]])
+        centers = (centers[survivors][:, None, :] + offsets[None, :, :]).reshape(-1, 2)
+        cell_size /= 2
+
+    # Greedy selection of mutually IMD-separated sites, best margin first
+    separation = engine.get_k_factor(KFactorType.IMD.value) * cube_root_new
+    chosen = []
+    for i in np.argsort(-margins, kind="stable"):
+        if len(chosen) >= max_results:
+            break
+        if all(np.hypot(*(centers[i] - centers[j])) >= separation for j in chosen):
+            chosen.append(i)
+
+    chosen_xy = centers[chosen]
+    lon, lat = index.projection.inverse(chosen_xy[:, 0], chosen_xy[:, 1])
+    allowable_lbs = allowable_new(engine, index, chosen_xy)
+    candidates = []
+    for rank, i in enumerate(chosen):
+        candidates.append({
+            "rank": rank + 1,
+            "longitude": float(lon[rank]),
+            "latitude": float(lat[rank]),
+            "margin_ft": round(float(margins[i]), 2),
+            "governing_distance_ft": round(float(distances[i]), 2),
+            "allowable_new": round(float(engine.convert_from_pounds(allowable_lbs[rank], unit_type)), 4)
+        })
+
+    logger.info(f"Siting search: {evaluated} points over {levels} levels, {len(candidates)} sites returned")
+    return {
+        "quantity": quantity,
+        "unit": unit_type,
+        "required_distances_ft": {index.default_k_factor_type: required},
+        "pad_separation_ft": round(separation, 2),
+        "resolution_ft": resolution_ft,
+        "points_evaluated": evaluated,
+        "levels": levels,
+        "candidates": candidates
+    }
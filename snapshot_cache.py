@@ -0,0 +1,96 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Any
+
+SNAPSHOT_CACHE_SIZE = 256
+# Seconds a snapshot is served from memory alone; after that its version is
+# checked against the database (one indexed lookup) before it is reused, or
+# it is rebuilt when it has no version, so writes handled by another worker
+# process are picked up
+DEFAULT_SNAPSHOT_MAX_AGE = 5.0
+
+
+@dataclass
+class Snapshot:
+    """Serialized JSON response, its strong ETag (content hash) and the location version it was built from"""
+    body: bytes
+    version: Optional[int]
+    checked_at: float
+    etag: str = ""
+
+    def __post_init__(self):
+        if not self.etag:
+            self.etag = f'"{hashlib.sha1(self.body).hexdigest()}"'
+
+
+class SnapshotCache:
+    """LRU of assembled read responses keyed by (location id, resource, query variant).
+
+    Writes in this process call `invalidate_location`, which also bumps a
+    per-location generation: a snapshot assembled before the invalidation
+    is not stored. Entries keyed by location None span every location
+    (the location list, unscoped layer and bookmark reads), so they are
+    dropped by any invalidation.
+    """
+
+    def __init__(self, max_entries: int = SNAPSHOT_CACHE_SIZE, max_age: Optional[float] = None):
+        self.max_entries = max_entries
+        self.max_age = max_age if max_age is not None else float(
+            os.environ.get('QD_SNAPSHOT_MAX_AGE', DEFAULT_SNAPSHOT_MAX_AGE))
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._metrics = {"hits": 0, "misses": 0, "revalidated": 0, "stale": 0}
+
+    def generation(self, location_id) -> int:
+        return self._generations.get(location_id, 0)
+
+    def get(self, key) -> Optional[Snapshot]:
+        snapshot = self._entries.get(key)
+        if snapshot is None:
+            self._metrics["misses"] += 1
+        else:
+            self._entries.move_to_end(key)
+        return snapshot
+
+    def is_fresh(self, snapshot: Snapshot) -> bool:
+        return time.monotonic() - snapshot.checked_at < self.max_age
+
+    def revalidated(self, key, snapshot: Snapshot, version: Optional[int]) -> Optional[Snapshot]:
+        """The snapshot if `version` is still current, otherwise None (and it is dropped)"""
+        if version == snapshot.version:
+            snapshot.checked_at = time.monotonic()
+            self._metrics["revalidated"] += 1
+            return snapshot
+        self._metrics["stale"] += 1
+        self._entries.pop(key, None)
+        return None
+
+    def hit(self) -> None:
+        self._metrics["hits"] += 1
+
+    def put(self, key, body: bytes, version: Optional[int], generation: int) -> Snapshot:
+        """Store a snapshot unless its location was invalidated since `generation`; returns it either way"""
+        snapshot = Snapshot(body, version, time.monotonic())
+        if generation != self.generation(key[0]):
+            return snapshot
+        self._entries[key] = snapshot
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate_location(self, location_id) -> None:
+        for scope in {location_id, None}:
+            self._generations[scope] = self.generation(scope) + 1
+        for key in [k for k in self._entries if k[0] in (location_id, None)]:
+            del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._metrics, entries=len(self._entries),
+                    bytes=sum(len(s.body) for s in self._entries.values()), max_age=self.max_age)
+
+
+snapshot_cache = SnapshotCache()
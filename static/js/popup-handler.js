@@ -230,7 +230,8 @@ function saveFeatureToServer(feature) {
     },
     body: JSON.stringify({
       feature_id: feature.id,
-      properties: feature.properties
+      properties: feature.properties,
+      location_id: window.QDPro?.currentLocationId || null
     })
   })
   .then(response => response.json())
@@ -0,0 +1,145 @@
+import logging
+from datetime import datetime, timezone
+from typing import List, Dict, Any
+
+import numpy as np
+
+from qd_engine import QDEngine, KFactorType
+from feature_table import parse_net_explosive_weight
+from qd_spatial import GeometryIndex
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_time(value) -> datetime:
+    """Parse an ISO-8601 timestamp (a trailing Z is accepted) as an aware UTC datetime.
+
+    Timestamps without an offset are taken to be UTC, so naive and aware
+    records can be ordered together.
+    """
+    moment = value if isinstance(value, datetime) else datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def _runs(flags: np.ndarray):
+    """(start, end) row indices of each run of True in every column of a 2-D bool array.
+
+    `end` is exclusive and equals the row count when the run is still open.
+    """
+    padded = np.zeros((flags.shape[0] + 2, flags.shape[1]), dtype=np.int8)
+    padded[1:-1] = flags
+    edges = np.diff(padded, axis=0)
+    start_rows, start_cols = np.nonzero(edges == 1)
+    end_rows, end_cols = np.nonzero(edges == -1)
+    # nonzero is row-major, reorder both by column so runs pair up
+    start_order = np.lexsort((start_rows, start_cols))
+    end_order = np.lexsort((end_rows, end_cols))
+    return start_cols[start_order], start_rows[start_order], end_rows[end_order]
+
+
+def evaluate_inventory_timeline(engine: QDEngine, features: List[Dict], inventory: Dict[str, List[Dict]],
+                                k_factor_type: str = KFactorType.IBD.value) -> Dict[str, Any]:
+    """Intervals during which each ES is in violation as PES inventories change over time.
+
+    `inventory` maps a PES feature id (compared as a string, since JSON object
+    keys are strings) to a list of {"time", "net_explosive_weight", optional
+    "unit"} records; each record holds until the next one. Before its first
+    record a PES keeps the NEW from its feature properties. Timestamps
+    without an offset are read as UTC.
+
+    Geometry does not change over the timeline, so candidate pairs and their
+    distances are computed once. Every timestamp is then a vectorized
+    comparison of those distances against the required distances, held to the
+    single analysis K-factor type as in analyze-location.
+    """
+    index = GeometryIndex(features, engine, default_k_factor_type=k_factor_type)
+    units = index.table.units[index.positions]
+    slot_of_id = {}
+    for slot, feature_id in enumerate(index.ids):
+        slot_of_id.setdefault(str(feature_id), slot)
+
+    unknown = [pes_id for pes_id in inventory if str(pes_id) not in slot_of_id]
+    if unknown:
+        raise ValueError(f"Inventory refers to unknown features: {', '.join(map(str, unknown))}")
+
+    # Merge every record time into one sorted timeline
+    records = {}
+    times = {}
+    for pes_id, entries in inventory.items():
+        slot = slot_of_id[str(pes_id)]
+        unit_default = units[slot]
+        parsed = []
+        for entry in entries:
+            moment = _parse_time(entry["time"])
+            times.setdefault(moment, entry["time"])
+            unit = entry.get("unit") or unit_default
+            if unit not in engine.unit_conversions:
+                unit = "lbs"
+            parsed.append((moment, engine.convert_to_pounds(parse_net_explosive_weight(entry.get("net_explosive_weight")), unit)))
+        records[slot] = sorted(parsed, key=lambda r: r[0])
+
+    timeline = sorted(times)
+    if not timeline:
+        raise ValueError("Inventory timeline is empty")
+    labels = [times[t] for t in timeline]
+
+    # NEW of every tracked PES at every timestamp (forward filled)
+    slots = np.array(sorted(set(np.flatnonzero(index.is_pes)) | set(records)), dtype=np.intp)
+    weights = np.tile(index.new_lbs[slots], (len(timeline), 1))
+    timeline_pos = {t: i for i, t in enumerate(timeline)}
+    for col, slot in enumerate(slots):
+        for moment, value in records.get(slot, []):
+            weights[timeline_pos[moment]:, col] = value
+
+    # Pair distances, once
+    k_factor = engine.get_k_factor(k_factor_type)
+    peak = weights.max(axis=0)
+    active = peak > 0
+    pes_idx, es_idx, distances = index.candidate_pairs(slots[active], k_factor * np.cbrt(peak[active]))
+    limits = np.power(distances / k_factor, 3)
+
+    # Same rounded K * NEW^(1/3) as QDEngine.calculate_safe_distance
+    column_of_slot = {slot: col for col, slot in enumerate(slots)}
+    pair_columns = np.array([column_of_slot[p] for p in pes_idx], dtype=np.intp)
+    pair_weights = weights[:, pair_columns]
+    violating = (pair_weights > 0) & (distances[None, :] < np.round(k_factor * np.cbrt(pair_weights), 2))
+
+    def _intervals(flags: np.ndarray) -> List[List[Dict]]:
+        per_column = [[] for _ in range(flags.shape[1])]
+        for col, start, end in zip(*_runs(flags)):
+            per_column[col].append({
+                "start": labels[start],
+                "end": labels[end] if end < len(labels) else None
+            })
+        return per_column
+
+    pair_intervals = _intervals(violating)
+    pairs = []
+    for i in np.flatnonzero(violating.any(axis=0)):
+        pairs.append({
+            "facility_id": index.ids[pes_idx[i]],
+            "feature_id": index.ids[es_idx[i]],
+            "distance": round(float(distances[i]), 2),
+            "max_allowable_new_lbs": round(float(limits[i]), 2),
+            "intervals": pair_intervals[i]
+        })
+
+    exposed = np.unique(es_idx)
+    es_flags = np.zeros((len(timeline), len(exposed)), dtype=bool)
+    for col, es in enumerate(exposed):
+        es_flags[:, col] = violating[:, es_idx == es].any(axis=1)
+    es_intervals = _intervals(es_flags)
+    exposures = [
+        {"feature_id": index.ids[es], "intervals": es_intervals[col]}
+        for col, es in enumerate(exposed) if es_intervals[col]
+    ]
+
+    logger.info(f"Timeline analysis: {len(timeline)} timestamps, {len(pes_idx)} pairs, {len(exposures)} ES in violation")
+    return {
+        "timestamps": labels,
+        "pairs_evaluated": int(len(pes_idx)),
+        "violating_pairs": pairs,
+        "exposed_sites": exposures
+    }
@@ -40,10 +40,9 @@ def test_basic_calculation():
         
         logger.info(f"Generated {len(rings)} QD rings")
         
-        return True
     except Exception as e:
         logger.error(f"Test failed: {str(e)}")
-        return False
+        raise
 
 def test_fragment_calculation():
     """Test fragment distance calculation"""
@@ -57,10 +56,9 @@ def test_fragment_calculation():
         )
         
         logger.info(f"Fragment calculation result: {json.dumps(result, indent=2)}")
-        return True
     except Exception as e:
         logger.error(f"Fragment test failed: {str(e)}")
-        return False
+        raise
 
 def test_facility_analysis():
     """Test facility analysis functionality"""
@@ -108,10 +106,1049 @@ def test_facility_analysis():
         )
         
         logger.info(f"Facility analysis result: {json.dumps(result, indent=2)}")
-        return True
     except Exception as e:
         logger.error(f"Facility analysis test failed: {str(e)}")
-        return False
+        raise
+
+def _square(lng, lat, size=0.001):
+    """Closed square polygon geometry with its south-west corner at (lng, lat)"""
+    return {
+        "type": "Polygon",
+        "coordinates": [[[lng, lat], [lng + size, lat], [lng + size, lat + size], [lng, lat + size], [lng, lat]]]
+    }
+
+def test_clearance_grid():
+    """Test allowable NEW raster against a direct (d/K)^3 evaluation"""
+    from siting import compute_clearance_grid
+
+    engine = get_engine("DOD")
+    features = [
+        {"id": "bldg-1", "type": "Feature", "geometry": _square(-98.58, 39.83), "properties": {"name": "Admin"}},
+        {"id": "road-1", "type": "Feature",
+         "geometry": {"type": "LineString", "coordinates": [[-98.59, 39.82], [-98.59, 39.84]]},
+         "properties": {"name": "Route 1", "k_factor_type": KFactorType.PTRD.value}}
+    ]
+
+    grid = compute_clearance_grid(engine, features, cell_size_ft=250, padding_ft=1000)
+    centers = grid.cell_centers()
+    values = grid.values_lbs
+    assert values.shape == centers.shape[:2]
+
+    # Spot check one cell against brute force distances
+    row, col = values.shape[0] // 2, values.shape[1] // 2
+    x, y = centers[row, col]
+    from shapely.geometry import Point
+    point = Point(x, y)
+    road_d = grid.index.geometries[1].distance(point)
+    bldg_d = grid.index.geometries[0].distance(point)
+    # The road's own k_factor_type is ignored: every ES is held to the analysis type, as in analyze-location
+    expected = (min(bldg_d, road_d) / engine.get_k_factor("IBD")) ** 3
+    assert abs(values[row, col] - expected) < 1e-6 * max(expected, 1)
+
+    # Cells on top of the building cannot hold any explosives
+    assert values.min() == 0
+    result = grid.to_dict(engine, "kg")
+    assert result["unit"] == "kg" and len(result["values"]) == values.shape[0]
+    logger.info(f"Clearance grid {values.shape}, max allowable {result['max_value']} kg")
+
+def test_site_optimizer():
+    """Test that optimized sites clear every ES and are ranked by margin"""
+    from siting import optimize_site_placement
+    from shapely.geometry import Point
+
+    engine = get_engine("DOD")
+    features = [
+        {"id": f"bldg-{i}", "type": "Feature", "geometry": _square(-98.58 + i * 0.004, 39.83), "properties": {}}
+        for i in range(5)
+    ]
+
+    result = optimize_site_placement(engine, features, quantity=1000, max_results=5, resolution_ft=20)
+    candidates = result["candidates"]
+    assert candidates, "Expected at least one feasible site"
+
+    required = engine.get_k_factor("IBD") * 1000 ** (1 / 3)
+    margins = [c["margin_ft"] for c in candidates]
+    assert margins == sorted(margins, reverse=True)
+
+    from qd_spatial import GeometryIndex
+    from shapely.geometry import MultiPolygon
+    index = GeometryIndex(features, engine)
+    footprint = MultiPolygon(list(index.geometries)).convex_hull
+    for candidate in candidates:
+        x, y = index.projection.forward([candidate["longitude"]], [candidate["latitude"]])
+        nearest = min(g.distance(Point(x[0], y[0])) for g in index.geometries)
+        assert nearest >= required - 1e-6
+        assert candidate["allowable_new"] >= 1000
+        # Sites stay on the installation, not in the open ground around it
+        assert footprint.contains(Point(x[0], y[0]))
+
+def test_scenario_evaluation():
+    """Test what-if scenarios against a shared geometry index and their diffs"""
+    from scenarios import evaluate_scenarios
+
+    engine = get_engine("DOD")
+    magazine = {
+        "id": "mag-1", "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [-98.58, 39.83]},
+        "properties": {"name": "Magazine", "net_explosive_weight": 1000, "unit": "lbs"}
+    }
+    # 0.001 degree is ~364 ft with the engine's scale; IBD for 1000 lbs is 400 ft
+    office = {
+        "id": "office-1", "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [-98.58, 39.831]},
+        "properties": {"name": "Office"}
+    }
+
+    result = evaluate_scenarios(engine, [magazine, office], [
+        {"name": "smaller", "set_new": {"mag-1": 500}},
+        {"name": "demolish", "remove": ["office-1"]},
+        {"name": "new shed", "add": [{
+            "id": "shed-1", "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [-98.5805, 39.83]},
+            "properties": {"name": "Shed"}
+        }]}
+    ])
+
+    assert result["base"]["total_violations"] == 1
+    by_name = {s["name"]: s for s in result["scenarios"]}
+    assert by_name["smaller"]["total_violations"] == 0
+    assert by_name["smaller"]["diff"]["resolved_violations"] == [{"facility_id": "mag-1", "feature_id": "office-1"}]
+    assert by_name["demolish"]["total_violations"] == 0
+    assert by_name["new shed"]["total_violations"] == 2
+    assert by_name["new shed"]["diff"]["new_violations"] == [{"facility_id": "mag-1", "feature_id": "shed-1"}]
+
+def _analyze_location_violations(engine, features, k_factor_type="IBD"):
+    """(facility id, feature id, required) of every violation, computed as /api/analyze-location does"""
+    import numpy as np
+    from feature_table import FeatureTable
+
+    table = FeatureTable.from_features(features, engine)
+    rows = np.flatnonzero(table.new_values > 0)
+    safe_distances = [engine.calculate_safe_distance(float(table.new_values[r]), k_factor_type,
+                                                     table.units[r])["distance_ft"] for r in rows]
+    violations = engine.find_violations(table, rows, np.array(safe_distances), k_factor_type)
+    return sorted((table.ids[r], v["feature_id"], v["required"]) for r, found in zip(rows, violations) for v in found)
+
+def test_scenario_base_matches_analysis():
+    """Test that the base scenario reports exactly the analyze-location violations"""
+    from scenarios import evaluate_scenarios
+    from qd_spatial import LocalProjection
+
+    engine = get_engine("DOD")
+    feet_per_lat = LocalProjection(-98.58, 39.83).feet_per_degree_lat
+    features = [
+        {"id": "mag-1", "type": "Feature", "geometry": {"type": "Point", "coordinates": [-98.58, 39.83]},
+         "properties": {"name": "Magazine", "net_explosive_weight": 1000}},
+        {"id": "mag-2", "type": "Feature", "geometry": {"type": "Point", "coordinates": [-98.58, 39.826]},
+         "properties": {"name": "Magazine 2", "net_explosive_weight": 2, "unit": "kg"}},
+        # 300 ft away: inside IBD (400 ft) but outside PTRD (240 ft); the
+        # analysis K-factor type applies, not the feature's own
+        {"id": "road-1", "type": "Feature",
+         "geometry": {"type": "Point", "coordinates": [-98.58, 39.83 + 300 / feet_per_lat]},
+         "properties": {"name": "Route 1", "k_factor_type": KFactorType.PTRD.value}},
+        {"id": "office-1", "type": "Feature", "geometry": _square(-98.5805, 39.8265, 0.0005),
+         "properties": {"name": "Office"}}
+    ]
+
+    for k_factor_type in ("IBD", "PTRD"):
+        expected = _analyze_location_violations(engine, features, k_factor_type)
+        base = evaluate_scenarios(engine, features, [], k_factor_type=k_factor_type)["base"]
+        assert sorted((v["facility_id"], v["feature_id"], v["required"]) for v in base["violations"]) == expected
+    assert ("mag-1", "road-1", 400.0) in _analyze_location_violations(engine, features, "IBD")
+
+def test_encroachment_metrics():
+    """Test encroaching area and length of violating ES inside a QD arc"""
+    import math
+    from qd_spatial import annotate_encroachment, LocalProjection
+
+    engine = get_engine("DOD")
+    magazine = {
+        "id": "mag-1", "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [-98.58, 39.83]},
+        "properties": {"name": "Magazine", "net_explosive_weight": 1000}
+    }
+    offset_ft = 200
+    projection = LocalProjection(-98.58, 39.83)
+    offset_deg = offset_ft / projection.feet_per_degree_lat
+    road = {
+        "id": "road-1", "type": "Feature",
+        "geometry": {"type": "LineString", "coordinates": [[-98.59, 39.83 + offset_deg], [-98.58, 39.83 + offset_deg],
+                                                          [-98.57, 39.83 + offset_deg]]},
+        "properties": {"name": "Route 1"}
+    }
+    building = {
+        "id": "bldg-1", "type": "Feature", "geometry": _square(-98.58, 39.83 + offset_deg, 0.0005),
+        "properties": {"name": "Barracks"}
+    }
+    features = [magazine, road, building]
+
+    analysis = engine.analyze_facility(magazine, [road, building])
+    required = analysis["safe_distance"]
+    assert len(analysis["violations"]) == 2
+
+    annotate_encroachment(engine, features, [analysis])
+    by_id = {v["feature_id"]: v for v in analysis["violations"]}
+
+    # Chord of the arc at the road's offset, within polygonization error
+    chord = 2 * math.sqrt(required ** 2 - offset_ft ** 2)
+    assert abs(by_id["road-1"]["encroachment_length_ft"] - chord) < 0.02 * chord
+    assert by_id["road-1"]["encroachment_area_sqft"] == 0
+    assert 0 < by_id["bldg-1"]["encroachment_area_sqft"] < 0.0005 ** 2 * projection.feet_per_degree_lon * projection.feet_per_degree_lat
+
+def test_inventory_timeline():
+    """Test violation intervals over a changing PES inventory"""
+    from temporal_compliance import evaluate_inventory_timeline
+
+    engine = get_engine("DOD")
+    features = [
+        {"id": "mag-1", "type": "Feature", "geometry": {"type": "Point", "coordinates": [-98.58, 39.83]},
+         "properties": {"name": "Magazine", "net_explosive_weight": 100}},
+        # ~364 ft away: IBD is violated above (364 / 40)^3 ~ 754 lbs
+        {"id": "office-1", "type": "Feature", "geometry": {"type": "Point", "coordinates": [-98.58, 39.831]},
+         "properties": {"name": "Office"}}
+    ]
+    inventory = {"mag-1": [
+        {"time": "2026-01-01T00:00:00", "net_explosive_weight": 500},
+        {"time": "2026-01-05T00:00:00", "net_explosive_weight": 1000},
+        {"time": "2026-01-09T00:00:00", "net_explosive_weight": 200},
+        {"time": "2026-01-20T00:00:00", "net_explosive_weight": 2000}
+    ]}
+
+    result = evaluate_inventory_timeline(engine, features, inventory)
+    assert len(result["timestamps"]) == 4
+    assert result["exposed_sites"] == [{"feature_id": "office-1", "intervals": [
+        {"start": "2026-01-05T00:00:00", "end": "2026-01-09T00:00:00"},
+        {"start": "2026-01-20T00:00:00", "end": None}
+    ]}]
+    assert result["violating_pairs"][0]["facility_id"] == "mag-1"
+
+    # Numeric feature ids match their string inventory keys; naive times are UTC
+    features[0]["id"], features[1]["id"] = 17, 18
+    result = evaluate_inventory_timeline(engine, features, {"17": [
+        {"time": "2026-01-05T00:00:00Z", "net_explosive_weight": 1000},
+        {"time": "2026-01-04T00:00:00", "net_explosive_weight": 500},
+        {"time": "2026-01-06T03:00:00+02:00", "net_explosive_weight": 200}
+    ]})
+    assert result["timestamps"] == ["2026-01-04T00:00:00", "2026-01-05T00:00:00Z", "2026-01-06T03:00:00+02:00"]
+    assert result["exposed_sites"] == [{"feature_id": 18, "intervals": [
+        {"start": "2026-01-05T00:00:00Z", "end": "2026-01-06T03:00:00+02:00"}
+    ]}]
+
+def test_feature_table():
+    """Test columnar feature parsing and geometry round trip"""
+    import shapely
+    from shapely.geometry import shape
+    from feature_table import FeatureTable
+
+    engine = get_engine("DOD")
+    hole = [[-98.5797, 39.8303], [-98.5793, 39.8303], [-98.5793, 39.8307], [-98.5797, 39.8307], [-98.5797, 39.8303]]
+    features = [
+        {"id": "mag-1", "type": "Feature",
+         "geometry": {"type": "Polygon", "coordinates": [_square(-98.58, 39.83, 0.001)["coordinates"][0], hole]},
+         "properties": {"name": "Magazine", "net_explosive_weight": "2", "unit": "kg", "hazard_division": "1.3"}},
+        {"type": "Feature", "geometry": {"type": "MultiPoint", "coordinates": [[-98.57, 39.84], [-98.56, 39.85]]},
+         "properties": {"name": "Towers", "k_factor_type": "PTRD", "layerName": "Utilities"}},
+        {"id": "road-1", "type": "Feature",
+         "geometry": {"type": "LineString", "coordinates": [[-98.59, 39.83], [-98.58, 39.84]]},
+         "properties": {"name": "Route 1"}},
+        {"id": "note-1", "type": "Feature", "geometry": None, "properties": {"name": "Note"}}
+    ]
+
+    table = FeatureTable.from_features(features, engine)
+    assert list(table.ids) == ["mag-1", "feature_1", "road-1", "note-1"]
+    assert abs(table.new_lbs[0] - engine.convert_to_pounds(2, "kg")) < 1e-9
+    assert list(table.units) == ["kg", "lbs", "lbs", "lbs"]
+    assert list(table.hazard_divisions) == ["1.3", "1.1", "1.1", "1.1"]
+    assert list(table.has_geometry) == [True, True, True, False]
+    assert table.bbox[2].tolist() == [-98.59, 39.83, -98.58, 39.84]
+
+    geometries = table.geometries()
+    for feature, geometry in zip(features[:3], geometries[:3]):
+        assert shapely.equals(geometry, shape(feature["geometry"]))
+    assert geometries[3] is None
+    assert len(geometries[0].interiors) == 1
+
+def test_shared_feature_table():
+    """Test shared memory table attach, parallel violations and cleanup"""
+    import numpy as np
+    from multiprocessing import shared_memory
+    from feature_table import FeatureTable
+    import asyncio
+    from shared_table import (SharedFeatureTable, find_violations_parallel, find_violations_parallel_async,
+                              shared_tables, worker_pool)
+
+    engine = get_engine("DOD")
+    features = []
+    for i in range(6):
+        features.append({"id": f"mag-{i}", "type": "Feature", "geometry": _square(-98.58 + i * 0.002, 39.83, 0.0005),
+                         "properties": {"name": f"Magazine {i}", "net_explosive_weight": 500 * (i + 1)}})
+        features.append({"id": f"bldg-{i}", "type": "Feature", "geometry": _square(-98.58 + i * 0.002, 39.8315, 0.0005),
+                         "properties": {"name": f"Building {i}"}})
+    table = FeatureTable.from_features(features, engine)
+
+    with SharedFeatureTable(table) as shared:
+        attached, segment = shared.handle.attach()
+        assert np.array_equal(attached.coords, table.coords)
+        assert list(attached.ids) == list(table.ids)
+        del attached
+        segment.close()
+    try:
+        shared_memory.SharedMemory(name=shared.handle.name)
+        assert False, "segment should be unlinked after the last release"
+    except FileNotFoundError:
+        pass
+
+    rows = np.flatnonzero(table.new_values > 0)
+    safe = np.array([engine.calculate_safe_distance(v, "IBD", "lbs")["distance_ft"] for v in table.new_values[rows]])
+    serial = engine.find_violations(table, rows, safe)
+    parallel = find_violations_parallel(engine, table, rows, safe, max_workers=2, key=("test", 1))
+    assert serial == parallel
+    assert sum(len(v) for v in serial) > 0
+
+    # Later analyses reuse the pool and the published table
+    pool = worker_pool.get(2)
+    again = asyncio.run(find_violations_parallel_async(engine, table, rows, safe, max_workers=2, key=("test", 1)))
+    assert again == serial and worker_pool.get(2) is pool and len(shared_tables) == 1
+
+    # Numeric feature ids keep their type through the shared table
+    for i, feature in enumerate(features):
+        feature["id"] = i + 1
+    table = FeatureTable.from_features(features, engine)
+    serial = engine.find_violations(table, rows, safe)
+    parallel = find_violations_parallel(engine, table, rows, safe, max_workers=2, key=("test", 2))
+    assert serial == parallel
+    assert all(isinstance(v["feature_id"], int) for violations in parallel for v in violations)
+    worker_pool.shutdown()
+    shared_tables.clear()
+    assert len(shared_tables) == 0
+
+def test_out_of_core_analysis():
+    """Test tiled analysis from a feature file against the in-memory result"""
+    import os
+    import tempfile
+    import numpy as np
+    from feature_table import FeatureTable
+    from tiled_analysis import analyze_out_of_core, iter_geojson_file
+
+    engine = get_engine("DOD")
+    rng = np.random.default_rng(7)
+    features = []
+    for i in range(400):
+        properties = {"name": f"Feature {i}"}
+        if i % 8 == 0:
+            properties["net_explosive_weight"] = float(rng.integers(10, 5000))
+        lng, lat = -98.6 + rng.random() * 0.1, 39.8 + rng.random() * 0.1
+        features.append({"type": "Feature", "geometry": _square(lng, lat, 0.0002), "properties": properties})
+
+    with tempfile.NamedTemporaryFile("w", suffix=".geojsonl", delete=False) as f:
+        for feature in features:
+            f.write(json.dumps(feature) + "\n")
+    try:
+        result = analyze_out_of_core(engine, iter_geojson_file(f.name), memory_budget_mb=0.1, chunk_size=64)
+    finally:
+        os.unlink(f.name)
+    assert result["tiles_analyzed"] > 1
+    assert result["total_facilities"] == 50
+
+    table = FeatureTable.from_features(features, engine)
+    rows = np.flatnonzero(table.new_values > 0)
+    safe = np.array([engine.calculate_safe_distance(v, "IBD", "lbs")["distance_ft"] for v in table.new_values[rows]])
+    expected = {(table.ids[r], v["feature_id"]) for r, found in zip(rows, engine.find_violations(table, rows, safe))
+                for v in found}
+    tiled = {(r["facility_id"], v["feature_id"]) for r in result["facilities_analyzed"] for v in r["violations"]}
+    assert tiled == expected and result["total_violations"] == len(expected)
+
+def test_out_of_core_large_pes():
+    """Test that a PES spanning many tiles is checked against ES beyond its center tile"""
+    from qd_spatial import LocalProjection
+    from tiled_analysis import analyze_out_of_core
+
+    engine = get_engine("DOD")
+    projection = LocalProjection(-98.58, 39.83)
+    length = 14000 / projection.feet_per_degree_lon
+    width = 100 / projection.feet_per_degree_lat
+    strip = {"id": "pes-strip", "type": "Feature",
+             "geometry": {"type": "Polygon", "coordinates": [[[-98.58, 39.83], [-98.58 + length, 39.83],
+                                                              [-98.58 + length, 39.83 + width],
+                                                              [-98.58, 39.83 + width], [-98.58, 39.83]]]},
+             "properties": {"name": "Strip", "net_explosive_weight": 100}}
+    # 100 ft east of the far end of the strip; IBD for 100 lbs is 185.66 ft
+    es = {"id": "es-east", "type": "Feature",
+          "geometry": {"type": "Point", "coordinates": [-98.58 + length + 100 / projection.feet_per_degree_lon,
+                                                        39.83 + width / 2]},
+          "properties": {"name": "Office"}}
+
+    assert len(engine.analyze_facility(strip, [es])["violations"]) == 1
+    result = analyze_out_of_core(engine, [strip, es], tile_size_ft=1000)
+    assert result["tiles_analyzed"] > 1
+    assert result["total_violations"] == 1
+    assert result["facilities_analyzed"][0]["violations"][0]["feature_id"] == "es-east"
+
+def test_cluster_analysis():
+    """Test coordinator/worker tiled analysis against single-process tiling"""
+    import copy
+    import numpy as np
+    from distributed_analysis import analyze_cluster_local
+    from tiled_analysis import analyze_out_of_core
+
+    engine = get_engine("DOD")
+    rng = np.random.default_rng(11)
+    jobs = {}
+    for job, lng0 in (("north", -98.6), ("south", -97.0)):
+        features = []
+        for i in range(200):
+            properties = {"name": f"{job} {i}"}
+            if i % 8 == 0:
+                properties["net_explosive_weight"] = float(rng.integers(10, 5000))
+            point = [lng0 + rng.random() * 0.05, 39.8 + rng.random() * 0.05]
+            features.append({"type": "Feature", "geometry": {"type": "Point", "coordinates": point},
+                             "properties": properties})
+        jobs[job] = {"source": features, "site_type": "DOD"}
+
+    expected = {job: analyze_out_of_core(engine, copy.deepcopy(spec["source"]), memory_budget_mb=0.05)
+                for job, spec in jobs.items()}
+    result = analyze_cluster_local(jobs, workers=2, memory_budget_mb=0.05, timeout=60)
+
+    def _pairs(analysis):
+        return {(f["facility_id"], v["feature_id"]) for f in analysis["facilities_analyzed"] for v in f["violations"]}
+
+    for job in jobs:
+        assert result[job]["failed_tiles"] == 0
+        assert result[job]["tiles_analyzed"] == expected[job]["tiles_analyzed"] > 1
+        assert _pairs(result[job]) == _pairs(expected[job])
+
+def test_cluster_authkey():
+    """Test that remote coordinators and workers refuse to run without a shared key"""
+    import os
+    from unittest import mock
+    from distributed_analysis import AUTHKEY_ENV, cluster_authkey, run_worker
+
+    with mock.patch.dict(os.environ, {AUTHKEY_ENV: ""}):
+        for call in (cluster_authkey, lambda: run_worker(("localhost", 1))):
+            try:
+                call()
+                assert False, "expected a missing-key error"
+            except RuntimeError as e:
+                assert AUTHKEY_ENV in str(e)
+    with mock.patch.dict(os.environ, {AUTHKEY_ENV: "s3cret"}):
+        assert cluster_authkey() == b"s3cret"
+
+def test_overlapping_distances():
+    """Test that touching, crossing and contained geometries are 0 ft apart"""
+    engine = get_engine("DOD")
+    square = _square(-98.58, 39.83, 0.01)
+    inside = {"type": "Point", "coordinates": [-98.575, 39.835]}
+    across = {"type": "LineString", "coordinates": [[-98.59, 39.835], [-98.56, 39.835]]}
+    crossing = {"type": "LineString", "coordinates": [[-98.575, 39.82], [-98.575, 39.85]]}
+    assert engine.calculate_polygon_distance(square, inside) == 0
+    assert engine.calculate_polygon_distance(inside, square) == 0
+    assert engine.calculate_polygon_distance(across, crossing) == 0
+    # The line's vertices all lie outside the square, yet it passes through it
+    assert engine.calculate_polygon_distance(square, across) == 0
+    assert engine.calculate_polygon_distance(square, _square(-98.5, 39.83)) > 0
+
+def test_geodesic_distances():
+    """Test engine distances and QD rings in feet at different latitudes"""
+    import numpy as np
+    from geodesy import haversine_ft
+    from qd_spatial import GeometryIndex
+
+    # Haversine is spherical; the engine uses WGS84 degree lengths (within ~0.6%)
+    tolerance = 0.006
+    engine = get_engine("DOD")
+    for lat in (0.0, 39.83, 64.8):
+        # Edge-to-edge: nearest point of the square is the middle of its top edge
+        square = _square(-98.58, lat, 0.001)
+        point = {"type": "Point", "coordinates": [-98.5795, lat + 0.002]}
+        expected = haversine_ft(-98.5795, lat + 0.001, -98.5795, lat + 0.002)
+        assert abs(engine.calculate_polygon_distance(square, point) - expected) < tolerance * expected
+
+        # East-west distances shrink with latitude
+        east = {"type": "Point", "coordinates": [-98.57, lat]}
+        west = {"type": "Point", "coordinates": [-98.58, lat]}
+        expected = haversine_ft(-98.57, lat, -98.58, lat)
+        distance = engine.calculate_polygon_distance(east, west)
+        assert abs(distance - expected) < tolerance * expected
+        index = GeometryIndex([{"id": "e", "geometry": east}, {"id": "w", "geometry": west}], engine)
+        _, _, distances = index.candidate_pairs(np.array([0]), np.array([1e6]))
+        assert abs(distances[0] - distance) < 1e-6 * distance
+
+        # A 1000 ft ring stays 1000 ft from its center in every direction
+        ring = engine._create_circle_feature([-98.58, lat], 1000, 1.0, "", "", "IBD", "1.1")
+        vertices = np.array(ring["geometry"]["coordinates"][0])
+        radii = haversine_ft(-98.58, lat, vertices[:, 0], vertices[:, 1])
+        assert np.all(np.abs(radii - 1000) < tolerance * 1000)
+
+def test_calculation_cache():
+    """Test memoized QD calculations and their counters"""
+    from qd_engine import QDEngine
+
+    engine = QDEngine("DOD")
+    engine.calculation_cache.max_entries = 2
+    first = engine.calculate_safe_distance(1000, "IBD", "lbs")
+    again = engine.calculate_safe_distance(1000, "IBD", "lbs")
+    assert again == first and again is not first
+    # Same NEW in another unit shares the entry but echoes its own quantity and unit
+    in_kg = engine.calculate_safe_distance(500, "IBD", "kg")
+    in_lbs = engine.calculate_safe_distance(500 * 2.20462, "IBD", "lbs")
+    assert in_kg["distance_ft"] == in_lbs["distance_ft"]
+    assert (in_kg["unit_type"], in_kg["quantity_original"]) == ("kg", 500)
+    assert "500 kg" in in_kg["calculation_steps"] and "kg" not in in_lbs["calculation_steps"]
+    assert engine.calculate_arc_radius(1000) == first["distance_ft"]
+
+    stats = engine.calculation_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (2, 3, 1)
+    assert stats["entries"] == 2
+
+    # Nested results are copied too, so a caller's edits never reach the cache
+    risk = engine.calculate_safe_distance(1000, "IBD", "lbs", risk_based=True)
+    risk["risk_analysis"]["risk_distance"] = 0
+    assert engine.calculate_safe_distance(1000, "IBD", "lbs", risk_based=True)["risk_analysis"]["risk_distance"] > 0
+
+    engine.calculation_cache.clear()
+    hits = engine.calculation_cache.stats()["hits"]
+    engine.calculate_fragment_distance(500)
+    assert engine.calculate_fragment_distance(500, material_type="steel")["material_type"] == "steel"
+    assert engine.calculation_cache.stats()["hits"] == hits + 1
+    assert get_engine("dod") is get_engine("DOD")
+
+def test_arc_dissolve():
+    """Test dissolving overlapping QD arcs into one outline per group"""
+    from qd_engine import QDEngine, QDParameters, KFactorType, UnitType
+    from arc_dissolve import dissolve_arcs, get_dissolved_arcs, facility_arcs
+    from shapely.geometry import shape, Polygon
+
+    engine = QDEngine("DOD")
+    params = QDParameters(quantity=5000, unit_type=UnitType.POUNDS, k_factor_type=KFactorType.IBD.value,
+                          hazard_division="1.1")
+    results = []
+    for i, center in enumerate([[-98.580, 39.830], [-98.578, 39.830]]):
+        results.append({
+            "facility_id": f"pes_{i}",
+            "facility_centroid": center,
+            "qd_rings": engine.generate_k_factor_rings(center=center, parameters=params, k_factors=[1.0, 1.5])
+        })
+
+    dissolved = dissolve_arcs(results)
+    assert len(dissolved["features"]) == 2
+    for outline in dissolved["features"]:
+        assert outline["properties"]["facility_count"] == 2
+        assert outline["geometry"]["type"] == "Polygon"
+        merged = shape(outline["geometry"])
+        # Conservative: the outline covers every arc it replaces
+        for result in results:
+            for ring in result["qd_rings"]:
+                if ring["properties"]["k_factor"] == outline["properties"]["k_factor"]:
+                    assert merged.buffer(1e-9).contains(Polygon(ring["geometry"]["coordinates"][0]))
+
+    key, cached = get_dissolved_arcs(results)
+    assert get_dissolved_arcs(results)[1] is cached
+    assert len(facility_arcs(key, "pes_1")["pes_1"]) == 2
+    assert facility_arcs(key, "pes_1", "circle")["pes_1"][1]["k"] == 1.5
+    assert facility_arcs("missing") is None
+    try:
+        facility_arcs(key, "pes_9")
+        assert False, "unknown facility should raise KeyError"
+    except KeyError:
+        pass
+
+    # Numeric feature ids are fetched by their query-string form
+    numeric = [dict(r, facility_id=i + 1) for i, r in enumerate(results)]
+    numeric_key, _ = get_dissolved_arcs(numeric)
+    assert len(facility_arcs(numeric_key, "2")["2"]) == 2
+    assert facility_arcs(numeric_key, 2, "circle")["2"][1]["k"] == 1.5
+
+def test_circle_primitives():
+    """Test compact circle primitives for QD arcs"""
+    import numpy as np
+    from qd_engine import QDEngine, QDParameters, KFactorType, UnitType, circle_primitive
+
+    engine = QDEngine("DOD")
+    params = QDParameters(quantity=5000, unit_type=UnitType.POUNDS, k_factor_type=KFactorType.IBD.value,
+                          hazard_division="1.1")
+    center = [-98.58, 39.83]
+    rings = engine.generate_k_factor_rings(center=center, parameters=params, uncertainty=0.1)
+    primitives = [circle_primitive(center, ring) for ring in rings]
+
+    assert len(json.dumps(primitives)) * 10 < len(json.dumps(rings))
+    assert primitives[0] == {"center": center, "radius_ft": round(rings[0]["properties"]["radius"], 2),
+                             "k": 1.0, "type": "IBD", "hd": "1.1"}
+    assert sum(1 for p in primitives if p.get("uncertainty")) == 6
+
+    # Polygonized output is still available from a primitive
+    rebuilt = engine.circle_feature(primitives[0])
+    assert rebuilt["properties"]["label"] == rings[0]["properties"]["label"]
+    assert np.allclose(rebuilt["geometry"]["coordinates"][0], rings[0]["geometry"]["coordinates"][0])
+
+def test_coordinate_encoding():
+    """Test coordinate quantization and delta encoding of GeoJSON payloads"""
+    from geojson_encoding import encode_coordinates, decode_coordinates, DEFAULT_COORDINATE_PRECISION
+
+    ring = [[-98.58012345678901, 39.83098765432101], [-98.5791, 39.8309], [-98.5791, 39.8321],
+            [-98.58012345678901, 39.83098765432101]]
+    payload = {
+        "layers": {"type": "FeatureCollection", "features": [
+            {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [ring]},
+             "properties": {"name": "ES", "net_explosive_weight": 1234.56789012}},
+            {"type": "Feature", "geometry": {"type": "Point", "coordinates": [-98.5, 39.8]}, "properties": {}}
+        ]},
+        "facility_centroid": [-98.58012345678901, 39.83098765432101]
+    }
+
+    quantized = encode_coordinates(payload)
+    assert quantized["layers"]["features"][0]["geometry"]["coordinates"][0][0] == [-98.5801235, 39.8309877]
+    assert quantized["facility_centroid"] == [-98.5801235, 39.8309877]
+    # Properties are left untouched and the input is not modified
+    assert quantized["layers"]["features"][0]["properties"]["net_explosive_weight"] == 1234.56789012
+    assert payload["facility_centroid"][0] == -98.58012345678901
+    assert len(json.dumps(quantized)) < len(json.dumps(payload))
+
+    encoded = encode_coordinates(payload, delta=True)
+    deltas = encoded["layers"]["features"][0]["geometry"]["coordinates"][0]
+    assert deltas[0] == [-985801235, 398309877] and deltas[2] == [0, 12000]
+    assert encoded["layers"]["features"][1]["geometry"]["coordinates"] == [-985000000, 398000000]
+    assert decode_coordinates(encoded, DEFAULT_COORDINATE_PRECISION) == quantized
+
+    # Only geometries, centroids and circle centers are coordinates; caller data keeps its values
+    from geojson_encoding import validate_precision, MAX_DELTA_PRECISION
+    point = [-98.58012345678901, 39.83098765432101]
+    echoed = {
+        "features": [{"type": "Feature", "geometry": {"type": "Point", "coordinates": point},
+                      "properties": {"center": point, "coordinates": [[1.23456789012, 2.0]]}}],
+        "analysis_options": {"center": point, "coordinates": point},
+        "buffer_zones": [{"center": point, "radius_ft": 400.0, "k": 40, "type": "IBD", "hd": "1.1"}],
+        "map_view": {"center": point}
+    }
+    for delta in (False, True):
+        encoded = encode_coordinates(echoed, 5, delta)
+        assert encoded["features"][0]["properties"] == echoed["features"][0]["properties"]
+        assert encoded["analysis_options"] == echoed["analysis_options"]
+        assert encoded["map_view"] == echoed["map_view"]
+        assert encoded["buffer_zones"][0]["center"] == [-98.58012, 39.83099]
+        assert decode_coordinates(encoded, 5)["features"][0]["properties"] == echoed["features"][0]["properties"]
+    assert validate_precision(15) == 15 and validate_precision(MAX_DELTA_PRECISION, delta=True) == 9
+    try:
+        validate_precision(MAX_DELTA_PRECISION + 1, delta=True)
+        assert False, "expected an out-of-range precision error"
+    except ValueError:
+        pass
+
+def test_connection_pool():
+    """Test pooled connection reuse, bounds and lifetime"""
+    from types import SimpleNamespace
+    from psycopg2 import extensions
+    from db_pool import ConnectionPool, PoolTimeout
+
+    class FakeConnection:
+        def __init__(self):
+            self.closed = 0
+            self.statements = []
+            self.rollbacks = 0
+            self.info = SimpleNamespace(transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+
+        def cursor(self):
+            conn = self
+
+            class Cursor:
+                connection = conn
+
+                def execute(self, sql, params=None):
+                    conn.statements.append(sql)
+                    conn.info.transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+
+                def __enter__(self):
+                    return self
+
+                def __exit__(self, *exc):
+                    pass
+
+            return Cursor()
+
+        def rollback(self):
+            self.rollbacks += 1
+            self.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+        def close(self):
+            self.closed = 1
+
+    pool = ConnectionPool("postgresql://test", min_size=1, max_size=2, timeout=0.05,
+                          connect=lambda dsn: FakeConnection())
+    pool.open()
+    with pool.connection() as conn:
+        conn.cursor().execute("SELECT id FROM locations WHERE id = %s", (7,))
+    # Returned connections are rolled back and reused
+    assert conn.rollbacks == 1 and conn.info.transaction_status == extensions.TRANSACTION_STATUS_IDLE
+
+    first, second = pool.getconn(), pool.getconn()
+    assert first is conn and second is not conn
+    try:
+        pool.getconn()
+        assert False, "pool should be bounded"
+    except PoolTimeout:
+        pass
+    pool.putconn(second)
+
+    # Expired connections are replaced
+    pool.max_lifetime = 0
+    pool.putconn(first)
+    replacement = pool.getconn()
+    assert replacement not in (first, second) and first.closed and second.closed
+    pool.putconn(replacement)
+
+    stats = pool.stats()
+    assert stats["size"] == 1 and stats["in_use"] == 0 and stats["timeouts"] == 1
+    assert stats["expired"] == 2
+    pool.close()
+    assert pool.stats()["size"] == 0
+
+def test_feature_rows():
+    """Test splitting GeoJSON features into per-feature table rows"""
+    from feature_store import feature_row, typed_columns
+
+    feature = {
+        "type": "Feature", "id": 42, "layerName": "Facilities",
+        "geometry": {"type": "Point", "coordinates": [-98.58, 39.83]},
+        "properties": {"name": "ES", "net_explosive_weight": "1500", "hazard_division": "1.3", "unit": "kg"}
+    }
+    row = feature_row(feature, 7, 3, 12)
+    assert row[:4] == (7, 3, 12, "42")
+    assert json.loads(row[4]) == feature["geometry"]
+    assert row[5:8] == (1500.0, "1.3", "kg")
+    # Everything but geometry and properties is kept so the feature reads back unchanged
+    assert row[8] == {"type": "Feature", "id": 42, "layerName": "Facilities"}
+    assert dict(row[8], geometry=json.loads(row[4]), properties=row[9]) == feature
+
+    row = feature_row({"type": "Feature", "geometry": None, "properties": None}, 7, None, 0)
+    assert row[3] is None and row[4] is None and row[9] == {}
+    assert typed_columns({"net_explosive_weight": "bad"}) == (0.0, None, None)
+
+def test_layer_patch():
+    """Test validation and update rows of incremental layer patches"""
+    from feature_store import feature_row, update_params, validate_layer_patch
+
+    point = {"type": "Point", "coordinates": [-98.58, 39.83]}
+    added = [{"type": "Feature", "id": "a", "geometry": point, "properties": {}}]
+    modified = [{"type": "Feature", "id": 7, "geometry": point, "properties": {"net_explosive_weight": 10}}]
+    validate_layer_patch(added, modified, ["x"])
+
+    for bad in ((added, [], ["a"]), (modified, modified, []), ([{"geometry": point}], [], []), ([], [], [None])):
+        try:
+            validate_layer_patch(*bad)
+            assert False, "patch should be rejected"
+        except ValueError:
+            pass
+
+    params = update_params(feature_row(modified[0], 3, 9, 0))
+    assert params[1:4] == (10.0, None, None)
+    assert params[-2:] == (3, "7")
+
+def test_repository_helpers():
+    """Test repository row building, feature read dispatch and version bumps without a database"""
+    import asyncio
+    from psycopg.types.json import Jsonb
+    from feature_store import FeatureFilter, feature_row
+    from repository import (_bump_location_version, _execute_features, _feature_row, _layer_features,
+                            LAYERS_ALL_SQL, LAYERS_BY_LOCATION_SQL, LayerVersionConflict)
+
+    feature = {"type": "Feature", "id": "mag-1", "geometry": {"type": "Point", "coordinates": [-98.58, 39.83]},
+               "properties": {"name": "Magazine", "net_explosive_weight": 500, "unit": "kg"}}
+    row = _feature_row(feature, 3, 9, 4)
+    plain = feature_row(feature, 3, 9, 4)
+    # JSONB members are wrapped for psycopg, every other column is passed as is
+    assert row[:-2] == plain[:-2]
+    assert isinstance(row[-2], Jsonb) and row[-2].obj == plain[-2]
+    assert isinstance(row[-1], Jsonb) and row[-1].obj == feature["properties"]
+    assert _layer_features([(1, 0, feature), (1, 1, {"id": "b"})]) == [feature, {"id": "b"}]
+
+    class FakeConnection:
+        def __init__(self):
+            self.calls = []
+
+        async def execute(self, sql, params=None, prepare=None):
+            self.calls.append((sql, params, prepare))
+
+    async def _run():
+        conn = FakeConnection()
+        await _execute_features(conn, 9, FeatureFilter.from_query())
+        await _execute_features(conn, None, FeatureFilter.from_query())
+        await _execute_features(conn, 9, FeatureFilter.from_query(layers="Facilities"))
+        await _bump_location_version(conn, None)
+        await _bump_location_version(conn, 9)
+        return conn.calls
+
+    calls = asyncio.run(_run())
+    # Unfiltered reads are the prepared hot queries; filtered reads build their own SQL
+    assert calls[0] == (LAYERS_BY_LOCATION_SQL, (9,), True)
+    assert calls[1] == (LAYERS_ALL_SQL, None, True)
+    assert calls[2][0] not in (LAYERS_BY_LOCATION_SQL, LAYERS_ALL_SQL) and not calls[2][2]
+    assert len(calls) == 4 and calls[3][0].startswith("UPDATE locations SET version") and calls[3][1] == (9,)
+    assert LayerVersionConflict("stale", 5).current_version == 5
+
+def test_update_feature_properties():
+    """Test that property edits are scoped to the given location and report missing features"""
+    import asyncio
+    from contextlib import asynccontextmanager
+    from repository import Repository
+
+    # (feature id, location id, layer id) of the active features, in layer/position order
+    stored = [("mag-1", 1, 10), ("mag-1", 2, 20), ("road-1", 2, 21)]
+
+    class FakeCursor:
+        def __init__(self, row=None):
+            self.row = row
+
+        async def fetchone(self):
+            return self.row
+
+    class FakeConnection:
+        def __init__(self):
+            self.updates = []
+            self.bumped = []
+
+        async def execute(self, sql, params=None, prepare=None):
+            if sql.startswith("UPDATE locations SET version"):
+                self.bumped.append(params[0])
+                return FakeCursor()
+            # Stand-in for the single-row UPDATE: first active match of the id, within the location if scoped
+            location_id = params[5] if "f.location_id = %s" in sql else None
+            for feature_id, feature_location, layer_id in stored:
+                if feature_id == params[4] and location_id in (None, feature_location):
+                    self.updates.append((feature_id, feature_location, params[0].obj))
+                    return FakeCursor((layer_id, feature_location))
+            return FakeCursor()
+
+    class FakePool:
+        def __init__(self):
+            self.conn = FakeConnection()
+
+        @asynccontextmanager
+        async def connection(self):
+            yield self.conn
+
+    async def _update(*args):
+        repository = Repository()
+        repository.pool = FakePool()
+        return await repository.update_feature_properties(*args), repository.pool.conn
+
+    properties = {"name": "Magazine", "net_explosive_weight": 250}
+    updated, conn = asyncio.run(_update("mag-1", properties, 2))
+    assert updated == (20, 2) and conn.updates == [("mag-1", 2, properties)] and conn.bumped == [2]
+
+    # Unscoped edits take the first active feature with the id
+    updated, conn = asyncio.run(_update("mag-1", properties))
+    assert updated == (10, 1) and conn.bumped == [1]
+
+    # A feature of another location, an unknown location or an unknown id is not found, and nothing is written
+    for args in (("road-1", properties, 1), ("mag-1", properties, 99), ("missing", properties, 2),
+                 (None, properties, 2)):
+        updated, conn = asyncio.run(_update(*args))
+        assert updated is None and not conn.updates and not conn.bumped
+
+def test_migration_runner():
+    """Test that migrations apply once, in order, with concurrent index builds outside transactions"""
+    from migrations import MIGRATIONS, Migration, run_migrations
+
+    class FakeConnection:
+        def __init__(self, versions, busy_polls=0):
+            self.versions = list(versions)
+            self.autocommit = False
+            self.statements = []
+            self.commits = 0
+            self.busy_polls = busy_polls
+
+        def cursor(self):
+            conn = self
+
+            class Cursor:
+                def execute(self, sql, params=None):
+                    conn.statements.append((" ".join(sql.split()), conn.autocommit))
+                    if sql.startswith("INSERT INTO version_history"):
+                        conn.versions.append(params[0])
+                    self.rows = [(v,) for v in conn.versions] if sql.startswith("SELECT version") else []
+                    if sql.startswith("SELECT pg_try_advisory_lock"):
+                        # Another worker holds the lock for the first `busy_polls` attempts
+                        self.rows = [(conn.busy_polls == 0,)]
+                        conn.busy_polls = max(0, conn.busy_polls - 1)
+
+                def fetchall(self):
+                    return self.rows
+
+                def fetchone(self):
+                    return self.rows[0] if self.rows else None
+
+                def __enter__(self):
+                    return self
+
+                def __exit__(self, *exc):
+                    pass
+
+            return Cursor()
+
+        def commit(self):
+            self.commits += 1
+
+        def rollback(self):
+            pass
+
+    migrations = (
+        Migration("1.0.0", "Base"),
+        Migration("1.1.0", "Table", statements=("CREATE TABLE t (id INTEGER)",)),
+        Migration("1.2.0", "Index", transactional=False, indexes=(("idx_t", "ON t (id)"),))
+    )
+    conn = FakeConnection(["1.0.0"], busy_polls=2)
+    assert run_migrations(conn, migrations, poll_seconds=0) == ["1.1.0", "1.2.0"]
+    # Waiters poll in short autocommit statements instead of blocking inside one
+    polls = [autocommit for sql, autocommit in conn.statements if sql.startswith("SELECT pg_try_advisory_lock")]
+    assert polls == [True] * 3 and not any("pg_advisory_lock(" in sql for sql, _ in conn.statements)
+    assert conn.versions == ["1.0.0", "1.1.0", "1.2.0"]
+    assert ("CREATE TABLE t (id INTEGER)", False) in conn.statements and conn.commits == 1
+    assert ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_t ON t (id)", True) in conn.statements
+    assert conn.statements[-1][0].startswith("SELECT pg_advisory_unlock")
+
+    # A current schema only takes the lock and reads the version table
+    conn.statements.clear()
+    assert run_migrations(conn, migrations) == []
+    assert not any("CREATE TABLE t" in sql for sql, _ in conn.statements)
+
+    versions = [m.version for m in MIGRATIONS]
+    assert len(set(versions)) == len(versions) and versions == sorted(versions)
+    assert all(not m.indexes or not m.transactional for m in MIGRATIONS)
+
+def test_feature_filter():
+    """Test viewport, layer and field filters and keyset pages for feature reads"""
+    from feature_store import FeatureFilter
+
+    assert FeatureFilter.from_query().is_empty
+    feature_filter = FeatureFilter.from_query(bbox="-98.6,39.8,-98.5,39.9", layers="Facilities, Roads",
+                                              fields="name,net_explosive_weight", cursor="4:120", limit=500)
+    assert feature_filter.bbox == (-98.6, 39.8, -98.5, 39.9)
+    assert feature_filter.layers == ("Facilities", "Roads") and feature_filter.after == (4, 120)
+
+    sql, params = feature_filter.sql(location_id=7)
+    # Parameters follow the placeholders: sparse fields, location, bbox, layers, keyset, limit
+    assert sql.count("%s") == len(params)
+    assert params == [["name", "net_explosive_weight"], 7, -98.6, 39.8, -98.5, 39.9,
+                      ["Facilities", "Roads"], ["Facilities", "Roads"], 4, 120, 500]
+    assert "ST_MakeEnvelope" in sql and "(f.layer_id, f.position) > (%s, %s)" in sql
+
+    assert feature_filter.next_cursor([(4, 121, {})] * 499) is None
+    assert feature_filter.next_cursor([(4, 121, {})] * 499 + [(5, 3, {})]) == "5:3"
+
+    for bad in ({"bbox": "1,2,3"}, {"bbox": "3,2,1,4"}, {"cursor": "x"}, {"limit": 0}):
+        try:
+            FeatureFilter.from_query(**bad)
+            assert False, "filter should be rejected"
+        except ValueError:
+            pass
+
+def test_vector_tile_helpers():
+    """Test tile bounds, arc selection and cache invalidation for vector tiles"""
+    from qd_engine import QDEngine
+    from vector_tiles import (TileCache, tile_bounds, simplify_tolerance, validate_tile, tile_options,
+                              facility_points, facility_rings, arcs_in_tile, tile_params, ARC_K_FACTORS)
+
+    assert tile_bounds(0, 0, 0)[0] == -180.0 and abs(tile_bounds(0, 0, 0)[3] - 85.0511) < 1e-4
+    min_lon, min_lat, max_lon, max_lat = tile_bounds(14, 3705, 6212)
+    assert min_lon < -98.58 < max_lon and min_lat < 39.83 < max_lat
+    assert abs(simplify_tolerance(0) / simplify_tolerance(10) - 1024) < 1e-9
+    for bad in ((23, 0, 0), (2, 4, 0), (2, 0, -1)):
+        try:
+            validate_tile(*bad)
+            assert False, "tile should be rejected"
+        except ValueError:
+            pass
+    assert tile_options("dod", "ibd") == ("DOD", "IBD")
+    for bad in (("DOD", "IBD "), ("ARMY", "IBD"), ("DOD", "x" * 1000)):
+        try:
+            tile_options(*bad)
+            assert False, "tile options should be rejected"
+        except ValueError:
+            pass
+
+    engine = QDEngine("DOD")
+    arcs = facility_rings(engine, [("es_1", -98.58, 39.83, 5000.0, "lbs", "1.1"),
+                                   ("es_2", -98.0, 39.0, 100.0, None, None)])
+    assert len(arcs) == 2 * len(ARC_K_FACTORS) and arcs[3]["hd"] == "1.1"
+    assert arcs[1]["radius_ft"] == arcs[0]["radius_ft"] * ARC_K_FACTORS[1]
+    selected = arcs_in_tile(arcs, (min_lon, min_lat, max_lon, max_lat))
+    assert {a["facility_id"] for a in selected} == {"es_1"}
+    params = tile_params(7, 14, 3705, 6212, selected)
+    assert params["arc_ids"] == ["es_1"] * len(ARC_K_FACTORS) and params["tolerance"] == simplify_tolerance(14)
+
+    cache = TileCache(max_entries=2)
+    generation = cache.generation(7)
+    cache.put((7, 14, 1, 1), b"a", generation)
+    cache.put((8, 14, 1, 1), b"b", cache.generation(8))
+    assert cache.get((7, 14, 1, 1)) == b"a"
+    cache.invalidate_location(7)
+    assert cache.get((7, 14, 1, 1)) is None and cache.get((8, 14, 1, 1)) == b"b"
+    # A tile generated before the invalidation is not stored
+    cache.put((7, 14, 1, 1), b"stale", generation)
+    assert cache.get((7, 14, 1, 1)) is None
+
+    # Arc sets are an LRU too
+    cache = TileCache(max_arc_sets=2)
+    for version in (1, 2, 3):
+        cache.put_arcs((7, version, "DOD", "IBD"), arcs, cache.generation(7))
+    assert cache.get_arcs((7, 1, "DOD", "IBD")) is None and cache.stats()["arc_sets"] == 2
+
+    # Arcs share analyze-location's vertex-average center, not a point on the surface
+    from feature_table import FeatureTable
+    l_shape = {"type": "Polygon", "coordinates": [[[-98.58, 39.83], [-98.57, 39.83], [-98.57, 39.831],
+                                                   [-98.579, 39.831], [-98.579, 39.84], [-98.58, 39.84],
+                                                   [-98.58, 39.83]]]}
+    features = [{"type": "Feature", "id": "mag-1", "geometry": l_shape,
+                 "properties": {"net_explosive_weight": 200, "unit": "kg", "hazard_division": "1.3"}},
+                {"type": "Feature", "id": "office", "geometry": _square(-98.5, 39.8), "properties": {}}]
+    points = facility_points(engine, features)
+    centroid = FeatureTable.from_features(features, engine).centroids[0]
+    assert points == [("mag-1", centroid[0], centroid[1], 200.0, "kg", "1.3")]
+
+def test_snapshot_cache():
+    """Test location snapshot reuse, revalidation by version and invalidation"""
+    from snapshot_cache import SnapshotCache
+
+    cache = SnapshotCache(max_entries=2, max_age=60)
+    key = (7, 7, False, None)
+    cache.put(key, b'{"location_id": 7}', 3, cache.generation(7))
+    snapshot = cache.get(key)
+    assert snapshot.body == b'{"location_id": 7}' and cache.is_fresh(snapshot)
+
+    # Past max_age the version decides whether the snapshot is reused
+    cache.max_age = 0
+    assert not cache.is_fresh(snapshot)
+    assert cache.revalidated(key, snapshot, 3) is snapshot
+    assert cache.revalidated(key, snapshot, 4) is None and cache.get(key) is None
+
+    generation = cache.generation(7)
+    cache.put(key, b"old", 4, generation)
+    cache.invalidate_location(7)
+    assert cache.get(key) is None
+    # Assembled before the write, so it is not stored
+    cache.put(key, b"old", 4, generation)
+    assert cache.get(key) is None
+
+    for location_id in (1, 2, 3):
+        cache.put((location_id, 7, False, None), b"x", 0, cache.generation(location_id))
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["revalidated"] == 1 and stats["stale"] == 1
+
+def test_snapshot_etags():
+    """Test content-hash ETags and invalidation of cross-location snapshots"""
+    from snapshot_cache import SnapshotCache
+
+    cache = SnapshotCache(max_age=60)
+    first = cache.put((3, "bookmarks"), b'{"bookmarks": {}}', 1, cache.generation(3))
+    again = cache.put((3, "bookmarks"), b'{"bookmarks": {}}', 2, cache.generation(3))
+    changed = cache.put((3, "bookmarks"), b'{"bookmarks": {"a": 1}}', 3, cache.generation(3))
+    # Strong ETags follow the content, not the version
+    assert first.etag == again.etag != changed.etag and first.etag.startswith('"')
+
+    cache.put((None, "locations", False), b'{"locations": []}', None, cache.generation(None))
+    cache.put((4, "location"), b"{}", 0, cache.generation(4))
+    cache.invalidate_location(3)
+    assert cache.get((None, "locations", False)) is None and cache.get((3, "bookmarks")) is None
+    assert cache.get((4, "location")) is not None
 
 if __name__ == "__main__":
     logger.info("Starting QD engine tests")
@@ -119,13 +1156,43 @@ if __name__ == "__main__":
     tests = [
         ("Basic calculation", test_basic_calculation),
         ("Fragment calculation", test_fragment_calculation),
-        ("Facility analysis", test_facility_analysis)
+        ("Facility analysis", test_facility_analysis),
+        ("Clearance grid", test_clearance_grid),
+        ("Site optimizer", test_site_optimizer),
+        ("Scenario evaluation", test_scenario_evaluation),
+        ("Scenario base matches analysis", test_scenario_base_matches_analysis),
+        ("Encroachment metrics", test_encroachment_metrics),
+        ("Inventory timeline", test_inventory_timeline),
+        ("Feature table", test_feature_table),
+        ("Shared feature table", test_shared_feature_table),
+        ("Out-of-core analysis", test_out_of_core_analysis),
+        ("Out-of-core large PES", test_out_of_core_large_pes),
+        ("Cluster analysis", test_cluster_analysis),
+        ("Cluster authkey", test_cluster_authkey),
+        ("Overlapping distances", test_overlapping_distances),
+        ("Geodesic distances", test_geodesic_distances),
+        ("Calculation cache", test_calculation_cache),
+        ("Arc dissolve", test_arc_dissolve),
+        ("Circle primitives", test_circle_primitives),
+        ("Coordinate encoding", test_coordinate_encoding),
+        ("Connection pool", test_connection_pool),
+        ("Feature rows", test_feature_rows),
+        ("Layer patch", test_layer_patch),
+        ("Repository helpers", test_repository_helpers),
+        ("Feature property update", test_update_feature_properties),
+        ("Migration runner", test_migration_runner),
+        ("Feature filter", test_feature_filter),
+        ("Vector tile helpers", test_vector_tile_helpers),
+        ("Snapshot cache", test_snapshot_cache),
+        ("Snapshot ETags", test_snapshot_etags)
     ]
     
     for test_name, test_func in tests:
         logger.info(f"Running test: {test_name}")
-        result = test_func()
-        status = "PASSED" if result else "FAILED"
-        logger.info(f"Test {test_name}: {status}")
+        try:
+            test_func()
+            logger.info(f"Test {test_name}: PASSED")
+        except Exception as e:
+            logger.error(f"Test {test_name}: FAILED ({e!r})")
     
     logger.info("QD engine tests completed")
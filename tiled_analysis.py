@@ -0,0 +1,354 @@
+import json
+import logging
+import os
+import tempfile
+from itertools import islice
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator, Any
+
+import numpy as np
+
+from qd_engine import QDEngine, KFactorType
+from feature_table import FeatureTable
+from qd_spatial import GeometryIndex, LocalProjection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_BUDGET_MB = 512
+DEFAULT_CHUNK_SIZE = 10000
+MIN_TILE_SIZE_FT = 500.0
+# Tiles are laid out in one dataset-wide projection but analyzed in their
+# own; the halo is widened to cover the difference in scale between them
+HALO_PROJECTION_MARGIN = 0.02
+
+# Rough in-memory cost of one analyzed feature: parsed GeoJSON dict, shapely
+# geometry and index entry, plus the per-vertex cost of coordinates
+BYTES_PER_FEATURE = 4096
+BYTES_PER_VERTEX = 96
+
+
+def iter_geojson_file(path: str) -> Iterator[Dict]:
+    """Stream features from newline-delimited GeoJSON (or RFC 8142 text sequences).
+
+    A regular FeatureCollection file is accepted too, but has to be parsed whole.
+    """
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip().lstrip("\x1e")
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                # Not one feature per line: a pretty-printed FeatureCollection
+                f.seek(0)
+                yield from json.load(f).get("features", [])
+                return
+            if item.get("type") == "FeatureCollection":
+                yield from item.get("features", [])
+            else:
+                yield item
+
+
+def iter_location_features(location_id: int, database_url: Optional[str] = None) -> Iterator[Dict]:
+    """Stream a location's features from the database in batches of feature rows.
+
+    Uses a pooled connection unless an explicit `database_url` is given.
+    """
+    import psycopg2
+    from db_pool import db_pool
+    from feature_store import FEATURE_JSON_SQL
+
+    conn = psycopg2.connect(database_url) if database_url else db_pool.getconn()
+    try:
+        # Named cursor: rows are fetched from the server as they are consumed
+        cur = conn.cursor(name=f"tiled_features_{location_id}")
+        cur.itersize = 1000
+        cur.execute(f"""
+            SELECT {FEATURE_JSON_SQL} FROM features f JOIN map_layers l ON l.id = f.layer_id
+            WHERE f.location_id = %s AND l.is_active = TRUE
+            ORDER BY f.layer_id, f.position
+        """, (location_id,))
+        for (feature,) in cur:
+            yield feature
+        cur.close()
+    finally:
+        if database_url:
+            conn.close()
+        else:
+            db_pool.putconn(conn)
+
+
+def close_source(source: Iterable[Dict]) -> None:
+    """Close a feature generator, returning a pooled connection that iter_location_features still holds"""
+    close = getattr(source, "close", None)
+    if close is not None:
+        close()
+
+
+class FeatureSpool:
+    """Features spooled to a temporary newline-delimited JSON file with a byte-offset index"""
+
+    def __init__(self, directory: Optional[str] = None):
+        self._file = tempfile.TemporaryFile(mode="w+b", dir=directory)
+        self._offsets = [0]
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def extend(self, features: List[Dict]) -> None:
+        self._file.seek(0, os.SEEK_END)
+        for feature in features:
+            self._file.write(json.dumps(feature, separators=(",", ":")).encode())
+            self._file.write(b"\n")
+            self._offsets.append(self._file.tell())
+
+    def read(self, rows: np.ndarray) -> List[Dict]:
+        """Load the given rows (in ascending order) back into feature dicts"""
+        features = []
+        for row in np.sort(np.asarray(rows, dtype=np.int64)):
+            self._file.seek(self._offsets[row])
+            features.append(json.loads(self._file.read(self._offsets[row + 1] - self._offsets[row])))
+        return features
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _tile_memberships(bbox: np.ndarray, origin: Tuple[float, float], tile_size: float,
+                      shape: Tuple[int, int], halo: float) -> Tuple[np.ndarray, np.ndarray]:
+    """(feature, tile) pairs for every tile whose halo-expanded extent meets a feature's bbox"""
+    nx, ny = shape
+    ix0 = np.clip(np.floor((bbox[:, 0] - halo - origin[0]) / tile_size), 0, nx - 1).astype(np.int64)
+    iy0 = np.clip(np.floor((bbox[:, 1] - halo - origin[1]) / tile_size), 0, ny - 1).astype(np.int64)
+    ix1 = np.clip(np.floor((bbox[:, 2] + halo - origin[0]) / tile_size), 0, nx - 1).astype(np.int64)
+    iy1 = np.clip(np.floor((bbox[:, 3] + halo - origin[1]) / tile_size), 0, ny - 1).astype(np.int64)
+    span_x = ix1 - ix0 + 1
+    counts = span_x * (iy1 - iy0 + 1)
+    feature = np.repeat(np.arange(len(bbox)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    tile = (iy0[feature] + local // span_x[feature]) * nx + ix0[feature] + local % span_x[feature]
+    return feature, tile
+
+
+def plan_tiles(bbox: np.ndarray, costs: np.ndarray, halo: float, memory_budget_bytes: int,
+               tile_size_ft: Optional[float] = None) -> Dict[str, Any]:
+    """Choose a square tile grid over projected bboxes so each halo-expanded tile fits the budget.
+
+    Starting from one tile over the whole extent (or `tile_size_ft`), the
+    tile size is halved until the costliest tile fits or tiles get no
+    smaller than the halo, below which halo features dominate anyway.
+    """
+    minx, miny = bbox[:, 0].min(), bbox[:, 1].min()
+    maxx, maxy = bbox[:, 2].max(), bbox[:, 3].max()
+    extent = max(maxx - minx, maxy - miny, 1.0)
+    tile_size = float(tile_size_ft or extent)
+    floor = max(halo, MIN_TILE_SIZE_FT)
+
+    while True:
+        shape = (int(np.ceil((maxx - minx) / tile_size)) or 1, int(np.ceil((maxy - miny) / tile_size)) or 1)
+        feature, tile = _tile_memberships(bbox, (minx, miny), tile_size, shape, halo)
+        loads = np.bincount(tile, weights=costs[feature], minlength=shape[0] * shape[1])
+        if tile_size_ft or loads.max() <= memory_budget_bytes or tile_size / 2 < floor:
+            break
+        tile_size /= 2
+
+    if loads.max() > memory_budget_bytes:
+        logger.warning(f"Densest tile needs ~{loads.max() / 2**20:.0f} MB, above the "
+                       f"{memory_budget_bytes / 2**20:.0f} MB budget")
+    return {
+        "origin": (minx, miny),
+        "tile_size_ft": tile_size,
+        "shape": shape,
+        "feature": feature,
+        "tile": tile,
+        "peak_bytes": float(loads.max())
+    }
+
+
+def home_tiles(bbox: np.ndarray, plan: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """(feature, tile) pairs for every tile a bbox overlaps; a PES is analyzed in each of its home tiles.
+
+    Each tile holds every feature within one halo of its own extent, so the
+    home tiles of a PES together hold every feature within one halo of the
+    PES, however far its geometry extends. A pair found in more than one of
+    them is reported once by merge_tile_results.
+    """
+    return _tile_memberships(bbox, plan["origin"], plan["tile_size_ft"], plan["shape"], 0.0)
+
+
+class TiledDataset:
+    """A feature stream spooled to disk with the per-feature summary needed for tiling.
+
+    Only bboxes, NEW and vertex counts stay in memory (tens of bytes per
+    feature); full features are read back tile by tile. Features without an
+    id get "feature_<row>" so ids stay unique across tiles.
+    """
+
+    def __init__(self, engine: QDEngine, source: Iterable[Dict], chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 spool_dir: Optional[str] = None):
+        self.spool = FeatureSpool(spool_dir)
+        bboxes, new_lbs, indexed, vertices = [], [], [], []
+        source = iter(source)
+        row = 0
+        while True:
+            chunk = list(islice(source, chunk_size))
+            if not chunk:
+                break
+            for i, feature in enumerate(chunk):
+                if not feature.get("id"):
+                    feature["id"] = f"feature_{row + i}"
+            table = FeatureTable.from_features(chunk, engine)
+            self.spool.extend(chunk)
+            bboxes.append(table.bbox)
+            new_lbs.append(table.new_lbs)
+            indexed.append(table.has_geometry & ~table.is_qd_arc)
+            vertex_offsets = table.ring_offsets[table.part_ring_offsets[table.geom_part_offsets]]
+            vertices.append(np.diff(vertex_offsets))
+            row += len(chunk)
+
+        self.bbox = np.concatenate(bboxes) if bboxes else np.empty((0, 4))
+        self.new_lbs = np.concatenate(new_lbs) if new_lbs else np.empty(0)
+        self.indexed = np.concatenate(indexed) if indexed else np.empty(0, dtype=bool)
+        self.vertices = np.concatenate(vertices) if vertices else np.empty(0, dtype=np.int64)
+        self.projection = LocalProjection.from_bbox(self.bbox[self.indexed])
+        logger.info(f"Spooled {len(self)} features for tiled analysis")
+
+    def __len__(self) -> int:
+        return len(self.spool)
+
+    def projected_bbox(self) -> np.ndarray:
+        x0, y0 = self.projection.forward(self.bbox[:, 0], self.bbox[:, 1])
+        x1, y1 = self.projection.forward(self.bbox[:, 2], self.bbox[:, 3])
+        return np.column_stack([x0, y0, x1, y1])
+
+    def plan(self, engine: QDEngine, k_factor_type: str = KFactorType.IBD.value,
+             memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+             tile_size_ft: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Size the tile grid for this dataset; None when there is no PES to analyze"""
+        rows = np.flatnonzero(self.indexed)
+        pes_mask = self.new_lbs[rows] > 0
+        if not pes_mask.any():
+            return None
+        halo = engine.calculate_safe_distance(float(self.new_lbs[rows][pes_mask].max()), k_factor_type, "lbs")["distance_ft"]
+        bbox = self.projected_bbox()[rows]
+        costs = BYTES_PER_FEATURE + BYTES_PER_VERTEX * self.vertices[rows].astype(np.float64)
+        plan = plan_tiles(bbox, costs, halo * (1 + HALO_PROJECTION_MARGIN), int(memory_budget_mb * 2**20), tile_size_ft)
+        pes, home = home_tiles(bbox[pes_mask], plan)
+        plan.update(halo_ft=halo, rows=rows, home_rows=rows[pes_mask][pes], home_tiles=home)
+        return plan
+
+    def tiles(self, plan: Dict[str, Any]) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """(dataset rows, home PES mask) of every tile that homes at least one PES.
+
+        Rows are ascending, matching the order `spool.read` returns features in.
+        """
+        rows = plan["rows"]
+        home_order = np.argsort(plan["home_tiles"], kind="stable")
+        home_tiles_, home_starts = np.unique(plan["home_tiles"][home_order], return_index=True)
+        home_pes = dict(zip(home_tiles_.tolist(), np.split(plan["home_rows"][home_order], home_starts[1:])))
+
+        order = np.argsort(plan["tile"], kind="stable")
+        tiles, starts = np.unique(plan["tile"][order], return_index=True)
+        members = np.split(plan["feature"][order], starts[1:])
+        for tile, tile_members in zip(tiles.tolist(), members):
+            if tile not in home_pes:
+                continue
+            tile_rows = np.sort(rows[tile_members])
+            yield tile_rows, np.isin(tile_rows, home_pes[tile])
+
+    def close(self) -> None:
+        self.spool.close()
+
+
+def analyze_tile(engine: QDEngine, features: List[Dict], is_home: np.ndarray, k_factor_type: str,
+                 projection: Optional[LocalProjection] = None) -> List[Dict]:
+    """Facility results for the PES homed in one tile (`is_home`) against all of the tile's features.
+
+    By default the tile is projected around its own center, which keeps
+    distances accurate on regional datasets.
+    """
+    table = FeatureTable.from_features(features, engine)
+    index = GeometryIndex(table, engine, default_k_factor_type=k_factor_type, projection=projection)
+    rows = np.flatnonzero((table.new_values > 0) & np.asarray(is_home, dtype=bool))
+    units = table.units
+    safe_distances = np.array([
+        engine.calculate_safe_distance(float(table.new_values[r]), k_factor_type, units[r])["distance_ft"]
+        for r in rows
+    ])
+    violations = engine.find_violations(table, rows, safe_distances, k_factor_type, index=index)
+    return [
+        {
+            "facility_id": table.ids[r],
+            "facility_name": table.names[r] or "Unnamed Facility",
+            "net_explosive_weight": float(table.new_values[r]),
+            "unit": units[r],
+            "safe_distance": float(safe),
+            "violations": found
+        }
+        for r, safe, found in zip(rows, safe_distances, violations)
+    ]
+
+
+def merge_tile_results(tile_results: Iterable[List[Dict]]) -> List[Dict]:
+    """Merge per-tile facility results, dropping facility/feature pairs already reported"""
+    merged = {}
+    seen = set()
+    for results in tile_results:
+        for result in results:
+            target = merged.setdefault(result["facility_id"], dict(result, violations=[]))
+            for violation in result["violations"]:
+                pair = (result["facility_id"], violation["feature_id"])
+                if pair not in seen:
+                    seen.add(pair)
+                    target["violations"].append(violation)
+    return list(merged.values())
+
+
+def analyze_out_of_core(engine: QDEngine, source: Iterable[Dict], k_factor_type: str = KFactorType.IBD.value,
+                        memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB, tile_size_ft: Optional[float] = None,
+                        chunk_size: int = DEFAULT_CHUNK_SIZE, spool_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Facility violation analysis over a feature stream too large to hold in memory.
+
+    The stream is spooled to disk once, tiles are sized so a tile plus its
+    halo (the largest safe distance) fits `memory_budget_mb`, and each PES
+    is analyzed in the tiles its bbox overlaps, with pairs found in more
+    than one of them reported once.
+    """
+    try:
+        dataset = TiledDataset(engine, source, chunk_size=chunk_size, spool_dir=spool_dir)
+    finally:
+        close_source(source)
+    try:
+        summary = {
+            "total_features": len(dataset),
+            "total_facilities": int(np.count_nonzero(dataset.new_lbs > 0)),
+            "tiles_analyzed": 0,
+            "halo_ft": 0.0
+        }
+        plan = dataset.plan(engine, k_factor_type, memory_budget_mb, tile_size_ft)
+        if plan is None:
+            return dict(summary, total_violations=0, facilities_analyzed=[])
+
+        def _tiles():
+            for tile_rows, is_home in dataset.tiles(plan):
+                summary["tiles_analyzed"] += 1
+                yield analyze_tile(engine, dataset.spool.read(tile_rows), is_home, k_factor_type)
+
+        results = merge_tile_results(_tiles())
+    finally:
+        dataset.close()
+
+    logger.info(f"Out-of-core analysis: {summary['tiles_analyzed']} tiles of {plan['tile_size_ft']:.0f} ft, "
+                f"halo {plan['halo_ft']:.0f} ft")
+    return dict(summary, **tile_summary(plan), total_violations=sum(len(r["violations"]) for r in results),
+                facilities_analyzed=results)
+
+
+def tile_summary(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Reportable tiling parameters of a plan"""
+    return {
+        "halo_ft": plan["halo_ft"],
+        "tile_size_ft": plan["tile_size_ft"],
+        "tile_grid": list(plan["shape"]),
+        "peak_tile_bytes_estimate": plan["peak_bytes"]
+    }
@@ -0,0 +1,215 @@
+import logging
+import math
+from collections import OrderedDict
+from typing import List, Dict, Tuple, Optional, Any
+
+import numpy as np
+
+from qd_engine import QDEngine, KFactorType, SiteType
+from feature_table import FeatureTable
+
+logger = logging.getLogger(__name__)
+
+MAX_ZOOM = 22
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+TILE_CACHE_SIZE = 4096
+# Facility arc sets kept, one per (location, version, site type, K-factor type)
+ARC_CACHE_SIZE = 64
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+# Rings drawn per facility, as multiples of its safe distance (same as the analysis endpoint)
+ARC_K_FACTORS = (1.0, 1.25, 1.5)
+
+# Half the Web Mercator world width in meters
+MERCATOR_HALF_WORLD_M = 20037508.342789244
+FEET_TO_METERS = 0.3048
+
+# One tile with a `features` layer (stored features, simplified to about one
+# tile pixel) and a `qd_arcs` layer (rings computed in Python, passed as arrays)
+TILE_SQL = """
+    WITH bounds AS (
+        SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom,
+               ST_Transform(ST_TileEnvelope(%(z)s, %(x)s, %(y)s, margin => %(margin)s), 4326) AS filter_geom
+    ),
+    feature_rows AS (
+        SELECT f.feature_id AS id, f.members->>'layerName' AS layer_name, f.properties->>'name' AS name,
+               f.net_explosive_weight, f.unit, f.hazard_division,
+               ST_AsMVTGeom(ST_SimplifyPreserveTopology(ST_Transform(f.geom, 3857), %(tolerance)s),
+                            bounds.geom, %(extent)s, %(buffer)s, true) AS geom
+        FROM features f JOIN map_layers l ON l.id = f.layer_id, bounds
+        WHERE f.location_id = %(location_id)s AND l.is_active = TRUE AND f.geom && bounds.filter_geom
+    ),
+    arc_rows AS (
+        SELECT a.facility_id, a.k, a.type, a.hd, a.radius_ft,
+               ST_AsMVTGeom(ST_Transform(ST_Buffer(ST_SetSRID(ST_MakePoint(a.lon, a.lat), 4326)::geography,
+                                                   a.radius_ft * %(feet_to_meters)s, 'quad_segs=16')::geometry, 3857),
+                            bounds.geom, %(extent)s, %(buffer)s, true) AS geom
+        FROM unnest(%(arc_ids)s::text[], %(arc_k)s::float8[], %(arc_types)s::text[], %(arc_hds)s::text[],
+                    %(arc_lons)s::float8[], %(arc_lats)s::float8[], %(arc_radii)s::float8[])
+             AS a(facility_id, k, type, hd, lon, lat, radius_ft), bounds
+    )
+    SELECT COALESCE((SELECT ST_AsMVT(feature_rows.*, 'features', %(extent)s, 'geom')
+                     FROM feature_rows WHERE geom IS NOT NULL), ''::bytea)
+        || COALESCE((SELECT ST_AsMVT(arc_rows.*, 'qd_arcs', %(extent)s, 'geom')
+                     FROM arc_rows WHERE geom IS NOT NULL), ''::bytea)
+"""
+
+
+def validate_tile(z: int, x: int, y: int) -> None:
+    if not 0 <= z <= MAX_ZOOM:
+        raise ValueError(f"Zoom must be between 0 and {MAX_ZOOM}")
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise ValueError(f"Tile {z}/{x}/{y} is outside the tile grid")
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """(min_lon, min_lat, max_lon, max_lat) of an XYZ tile"""
+    n = 2 ** z
+
+    def _lat(row: float) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360.0 - 180.0, _lat(y + 1), (x + 1) / n * 360.0 - 180.0, _lat(y)
+
+
+def tile_options(site_type: str, k_factor_type: str) -> Tuple[str, str]:
+    """Validated, upper-cased (site type, K-factor type) of a tile request"""
+    site_type, k_factor_type = str(site_type).upper(), str(k_factor_type).upper()
+    if site_type not in {t.value for t in SiteType}:
+        raise ValueError(f"Unknown site type {site_type}")
+    if k_factor_type not in {t.value for t in KFactorType}:
+        raise ValueError(f"Unknown K-factor type {k_factor_type}")
+    return site_type, k_factor_type
+
+
+def simplify_tolerance(z: int) -> float:
+    """Simplification tolerance in Web Mercator meters: one tile pixel at this zoom"""
+    return 2 * MERCATOR_HALF_WORLD_M / (2 ** z) / TILE_EXTENT
+
+
+def facility_points(engine: QDEngine, features: List[Dict]) -> List[Tuple]:
+    """(feature id, lon, lat, NEW, unit, HD) of facility features.
+
+    Arcs are centered on the FeatureTable vertex-average centroid, the
+    same center analyze-location draws its rings around.
+    """
+    table = FeatureTable.from_features(features, engine)
+    rows = np.flatnonzero(table.has_geometry & (table.new_values > 0))
+    units, hazard_divisions = table.units, table.hazard_divisions
+    return [
+        (table.ids[row], float(table.centroids[row, 0]), float(table.centroids[row, 1]),
+         float(table.new_values[row]), units[row], hazard_divisions[row])
+        for row in rows
+    ]
+
+
+def facility_rings(engine: QDEngine, facilities: List[Tuple],
+                   k_factor_type: str = KFactorType.IBD.value) -> List[Dict[str, Any]]:
+    """QD rings for (feature id, lon, lat, NEW, unit, HD) facility rows"""
+    arcs = []
+    for feature_id, lon, lat, new_value, unit, hazard_division in facilities:
+        unit = unit if unit in engine.unit_conversions else "lbs"
+        try:
+            distance_ft = engine.calculate_safe_distance(quantity=new_value, k_factor_type=k_factor_type,
+                                                         unit_type=unit)["distance_ft"]
+        except Exception as e:
+            logger.warning(f"No QD arc for facility {feature_id}: {str(e)}")
+            continue
+        for k in ARC_K_FACTORS:
+            arcs.append({"facility_id": feature_id, "k": k, "type": k_factor_type, "hd": hazard_division or "1.1",
+                         "lon": lon, "lat": lat, "radius_ft": distance_ft * k})
+    return arcs
+
+
+def arcs_in_tile(arcs: List[Dict[str, Any]], bounds: Tuple[float, float, float, float]) -> List[Dict[str, Any]]:
+    """Arcs whose extent overlaps the tile bounds (lon/lat)"""
+    min_lon, min_lat, max_lon, max_lat = bounds
+    selected = []
+    for arc in arcs:
+        # Degree extents from a spherical earth, padded to stay conservative
+        dlat = arc["radius_ft"] * FEET_TO_METERS / 111000.0 * 1.01
+        dlon = dlat / max(math.cos(math.radians(min(abs(arc["lat"]) + dlat, 89.9))), 1e-6)
+        if (arc["lon"] + dlon >= min_lon and arc["lon"] - dlon <= max_lon
+                and arc["lat"] + dlat >= min_lat and arc["lat"] - dlat <= max_lat):
+            selected.append(arc)
+    return selected
+
+
+def tile_params(location_id: int, z: int, x: int, y: int, arcs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Parameters for TILE_SQL"""
+    return {
+        "location_id": location_id, "z": z, "x": x, "y": y,
+        "margin": TILE_BUFFER / TILE_EXTENT, "extent": TILE_EXTENT, "buffer": TILE_BUFFER,
+        "tolerance": simplify_tolerance(z), "feet_to_meters": FEET_TO_METERS,
+        "arc_ids": [a["facility_id"] for a in arcs], "arc_k": [a["k"] for a in arcs],
+        "arc_types": [a["type"] for a in arcs], "arc_hds": [a["hd"] for a in arcs],
+        "arc_lons": [a["lon"] for a in arcs], "arc_lats": [a["lat"] for a in arcs],
+        "arc_radii": [a["radius_ft"] for a in arcs]
+    }
+
+
+class TileCache:
+    """LRUs of encoded tiles and of the per-location facility arcs they are drawn from.
+
+    Keys start with (location id, location version), so a write made
+    through any worker retires the tiles cached before it. Each location
+    also has a generation number that `invalidate_location` bumps; a tile
+    computed under an older generation is not stored, so a save that lands
+    while a tile is being generated cannot leave a stale tile behind.
+    """
+
+    def __init__(self, max_entries: int = TILE_CACHE_SIZE, max_arc_sets: int = ARC_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.max_arc_sets = max_arc_sets
+        self._tiles = OrderedDict()
+        self._arcs = OrderedDict()
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self, location_id) -> int:
+        return self._generations.get(location_id, 0)
+
+    def get(self, key) -> Optional[bytes]:
+        tile = self._tiles.get(key)
+        if tile is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._tiles.move_to_end(key)
+        return tile
+
+    def put(self, key, tile: bytes, generation: int) -> None:
+        if generation != self.generation(key[0]):
+            return
+        self._tiles[key] = tile
+        self._tiles.move_to_end(key)
+        while len(self._tiles) > self.max_entries:
+            self._tiles.popitem(last=False)
+
+    def get_arcs(self, key) -> Optional[List[Dict[str, Any]]]:
+        arcs = self._arcs.get(key)
+        if arcs is not None:
+            self._arcs.move_to_end(key)
+        return arcs
+
+    def put_arcs(self, key, arcs: List[Dict[str, Any]], generation: int) -> None:
+        if generation != self.generation(key[0]):
+            return
+        self._arcs[key] = arcs
+        self._arcs.move_to_end(key)
+        while len(self._arcs) > self.max_arc_sets:
+            self._arcs.popitem(last=False)
+
+    def invalidate_location(self, location_id) -> None:
+        self._generations[location_id] = self.generation(location_id) + 1
+        for key in [k for k in self._tiles if k[0] == location_id]:
+            del self._tiles[key]
+        for key in [k for k in self._arcs if k[0] == location_id]:
+            del self._arcs[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"tiles": len(self._tiles), "arc_sets": len(self._arcs), "hits": self.hits, "misses": self.misses}
+
+
+tile_cache = TileCache()